@@ -7,7 +7,10 @@ import datetime
 import random
 import psycopg2
 import traceback
+import time
 import re
+import copy
+import threading
 import logging
 import sys
 from flask import Flask, request, jsonify, g, make_response
@@ -18,6 +21,7 @@ from datetime import datetime as dt, timedelta
 from psycopg2.extras import RealDictCursor, Json
 from supabase import create_client, Client
 from functools import wraps
+from collections import OrderedDict
 
 # IMPORT SCHEDULER LOGIC
 import scheduler_logic
@@ -76,6 +80,18 @@ limiter = Limiter(
 def ignore_options():
     return request.method == 'OPTIONS'
 
+# Portfolio scheduling (several seeds in worker processes, best roster kept)
+PORTFOLIO_MAX_SEEDS = int(os.environ.get("SCHEDULER_PORTFOLIO_MAX_SEEDS", 8))
+PORTFOLIO_TIME_BUDGET = float(os.environ.get("SCHEDULER_PORTFOLIO_TIME_BUDGET", 60))
+# Upper bound (seconds) for the optional local-search pass
+OPTIMIZE_MAX_BUDGET = float(os.environ.get("SCHEDULER_OPTIMIZE_MAX_BUDGET", 30))
+# Wall-clock limit (seconds) for one scheduler request; 0 = no limit. The run returns what it has by then.
+SCHEDULER_TIME_LIMIT = float(os.environ.get("SCHEDULER_TIME_LIMIT", 0))
+# Finished scheduler months kept for identical repeat requests (see scheduler_logic.input_fingerprint)
+SCHEDULER_CACHE_SIZE = int(os.environ.get("SCHEDULER_CACHE_SIZE", 32))
+# Longest season forecast (months) one simulate request may chain
+SIMULATION_MAX_MONTHS = int(os.environ.get("SCHEDULER_SIMULATION_MAX_MONTHS", 12))
+
 # ==========================================
 # 2. SUPABASE SETUP
 # ==========================================
@@ -115,6 +131,10 @@ def get_db():
 # ==========================================
 # Cache structure: { token: { 'auth_id': str, 'db_user': dict, 'expires': float } }
 TOKEN_CACHE = {}
+# Scheduler runs in progress in this process, by user id (see /api/services/run_scheduler/cancel);
+# one per user, a second request while one is running gets 409
+ACTIVE_SCHEDULER_RUNS = {}
+ACTIVE_SCHEDULER_RUNS_LOCK = threading.Lock()
 
 def require_auth(f):
     @wraps(f)
@@ -726,20 +746,104 @@ def queue_init_route(current_user):
         logger.error(f"Queue Init Error: {e}")
         return jsonify({"error": str(e)}), 500
 
+# ==========================================
+# SCHEDULER RESULT CACHE
+# ==========================================
+# { fingerprint: (first_day, last_day, rows, res_meta) }, least recently used first
+SCHEDULER_CACHE = OrderedDict()
+SCHEDULER_CACHE_LOCK = threading.Lock()
+# Routes whose writes change scheduler inputs (staff, duties, special dates, preferences, queues, schedule, unavailability)
+SCHEDULER_INPUT_ENDPOINTS = {'manage_users', 'manage_employees', 'schedule_route', 'queue_history_route', 'queue_init_route',
+                             's_unavail', 's_prefs', 'clear_schedule', 'config_route', 'special_dates_route'}
+
+def scheduler_cache_get(key):
+    with SCHEDULER_CACHE_LOCK:
+        entry = SCHEDULER_CACHE.get(key)
+        if entry is None: return None
+        SCHEDULER_CACHE.move_to_end(key)
+    return copy.deepcopy(entry[2]), copy.deepcopy(entry[3])
+
+def scheduler_cache_put(key, first, last, rows, res_meta):
+    entry = (first, last, copy.deepcopy(rows), copy.deepcopy(res_meta))
+    with SCHEDULER_CACHE_LOCK:
+        SCHEDULER_CACHE[key] = entry
+        SCHEDULER_CACHE.move_to_end(key)
+        while len(SCHEDULER_CACHE) > SCHEDULER_CACHE_SIZE: SCHEDULER_CACHE.popitem(last=False)
+
+def invalidate_scheduler_cache(day=None):
+    # Drops the months whose input window (day before to day after) contains `day`; everything when no day is given
+    with SCHEDULER_CACHE_LOCK:
+        for key, (first, last, _, _) in list(SCHEDULER_CACHE.items()):
+            if day is None or first - timedelta(days=1) <= day <= last + timedelta(days=1):
+                del SCHEDULER_CACHE[key]
+
+@app.after_request
+def invalidate_scheduler_cache_after_write(response):
+    # Keys already change with the data; this frees the entries a successful write made stale
+    if request.method in ('POST', 'PUT', 'DELETE') and request.endpoint in SCHEDULER_INPUT_ENDPOINTS and response.status_code < 400:
+        day = None
+        if request.endpoint == 's_unavail':
+            # A plain unavailability change only touches the months around its date; a repair also rewrites rows and queues
+            body = request.get_json(silent=True) or {}
+            date_str = body.get('date') if request.method == 'POST' and not body.get('repair') else request.args.get('date')
+            try:
+                day = dt.strptime(date_str, '%Y-%m-%d').date() if date_str else None
+            except ValueError:
+                day = None
+        invalidate_scheduler_cache(day)
+    return response
+
 @app.route('/api/services/run_scheduler', methods=['POST'])
 @require_auth
 def run_scheduler_route(current_user):
+    # One run per user: the cancel route finds it by user id, and a second run would also race on the same months
+    user_id = current_user.get('id')
+    cancel_token = scheduler_logic.CancelToken()
+    with ACTIVE_SCHEDULER_RUNS_LOCK:
+        if user_id in ACTIVE_SCHEDULER_RUNS:
+            return jsonify({"error": "A scheduler run is already in progress"}), 409
+        ACTIVE_SCHEDULER_RUNS[user_id] = cancel_token
+    try:
+        return run_scheduler_request(cancel_token)
+    finally:
+        with ACTIVE_SCHEDULER_RUNS_LOCK:
+            del ACTIVE_SCHEDULER_RUNS[user_id]
+
+def run_scheduler_request(cancel_token):
+    started = time.monotonic()
     try:
         req = request.json
         print(f"DEBUG: Input received: {req}", flush=True)
         
         is_valid, error = validate_input(req, {
             'start': {'type': str, 'regex': r'^\d{4}-\d{2}$'},
-            'end': {'type': str, 'regex': r'^\d{4}-\d{2}$'}
+            'end': {'type': str, 'regex': r'^\d{4}-\d{2}$'},
+            'log_level': {'type': str, 'regex': r'^(summary|phase|trace)$', 'optional': True},
+            'seed': {'type': int, 'optional': True},
+            'portfolio': {'type': int, 'optional': True},
+            'time_budget': {'type': (int, float), 'optional': True},
+            'balancer': {'type': str, 'regex': r'^(swap|flow)$', 'optional': True},
+            'optimize_budget': {'type': (int, float), 'optional': True},
+            'time_limit': {'type': (int, float), 'optional': True},
+            'daily_assign': {'type': str, 'regex': r'^(greedy|matching)$', 'optional': True},
+            'resume': {'type': bool, 'optional': True},
+            'save_partial': {'type': bool, 'optional': True},
+            'phases': {'type': (str, list), 'optional': True}
         })
         if not is_valid: 
             print(f"DEBUG: Validation failed: {error}", flush=True)
             return jsonify({"error": error}), 400
+        # A preset ('balance', 'sk') or stage names: touch-up of the stored schedule instead of a full run
+        phases = req.get('phases') or None
+        try:
+            scheduler_logic.resolve_stages(phases)
+        except ValueError as e:
+            return jsonify({"error": f"Field 'phases': {e}"}), 400
+        
+        portfolio = req.get('portfolio') or 1
+        if not 1 <= portfolio <= PORTFOLIO_MAX_SEEDS:
+            return jsonify({"error": f"Field 'portfolio' must be between 1 and {PORTFOLIO_MAX_SEEDS}"}), 400
+        time_budget = min(req.get('time_budget') or PORTFOLIO_TIME_BUDGET, PORTFOLIO_TIME_BUDGET)
         
         try:
             start_date = dt.strptime(req['start'] + '-01', '%Y-%m-%d').date()
@@ -747,61 +851,189 @@ def run_scheduler_route(current_user):
             print(f"DEBUG: Date Parse Failed: {e}", flush=True)
             return jsonify({"error": f"Date Parsing Error: {str(e)}"}), 400
         
-        # 2. Load DB via external module
-        db = scheduler_logic.load_state_for_scheduler(start_date)
+        end_date_month = dt.strptime(req['end'] + '-01', '%Y-%m-%d')
+        end_date = (end_date_month + relativedelta(months=1) - timedelta(days=1)).date()
+        
+        # 2. Load DB via external module (history limited to the window the run reads)
+        db = scheduler_logic.load_state_for_scheduler(start_date, end_date=end_date)
         if not db: 
             print("DEBUG: DB Load Failed", flush=True)
             return jsonify({"error": "DB Load Failed"}), 500
         
-        end_date_month = dt.strptime(req['end'] + '-01', '%Y-%m-%d')
-        end_date = (end_date_month + relativedelta(months=1) - timedelta(days=1)).date()
-        
+        conn = get_db()
+        if not conn: return jsonify({"error": "DB Connection Failed"}), 500
+        # Checkpoints are keyed by the requested months; a resumed run starts after the last completed one
+        run_key = (start_date, end_date.replace(day=1))
+        resumed_from = None
+        if req.get('resume'):
+            resume_date = scheduler_resume_start(conn, db, *run_key)
+            if resume_date != start_date: resumed_from = resume_date.strftime('%Y-%m')
+            start_date = resume_date
+        else:
+            clear_scheduler_checkpoint(conn, run_key)
+        if start_date > end_date:
+            clear_scheduler_checkpoint(conn, run_key)
+            conn.close()
+            return jsonify({"success": True, "logs": [], "months": [], "resumed_from": resumed_from})
     except Exception as e:
+        if 'conn' in locals() and conn: conn.close()
         logger.error(f"Scheduler Setup Error: {str(e)}", exc_info=True)
         return jsonify({"error": "Scheduler Setup Error", "details": str(e)}), 400
     
+    cached_months = []
+    partial_schedule = []
+    def checkpoint(first, last, rows, meta):
+        # Every month is stored as soon as it is done; a month cut short would replace the
+        # published one, so it goes back to the client unsaved unless `save_partial` asks for it
+        # (a month stopped before any row was placed is never saved)
+        if meta.get('stopped') and (not rows or not req.get('save_partial')):
+            partial_schedule.extend(rows)
+            return
+        cur = conn.cursor()
+        save_scheduler_month(cur, first, last, rows, meta)
+        if not meta.get('stopped'):
+            cur.execute("""
+                INSERT INTO scheduler_run_checkpoints (start_month, end_month, completed_month)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (start_month, end_month) DO UPDATE SET completed_month = EXCLUDED.completed_month
+            """, run_key + (first,))
+        conn.commit()
+    
+    time_limit = req.get('time_limit') or SCHEDULER_TIME_LIMIT
+    if SCHEDULER_TIME_LIMIT: time_limit = min(time_limit, SCHEDULER_TIME_LIMIT)
     try:
         # Call external logic
-        new_schedule, res_meta = scheduler_logic.run_auto_scheduler_logic(db, start_date, end_date)
+        run_options = {'log_level': req.get('log_level') or 'trace', 'balancer': req.get('balancer') or 'swap',
+                       'optimize_budget': max(0, min(req.get('optimize_budget') or 0, OPTIMIZE_MAX_BUDGET)),
+                       'deadline': started + time_limit if time_limit and time_limit > 0 else None,
+                       'daily_assign': req.get('daily_assign') or 'greedy', 'phases': phases}
+        if portfolio > 1:
+            base_seed = req.get('seed')
+            if base_seed is None: base_seed = random.SystemRandom().randrange(2**32)
+            seeds = [base_seed + i for i in range(portfolio)]
+            run_month = lambda db, first, last, **kw: scheduler_logic.run_scheduler_portfolio(db, first, last, seeds, time_budget=time_budget, **kw)
+        else:
+            run_month = lambda db, first, last, **kw: scheduler_logic.run_auto_scheduler_logic(db, first, last, seed=req.get('seed'), **kw)
+
+        def runner(db, first, last, **kw):
+            # A touch-up continues from the queues the month's own run left, not the previous month's
+            if phases is not None: load_month_queues(conn, db, first)
+            # An unseeded request is keyed with seed=None: repeating it returns the cached roster and the seed it drew
+            key = scheduler_logic.input_fingerprint(db, first, last, seed=req.get('seed'), portfolio=portfolio, **kw)
+            hit = scheduler_cache_get(key)
+            if hit:
+                cached_months.append(first.strftime('%Y-%m'))
+                return hit
+            rows, meta = run_month(db, first, last, **kw)
+            if not meta.get('stopped') and all(p['status'] == 'done' for p in meta.get('portfolio') or []):
+                scheduler_cache_put(key, first, last, rows, meta)
+            return rows, meta
+        new_schedule, res_meta = scheduler_logic.run_scheduler_months(db, start_date, end_date, checkpoint=checkpoint, runner=runner,
+                                                                      cancel_token=cancel_token, **run_options)
+        if not res_meta.get('stopped'): clear_scheduler_checkpoint(conn, run_key)
     except Exception as e:
+        # Months finished before the failure are already stored; `resume` continues after them
+        conn.rollback()
         logger.error(f"Scheduler Logic Crash: {traceback.format_exc()}", exc_info=True)
         return jsonify({"error": "Scheduler Algorithm Crash", "details": str(e)}), 500
+    finally:
+        conn.close()
+    if res_meta.get('stopped'):
+        logger.warning(f"Scheduler stopped early ({res_meta['stopped']}), cut short: {res_meta['cut_short']}")
+    return jsonify({"success": True, "logs": res_meta['logs'], "metrics": res_meta['metrics'], "seed": res_meta['seed'],
+                    "portfolio": res_meta.get('portfolio'), "stopped": res_meta.get('stopped'), "cut_short": res_meta.get('cut_short', []),
+                    "months": res_meta['months'], "resumed_from": resumed_from, "cached_months": cached_months,
+                    "partial_schedule": partial_schedule or None})
+
+def save_scheduler_month(cur, first, last, rows, res_meta):
+    # One month of a run: its rows replace the unlocked ones stored, its queues become that month's history state
+    cur.execute("DELETE FROM schedule WHERE date >= %s AND date <= %s AND manually_locked = false", (first, last))
+    values = []
+    # Engine rows carry ISO 'YYYY-MM-DD' dates, which compare correctly as strings
+    first_str, last_str = first.isoformat(), last.isoformat()
+    for s in rows:
+        if first_str <= s['date'] <= last_str and not s.get('manually_locked'):
+            values.append((s['date'], s['duty_id'], s['shift_index'], s['employee_id'], False, False))
+    if values:
+        args_str = ','.join(cur.mogrify("(%s,%s,%s,%s,%s,%s)", x).decode('utf-8') for x in values)
+        cur.execute("INSERT INTO schedule (date, duty_id, shift_index, employee_id, is_locked, manually_locked) VALUES " + args_str + " ON CONFLICT (date, duty_id, shift_index) DO NOTHING")
+    cur.execute("UPDATE scheduler_state SET rotation_queues = %s, next_round_queues = %s WHERE id = 1", (Json(res_meta['rotation_queues']), Json(res_meta['next_round_queues'])))
     
-    conn = get_db()
-    if not conn: return jsonify({"error": "DB Connection Failed"}), 500
-    cur = conn.cursor()
+    # --- PERSISTENCE: Save History State ---
     try:
-        cur.execute("DELETE FROM schedule WHERE date >= %s AND date <= %s AND manually_locked = false", (start_date, end_date))
-        values = []
-        for s in new_schedule:
-            try:
-                s_date = dt.strptime(s['date'], '%Y-%m-%d').date()
-                if start_date <= s_date <= end_date and not s.get('manually_locked'):
-                    values.append((s['date'], s['duty_id'], s['shift_index'], s['employee_id'], False, False))
-            except: pass
-        if values:
-            args_str = ','.join(cur.mogrify("(%s,%s,%s,%s,%s,%s)", x).decode('utf-8') for x in values)
-            cur.execute("INSERT INTO schedule (date, duty_id, shift_index, employee_id, is_locked, manually_locked) VALUES " + args_str + " ON CONFLICT (date, duty_id, shift_index) DO NOTHING")
-        cur.execute("UPDATE scheduler_state SET rotation_queues = %s, next_round_queues = %s WHERE id = 1", (Json(res_meta['rotation_queues']), Json(res_meta['next_round_queues'])))
-        
-        # --- PERSISTENCE: Save History State ---
-        try:
-            cur.execute("""
-                INSERT INTO scheduler_history_state (month, rotation_queues, next_round_queues)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (month) 
-                DO UPDATE SET rotation_queues = EXCLUDED.rotation_queues, next_round_queues = EXCLUDED.next_round_queues
-            """, (start_date, Json(res_meta['rotation_queues']), Json(res_meta['next_round_queues'])))
-        except Exception as e:
-            logger.error(f"Failed to save history state: {e}")
-        conn.commit()
+        cur.execute("""
+            INSERT INTO scheduler_history_state (month, rotation_queues, next_round_queues)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (month) 
+            DO UPDATE SET rotation_queues = EXCLUDED.rotation_queues, next_round_queues = EXCLUDED.next_round_queues
+        """, (first.replace(day=1), Json(res_meta['rotation_queues']), Json(res_meta['next_round_queues'])))
     except Exception as e:
-        conn.rollback()
-        logger.error("DB Save Error in Scheduler", exc_info=True)
-        return jsonify({"error": "DB Save Error", "details": str(e)}), 500
-    finally:
-        conn.close()
-    return jsonify({"success": True, "logs": res_meta['logs']})
+        logger.error(f"Failed to save history state: {e}")
+
+def scheduler_resume_start(conn, db, start_month, end_month):
+    # First month after the last one an interrupted run completed; db gets the queues that month left
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("SELECT completed_month FROM scheduler_run_checkpoints WHERE start_month = %s AND end_month = %s", (start_month, end_month))
+    row = cur.fetchone()
+    if not row: return start_month
+    load_month_queues(conn, db, row['completed_month'])
+    return row['completed_month'] + relativedelta(months=1)
+
+def load_month_queues(conn, db, month):
+    # Puts the queues stored for `month` (as its run left them) into db; returns the stored row, None if there is none
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("SELECT rotation_queues, next_round_queues FROM scheduler_history_state WHERE month = %s", (month.replace(day=1),))
+    state = cur.fetchone()
+    if state:
+        db['service_config']['rotation_queues'] = state['rotation_queues'] or {}
+        db['service_config']['next_round_queues'] = state['next_round_queues'] or {}
+    return state
+
+def clear_scheduler_checkpoint(conn, run_key):
+    conn.cursor().execute("DELETE FROM scheduler_run_checkpoints WHERE start_month = %s AND end_month = %s", run_key)
+    conn.commit()
+
+@app.route('/api/services/run_scheduler/cancel', methods=['POST'])
+@require_auth
+def cancel_scheduler_route(current_user):
+    # Stops the caller's running scheduler at its next check; that request keeps its finished months and returns the cut-short one unsaved
+    token = ACTIVE_SCHEDULER_RUNS.get(current_user.get('id'))
+    if token: token.cancel()
+    return jsonify({"success": True, "cancelled": bool(token)})
+
+@app.route('/api/services/simulate', methods=['POST'])
+@require_auth
+def simulate_route(current_user):
+    # Season forecast from the stored state, chained in memory; nothing is written to the DB
+    started = time.monotonic()
+    req = request.json
+    is_valid, error = validate_input(req, {
+        'start': {'type': str, 'regex': r'^\d{4}-\d{2}$'},
+        'months': {'type': int},
+        'unavailability_rate': {'type': (int, float), 'optional': True},
+        'seed': {'type': int, 'optional': True},
+        'balancer': {'type': str, 'regex': r'^(swap|flow)$', 'optional': True},
+        'daily_assign': {'type': str, 'regex': r'^(greedy|matching)$', 'optional': True}
+    })
+    if not is_valid: return jsonify({"error": error}), 400
+    months = req['months']
+    if not 1 <= months <= SIMULATION_MAX_MONTHS:
+        return jsonify({"error": f"Field 'months' must be between 1 and {SIMULATION_MAX_MONTHS}"}), 400
+    rate = req.get('unavailability_rate') or 0
+    if not 0 <= rate < 1: return jsonify({"error": "Field 'unavailability_rate' must be in [0, 1)"}), 400
+
+    start_date = dt.strptime(req['start'] + '-01', '%Y-%m-%d').date()
+    end_date = start_date + relativedelta(months=months) - timedelta(days=1)
+    db = scheduler_logic.load_state_for_scheduler(start_date, end_date=end_date)
+    if not db: return jsonify({"error": "DB Load Failed"}), 500
+    try:
+        result = scheduler_logic.simulate_season(db, start_date, months, unavailability_rate=rate, seed=req.get('seed'),
+                                                 balancer=req.get('balancer') or 'swap', daily_assign=req.get('daily_assign') or 'greedy',
+                                                 deadline=started + SCHEDULER_TIME_LIMIT if SCHEDULER_TIME_LIMIT else None)
+    except Exception as e:
+        logger.error(f"Simulation Crash: {traceback.format_exc()}", exc_info=True)
+        return jsonify({"error": "Simulation Crash", "details": str(e)}), 500
+    return jsonify({"success": True, **result})
 
 @app.route('/api/services/balance', methods=['GET'])
 @require_auth
@@ -834,24 +1066,15 @@ def get_special_duties_report(current_user):
         schedule = cur.fetchall()
         
         # 3. Filter & Group
+        # Calendar over the schedule span resolves exact / recurring (Year 2000) matches once per day
+        days = [scheduler_logic.to_day(s['date']) for s in schedule]
+        calendar = scheduler_logic.HorizonCalendar(special_dates, min(days, default=0), max(days, default=-1))
         report = {}
-        for s in schedule:
-            s_date = str(s['date']) # YYYY-MM-DD
-            ds = dt.strptime(s_date, '%Y-%m-%d')
+        for s, day in zip(schedule, days):
+            special_key = calendar.special_key_for(day)
             
-            # Check if it's a special date
-            # A. Exact Match
-            is_special = s_date in special_dates
-            desc = special_dates.get(s_date)
-            
-            # B. Recurring Match (Year 2000)
-            if not is_special:
-                rec_key = f"2000-{ds.month:02d}-{ds.day:02d}"
-                if rec_key in special_dates:
-                    is_special = True
-                    desc = special_dates[rec_key]
-            
-            if is_special:
+            if special_key:
+                desc = special_dates[special_key]
                 eid = s['employee_id']
                 if eid not in report:
                     report[eid] = {
@@ -860,7 +1083,7 @@ def get_special_duties_report(current_user):
                         'details': []
                     }
                 report[eid]['count'] += 1
-                report[eid]['details'].append(f"{desc} {ds.year} - {s['duty_name']}")
+                report[eid]['details'].append(f"{desc} {datetime.date.fromordinal(day).year} - {s['duty_name']}")
         
         # 4. Format Output List
         output = [v for k, v in report.items()]
@@ -870,6 +1093,33 @@ def get_special_duties_report(current_user):
     finally:
         conn.close()
 
+def repair_after_unavailability(conn, employee_id, date_str):
+    # Replaces employee_id on date_str in the published month instead of re-running it (see scheduler_logic.repair_schedule)
+    start_date = dt.strptime(date_str, '%Y-%m-%d').date().replace(day=1)
+    end_date = start_date + relativedelta(months=1) - timedelta(days=1)
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute("SELECT 1 FROM schedule WHERE employee_id=%s AND date=%s", (employee_id, date_str))
+    if not cur.fetchone(): return {"diff": [], "conflicts": []}
+
+    db = scheduler_logic.load_state_for_scheduler(start_date, end_date=end_date)
+    if not db: raise RuntimeError("DB Load Failed")
+    # Queues as this month's run left them (load_state_for_scheduler gives the state the month started from)
+    state = load_month_queues(conn, db, start_date)
+
+    diff, res_meta = scheduler_logic.repair_schedule(db, start_date, end_date, [(employee_id, date_str)], log_level='summary')
+    for d in diff:
+        if d['employee_id'] is None:
+            cur.execute("DELETE FROM schedule WHERE date=%s AND duty_id=%s AND shift_index=%s AND manually_locked = false",
+                        (d['date'], d['duty_id'], d['shift_index']))
+        else:
+            cur.execute("UPDATE schedule SET employee_id=%s WHERE date=%s AND duty_id=%s AND shift_index=%s AND manually_locked = false",
+                        (d['employee_id'], d['date'], d['duty_id'], d['shift_index']))
+    if state:
+        cur.execute("UPDATE scheduler_history_state SET rotation_queues = %s, next_round_queues = %s WHERE month = %s",
+                    (Json(res_meta['rotation_queues']), Json(res_meta['next_round_queues']), start_date))
+    conn.commit()
+    return {"diff": diff, "conflicts": res_meta['conflicts'], "metrics": res_meta['metrics'], "logs": res_meta['logs']}
+
 @app.route('/api/services/unavailability', methods=['GET', 'POST', 'DELETE'])
 @require_auth
 def s_unavail(current_user):
@@ -888,11 +1138,19 @@ def s_unavail(current_user):
             u=request.json
             is_valid, error = validate_input(u, {
                 'employee_id': {'type': int},
-                'date': {'type': str, 'regex': r'^\d{4}-\d{2}-\d{2}$'}
+                'date': {'type': str, 'regex': r'^\d{4}-\d{2}-\d{2}$'},
+                'repair': {'type': bool, 'optional': True}
             })
             if not is_valid: return jsonify({"error": error}), 400
             cur.execute("INSERT INTO unavailability (employee_id, date) VALUES (%s, %s) ON CONFLICT DO NOTHING", (u.get('employee_id'), u.get('date')))
             conn.commit()
+            if u.get('repair'):
+                try:
+                    return jsonify({"success": True, "repair": repair_after_unavailability(conn, u['employee_id'], u['date'])})
+                except Exception as e:
+                    conn.rollback()
+                    logger.error("Schedule Repair Error", exc_info=True)
+                    return jsonify({"error": "Schedule Repair Error", "details": str(e)}), 500
             return jsonify({"success":True})
         if request.method=='DELETE':
             cur.execute("DELETE FROM unavailability WHERE employee_id=%s AND date=%s", (request.args.get('employee_id'), request.args.get('date')))
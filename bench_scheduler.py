@@ -0,0 +1,213 @@
+import argparse
+import contextlib
+import copy
+import io
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from dateutil.relativedelta import relativedelta
+
+import scheduler_logic
+
+# Benchmark for run_auto_scheduler_logic on synthetic data (no DB needed).
+# Usage: python bench_scheduler.py [--employees 40] [--months 1] [--repeat 3] [--seed 1] [--balancer swap|flow|both] [--optimize SECONDS]
+#        [--daily-assign greedy|matching]   (--balancer both runs both daily_assign modes and fails if flow ends worse than swap)
+#        python bench_scheduler.py --scoring [--employees 50] [--history-months 24] [--repeat 3]
+#        python bench_scheduler.py --simulate 12 [--employees 40] [--unavailability-rate 0.02]
+# Output is printed; redirect to bench_output.txt to keep a local record.
+
+
+def build_db(n_employees=40, history_start=date(2023, 1, 1), history_end=date(2024, 2, 29), seed=7):
+    r = random.Random(seed)
+    employees = [{'id': i, 'name': f'Υπάλληλος {i}'} for i in range(1, n_employees + 1)]
+    ids = [e['id'] for e in employees]
+
+    duties = [
+        {'id': 1, 'name': 'Γραφείο', 'shifts_per_day': 2, 'is_weekly': False, 'is_special': False, 'is_off_balance': False,
+         'shift_config': [{'is_within_hours': True, 'default_employee_id': 3, 'excluded_ids': ['5']},
+                          {'handicaps': {'4': 2, '9': 1}}]},
+        {'id': 2, 'name': 'Πύλη', 'shifts_per_day': 2, 'is_weekly': False, 'is_special': False, 'is_off_balance': False,
+         'shift_config': [{'excluded_ids': [7, 8]}, {'active_range': {'start': '01/05', 'end': '30/09'}}]},
+        {'id': 3, 'name': 'Λιμάνι', 'shifts_per_day': 1, 'is_weekly': False, 'is_special': False, 'is_off_balance': False,
+         'active_range': {'start': '01-11', 'end': '31-03'}, 'shift_config': [{}]},
+        {'id': 4, 'name': 'Αεροδρόμιο', 'shifts_per_day': 1, 'is_weekly': False, 'is_special': False, 'is_off_balance': False,
+         'shift_config': [{'excluded_ids': ['10', '11']}]},
+        {'id': 5, 'name': 'Εβδομαδιαία', 'shifts_per_day': 1, 'is_weekly': True, 'is_special': False, 'is_off_balance': False,
+         'sunday_active_range': {'start': '01/06', 'end': '31/08'}, 'shift_config': [{'day_index': 0}]},
+        {'id': 6, 'name': 'Έκτακτη', 'shifts_per_day': 1, 'is_weekly': False, 'is_special': False, 'is_off_balance': True,
+         'shift_config': [{'excluded_ids': ['12']}]},
+        {'id': 7, 'name': 'Εβδομαδιαία Εκτός', 'shifts_per_day': 1, 'is_weekly': True, 'is_special': False, 'is_off_balance': True,
+         'shift_config': [{'day_index': 0, 'default_employee_id': 13}]},
+        {'id': 8, 'name': 'Τελετή', 'shifts_per_day': 1, 'is_weekly': False, 'is_special': True, 'is_off_balance': False,
+         'shift_config': [{}]},
+    ]
+    special_dates = ['2000-01-01', '2000-01-06', '2000-03-25', '2000-08-15', '2000-10-28', '2000-12-25',
+                     '2000-12-26', '2023-04-14', '2023-04-17', '2024-05-03', '2024-05-06', '2024-06-24']
+
+    schedule = []
+    d = history_start
+    while d <= history_end:
+        for duty in duties:
+            for sh in range(duty['shifts_per_day']):
+                if r.random() < 0.15: continue
+                schedule.append({'id': len(schedule) + 1, 'date': d.isoformat(), 'duty_id': duty['id'],
+                                 'shift_index': sh, 'employee_id': r.choice(ids),
+                                 'is_locked': False, 'manually_locked': False})
+        d += timedelta(days=1)
+
+    unavailability = []
+    d = history_start
+    while d <= history_end + timedelta(days=366):
+        for eid in ids:
+            if r.random() < 0.03: unavailability.append({'employee_id': eid, 'date': d.isoformat()})
+        d += timedelta(days=1)
+
+    return {
+        'employees': employees,
+        'service_config': {'duties': duties, 'special_dates': special_dates,
+                           'rotation_queues': {}, 'next_round_queues': {}},
+        'schedule': schedule,
+        'unavailability': unavailability,
+        'preferences': {i: True for i in ids[1::7]},
+    }
+
+
+def time_run(db, start_date, end_date, seed, balancer='swap', optimize=0, daily_assign='greedy'):
+    # The engine mutates queues/config in place, so every run gets a fresh copy
+    db = copy.deepcopy(db)
+    buf = io.StringIO()
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(buf):
+        schedule, meta = scheduler_logic.run_auto_scheduler_logic(db, start_date, end_date, seed=seed, balancer=balancer, optimize_budget=optimize,
+                                                                    daily_assign=daily_assign)
+    return time.perf_counter() - t0, schedule, meta
+
+
+def bench_scoring(args):
+    # Whole-history scoring: balance report and windowed score vectors, row by row vs ScoreMatrix
+    history_end = date(2024, 2, 29)
+    history_start = history_end + timedelta(days=1) - relativedelta(months=args.history_months)
+    db = build_db(n_employees=args.employees, history_start=history_start, history_end=history_end)
+    employees, duties = db['employees'], db['service_config']['duties']
+    special_dates = set(db['service_config']['special_dates'])
+    print(f"Υπάλληλοι: {args.employees} | Ιστορικό: {history_start} - {history_end} ({len(db['schedule'])} βάρδιες)")
+
+    def best_of(fn):
+        times = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter(); out = fn(); times.append(time.perf_counter() - t0)
+        return min(times), out
+
+    t_rows, report_rows = best_of(lambda: scheduler_logic.balance_stats(employees, duties, db['schedule'], special_dates))
+    t_matrix, report_matrix = best_of(lambda: scheduler_logic.balance_stats_matrix(employees, duties, db['schedule'], special_dates))
+    assert report_rows == report_matrix, "balance_stats_matrix differs from balance_stats"
+    print(f"balance report: rows {t_rows * 1000:.1f}ms | matrix {t_matrix * 1000:.1f}ms (same result)")
+
+    # Window sums as the engine's ledgers see them: normal score over the 2-month lookback, SK over the 5-month window
+    start_date = history_end + timedelta(days=1)
+    catalog = scheduler_logic.DutyCatalog(duties)
+    rows = scheduler_logic.compile_rows(db['schedule'])
+    emp_ids = [e['id'] for e in employees]
+    first, last = min(r['day'] for r in rows), max(r['day'] for r in rows)
+    calendar = scheduler_logic.HorizonCalendar(special_dates, first, last)
+    windows = {'normal': (scheduler_logic.balance_lookback_start(start_date).toordinal(), None),
+               'sk': (scheduler_logic.sk_window_start(history_end).toordinal(), calendar.is_scoreable)}
+
+    def ledger_scores():
+        out = {}
+        for name, (w_first, on_day) in windows.items():
+            def weight(r, eid, w_first=w_first, on_day=on_day):
+                if r['duty_id'] not in catalog.normal_ids or r['day'] < w_first: return 0
+                if on_day: return 1 if on_day(r['day']) else 0
+                conf = catalog.conf(r['duty_id'], r['shift_index'])
+                off = not calendar.is_scoreable(r['day'])
+                if off and (r['duty_id'] in catalog.weekly_ids or (conf.get('is_within_hours') and conf.get('default_employee_id') == eid)): return 0
+                return 1
+            out[name] = [scheduler_logic.ScoreLedger(emp_ids, weight, rows).scores[eid] for eid in emp_ids]
+        return out
+
+    def matrix_scores():
+        m = scheduler_logic.ScoreMatrix(emp_ids, catalog, calendar, rows, first, last)
+        return {'normal': m.scores(catalog.normal_ids, first_day=windows['normal'][0]).tolist(),
+                'sk': m.scores(catalog.normal_ids, first_day=windows['sk'][0], day_mask=m.scoreable).tolist()}
+
+    t_ledger, by_ledger = best_of(ledger_scores)
+    t_dense, by_matrix = best_of(matrix_scores)
+    assert by_ledger == by_matrix, "ScoreMatrix window sums differ from ScoreLedger"
+    spreads = {k: max(v) - min(v) for k, v in by_matrix.items()}
+    print(f"window scores: rows {t_ledger * 1000:.1f}ms | matrix {t_dense * 1000:.1f}ms (same result, spreads {spreads})")
+
+
+def bench_simulation(args):
+    # Season forecast in memory: month-by-month trajectory of the final and cumulative spreads
+    db = build_db(n_employees=args.employees)
+    start_date = date(2024, 3, 1)
+    print(f"Υπάλληλοι: {args.employees} | Προσομοίωση: {args.simulate} μήνες από {start_date} | Επιπλέον κωλύματα: {args.unavailability_rate}")
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = scheduler_logic.simulate_season(db, start_date, args.simulate, unavailability_rate=args.unavailability_rate, seed=args.seed)
+    for m in result['months']:
+        print(f"  {m['month']}: {m['total_ms']:.0f}ms | unfilled {m['unfilled_slots']} | spreads {m['spreads']} | cumulative {m['cumulative']}")
+    print(f"total: {time.perf_counter() - t0:.2f}s")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the auto scheduler on synthetic data")
+    ap.add_argument('--employees', type=int, default=40)
+    ap.add_argument('--months', type=int, default=1)
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--balancer', choices=scheduler_logic.BALANCERS + ('both',), default='swap')
+    ap.add_argument('--optimize', type=float, default=0, help="local-search budget in seconds (0 = off)")
+    ap.add_argument('--daily-assign', choices=scheduler_logic.DAILY_ASSIGNERS, default='greedy')
+    ap.add_argument('--scoring', action='store_true', help="benchmark whole-history scoring instead of a run")
+    ap.add_argument('--history-months', type=int, default=24)
+    ap.add_argument('--simulate', type=int, default=0, help="forecast this many months in memory instead of a run")
+    ap.add_argument('--unavailability-rate', type=float, default=0.0)
+    args = ap.parse_args()
+    if args.scoring: return bench_scoring(args)
+    if args.simulate: return bench_simulation(args)
+
+    start_date = date(2024, 3, 1)
+    end_date = start_date + relativedelta(months=args.months) - timedelta(days=1)
+
+    db = build_db(n_employees=args.employees)
+    print(f"Υπάλληλοι: {args.employees} | Περίοδος: {start_date} - {end_date} | Ιστορικό: {len(db['schedule'])} βάρδιες")
+
+    # 'both' runs each balancer with every daily_assign mode and checks that flow never ends worse than swap
+    balancers = scheduler_logic.BALANCERS if args.balancer == 'both' else (args.balancer,)
+    daily_assigns = scheduler_logic.DAILY_ASSIGNERS if args.balancer == 'both' else (args.daily_assign,)
+    spreads = {}
+    for daily_assign in daily_assigns:
+        for balancer in balancers:
+            print(f"[{balancer} | {daily_assign}]")
+            timings = []
+            for i in range(args.repeat):
+                elapsed, schedule, meta = time_run(db, start_date, end_date, args.seed, balancer, args.optimize, daily_assign)
+                timings.append(elapsed)
+                print(f"  run {i + 1}: {elapsed:.3f}s ({len(schedule)} βάρδιες, {len(meta['logs'])} logs)")
+            print(f"median: {statistics.median(timings):.3f}s | min: {min(timings):.3f}s")
+            phases = sorted(meta['metrics']['phases'], key=lambda p: p['wall_ms'], reverse=True)
+            print("phases (last run): " + ", ".join(f"{p['name']} {p['wall_ms']:.1f}ms" for p in phases))
+            print(f"swaps: {meta['metrics']['swaps_performed']} | unfilled: {meta['metrics']['unfilled_slots']}")
+            print("final spreads: " + ", ".join(f"{k} {v}" for k, v in meta['metrics']['final_spreads'].items()))
+            spreads[daily_assign, balancer] = meta['metrics']['final_spreads']
+    if args.balancer == 'both': check_flow_spreads(spreads, daily_assigns)
+
+
+def check_flow_spreads(spreads, daily_assigns):
+    # Only the run_balance phases (balance_*) use the balancer; special-date and SK balancing run
+    # their own loops on whatever state the balancer left, so their spreads are not compared
+    worse = []
+    for daily_assign in daily_assigns:
+        swap, flow = spreads[daily_assign, 'swap'], spreads[daily_assign, 'flow']
+        for phase in sorted(p for p in swap if p.startswith('balance_')):
+            if flow.get(phase, float('inf')) > swap[phase]: worse.append(f"{daily_assign} {phase}: flow {flow.get(phase)} > swap {swap[phase]}")
+    print("flow vs swap: " + ("ok" if not worse else "; ".join(worse)))
+    assert not worse, "flow balancer ended with a wider spread than the swap loop"
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,26 @@
 import os
+import io
+import copy
+import hashlib
 import json
+import contextlib
+import multiprocessing
+import math
 import random
+import bisect
+import threading
+import heapq
+import time
+from collections import deque
 import psycopg2
 import logging
-from datetime import datetime as dt, timedelta
+from datetime import date, datetime as dt, timedelta
 from dateutil.relativedelta import relativedelta
 from psycopg2.extras import RealDictCursor
+try:
+    import numpy as np
+except ImportError:  # ScoreMatrix needs it; without it scoring stays on the row-by-row path
+    np = None
 
 # Setup logger for this module
 logger = logging.getLogger("customs_api")
@@ -33,32 +48,57 @@ def get_db():
 # SCHEDULER HELPER FUNCTIONS
 # ==========================================
 
-def is_in_period(date_obj, range_config):
-    if not range_config or not range_config.get('start') or not range_config.get('end'): return True 
-    try:
-        y = date_obj.year
-        s_str = str(range_config['start']).strip()
-        e_str = str(range_config['end']).strip()
-        
-        # Handle YYYY-MM-DD
-        if '-' in s_str and len(s_str.split('-')) == 3:
-             start_date = dt.strptime(s_str, '%Y-%m-%d').date()
-        else:
-             # Assume DD/MM or DD-MM
-             s_parts = s_str.replace('/','-').split('-')
-             s_day, s_month = int(s_parts[0]), int(s_parts[1])
-             start_date = dt(y, s_month, s_day).date()
+class PeriodRange:
+    """
+    Compiled form of an `active_range` / `sunday_active_range` config.
+    The strings are parsed once; DD/MM bounds are resolved per year and cached.
+    Anything unparsable means "always active", exactly like is_in_period().
+    """
+    def __init__(self, range_config):
+        self.always = True
+        self._by_year = {}
+        self._by_day = {}
+        if not range_config or not range_config.get('start') or not range_config.get('end'): return
+        try:
+            self.start = self._parse(str(range_config['start']).strip())
+            self.end = self._parse(str(range_config['end']).strip())
+            self.always = False
+        except Exception: pass
 
-        if '-' in e_str and len(e_str.split('-')) == 3:
-             end_date = dt.strptime(e_str, '%Y-%m-%d').date()
-        else:
-             e_parts = e_str.replace('/','-').split('-')
-             e_day, e_month = int(e_parts[0]), int(e_parts[1])
-             end_date = dt(y, e_month, e_day).date()
-             
+    @staticmethod
+    def _parse(text):
+        # Handle YYYY-MM-DD
+        if '-' in text and len(text.split('-')) == 3:
+            return dt.strptime(text, '%Y-%m-%d').date()
+        # Assume DD/MM or DD-MM -> (month, day), resolved against the checked year
+        parts = text.replace('/','-').split('-')
+        return (int(parts[1]), int(parts[0]))
+
+    def _bounds(self, y):
+        if y not in self._by_year:
+            try:
+                s = self.start if isinstance(self.start, date) else date(y, *self.start)
+                e = self.end if isinstance(self.end, date) else date(y, *self.end)
+                self._by_year[y] = (s, e)
+            except Exception:
+                self._by_year[y] = None
+        return self._by_year[y]
+
+    def contains(self, date_obj):
+        """Accepts a date or an integer day ordinal (memoized per day)."""
+        if self.always: return True
+        if isinstance(date_obj, int):
+            if date_obj not in self._by_day:
+                self._by_day[date_obj] = self.contains(date.fromordinal(date_obj))
+            return self._by_day[date_obj]
+        b = self._bounds(date_obj.year)
+        if b is None: return True
+        start_date, end_date = b
         if start_date > end_date: return date_obj >= start_date or date_obj <= end_date
         else: return start_date <= date_obj <= end_date
-    except: return True 
+
+def is_in_period(date_obj, range_config):
+    return PeriodRange(range_config).contains(date_obj)
 
 def is_scoreable_day(d_date, special_dates_set):
     if isinstance(d_date, str): d_date = dt.strptime(d_date, '%Y-%m-%d').date()
@@ -70,6 +110,722 @@ def is_scoreable_day(d_date, special_dates_set):
     if recurring_key in special_dates_set: return True
     return False
 
+# --- History windows ---
+# Balancing scores look back BALANCE_LOOKBACK_MONTHS before the run and the SK
+# score SK_WINDOW_MONTHS before its end. Older stored schedule is only needed
+# for the special-date scores (Phase 5), which count strictly special days.
+BALANCE_LOOKBACK_MONTHS = 2
+SK_WINDOW_MONTHS = 5
+
+def balance_lookback_start(start_date):
+    return (start_date - relativedelta(months=BALANCE_LOOKBACK_MONTHS)).replace(day=1)
+
+def sk_window_start(end_date):
+    return (end_date - relativedelta(months=SK_WINDOW_MONTHS)).replace(day=1)
+
+def history_window_start(start_date, end_date):
+    """Earliest day a run reads for anything other than special-date scores."""
+    return min(balance_lookback_start(start_date), sk_window_start(end_date), start_date - timedelta(days=1))
+
+# --- Internal day representation ---
+# The engine works on integer day ordinals (date.toordinal()); strings are
+# parsed once when rows are loaded and formatted back only for the result.
+def to_day(value):
+    if isinstance(value, int): return value
+    if isinstance(value, date): return value.toordinal()
+    return date.fromisoformat(str(value)[:10]).toordinal()
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def ordinal_days(values):
+    """to_day() for a whole column of dates / 'YYYY-MM-DD' strings, as one NumPy array (needs numpy)."""
+    return np.array([str(v)[:10] for v in values], dtype='datetime64[D]').astype(np.int64) + EPOCH_ORDINAL
+
+def day_str(day):
+    return date.fromordinal(day).isoformat()
+
+def day_weekday(day):
+    # date.fromordinal(1) is a Monday -> 0=Mon ... 6=Sun, same as date.weekday()
+    return (day - 1) % 7
+
+def compile_rows(rows):
+    """Schedule rows as loaded from the DB -> internal rows ('day' ordinal, int ids)."""
+    out = []
+    for s in rows:
+        try:
+            row = {k: v for k, v in s.items() if k != 'date'}
+            row['day'] = to_day(s['date'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        row['duty_id'] = int(s['duty_id'])
+        row['shift_index'] = int(s.get('shift_index') or 0)
+        if s.get('employee_id') is not None: row['employee_id'] = int(s['employee_id'])
+        out.append(row)
+    return out
+
+def serialize_rows(rows):
+    """Internal rows -> the 'YYYY-MM-DD' rows returned to callers / saved to the DB."""
+    out = []
+    for r in rows:
+        s = {k: v for k, v in r.items() if k != 'day'}
+        s['date'] = day_str(r['day'])
+        out.append(s)
+    return out
+
+class HorizonCalendar:
+    """
+    Per-day lookup table over [first_day, last_day] (day ordinals), built once
+    from the special dates. Same rules as is_scoreable_day(): a day is strictly
+    special on an exact 'YYYY-MM-DD' or recurring '2000-MM-DD' match, and
+    scoreable when it is a weekend or strictly special.
+    Days outside the horizon are computed on demand and cached.
+    """
+    def __init__(self, special_dates, first_day, last_day):
+        self.special_dates = special_dates
+        self.first = to_day(first_day)
+        self.last = max(to_day(last_day), self.first - 1)
+        n = self.last - self.first + 1
+        self.weekday = bytearray(n)
+        self.weekend = bytearray(n)
+        self.strict_special = bytearray(n)
+        self.scoreable = bytearray(n)
+        self.iso_week = [None] * n
+        self.special_key = [None] * n
+        for i in range(n):
+            wd, we, sp, sc, iw, key = self._compute(self.first + i)
+            self.weekday[i] = wd; self.weekend[i] = we
+            self.strict_special[i] = sp; self.scoreable[i] = sc
+            self.iso_week[i] = iw; self.special_key[i] = key
+        self._outside = {}
+
+    def _compute(self, day):
+        d = date.fromordinal(day)
+        iso_y, iso_w, iso_day = d.isocalendar()
+        d_str = d.isoformat()
+        key = d_str if d_str in self.special_dates else None
+        if key is None and f"2000-{d_str[5:]}" in self.special_dates: key = f"2000-{d_str[5:]}"
+        weekend = iso_day in (6, 7)
+        special = key is not None
+        return iso_day - 1, weekend, special, weekend or special, (iso_y, iso_w), key
+
+    def _row(self, day):
+        if day not in self._outside: self._outside[day] = self._compute(day)
+        return self._outside[day]
+
+    def is_weekend(self, day):
+        if self.first <= day <= self.last: return bool(self.weekend[day - self.first])
+        return self._row(day)[1]
+
+    def is_strict_special(self, day):
+        if self.first <= day <= self.last: return bool(self.strict_special[day - self.first])
+        return self._row(day)[2]
+
+    def is_scoreable(self, day):
+        if self.first <= day <= self.last: return bool(self.scoreable[day - self.first])
+        return self._row(day)[3]
+
+    def week(self, day):
+        """(iso_year, iso_week) of the day."""
+        if self.first <= day <= self.last: return self.iso_week[day - self.first]
+        return self._row(day)[4]
+
+    def special_key_for(self, day):
+        """The special_dates key (exact or recurring) that makes the day special, else None."""
+        if self.first <= day <= self.last: return self.special_key[day - self.first]
+        return self._row(day)[5]
+
+class DutyCatalog:
+    """
+    Duty configuration compiled once per run from db['service_config']['duties'].
+    Replaces the repeated `next(d for d in duties ...)` lookups, excluded_ids
+    parsing and active-range parsing inside the scheduler loops.
+    """
+    def __init__(self, duties):
+        # Normalize in place (callers have always seen these defaults applied)
+        for d in duties:
+            if d.get('shifts_per_day') is None: d['shifts_per_day'] = 1
+            if d.get('shift_config') is None: d['shift_config'] = []
+            while len(d['shift_config']) < d['shifts_per_day']: d['shift_config'].append({})
+
+        self.duties = duties
+        self.by_id = {d['id']: d for d in duties}
+
+        self.weekly_ids = frozenset(d['id'] for d in duties if d.get('is_weekly'))
+        self.special_ids = frozenset(d['id'] for d in duties if d.get('is_special'))
+        self.off_balance_ids = frozenset(d['id'] for d in duties if d.get('is_off_balance'))
+        # "Normal" = counts towards the main balance (not off-balance, not special)
+        self.normal_ids = frozenset(d['id'] for d in duties if not d.get('is_off_balance') and not d.get('is_special'))
+        self.off_balance_scored_ids = frozenset(d['id'] for d in duties if d.get('is_off_balance') and not d.get('is_special'))
+        # Daily normal duties: the only ones SK/special balancing may swap one shift at a time
+        self.daily_normal_ids = self.normal_ids - self.weekly_ids
+
+        self.excluded = {}
+        self.default_employee = {}
+        self.shift_active = {}
+        self.active = {}
+        self.sunday_active = {}
+        for d in duties:
+            self.active[d['id']] = PeriodRange(d.get('active_range'))
+            self.sunday_active[d['id']] = PeriodRange(d.get('sunday_active_range'))
+            for sh_idx, conf in enumerate(d['shift_config']):
+                self.excluded[(d['id'], sh_idx)] = frozenset(int(x) for x in conf.get('excluded_ids', []))
+                self.default_employee[(d['id'], sh_idx)] = conf.get('default_employee_id')
+                self.shift_active[(d['id'], sh_idx)] = PeriodRange(conf.get('active_range'))
+
+        self._handicaps = {}
+
+    def get(self, duty_id):
+        return self.by_id.get(int(duty_id))
+
+    def conf(self, duty_id, sh_idx):
+        d = self.by_id.get(int(duty_id))
+        if not d: return {}
+        confs = d['shift_config']
+        sh_idx = int(sh_idx or 0)
+        return confs[sh_idx] if sh_idx < len(confs) else {}
+
+    def excluded_for(self, duty_id, sh_idx):
+        return self.excluded.get((int(duty_id), int(sh_idx or 0)), frozenset())
+
+    def week_start(self, duty_id, sh_idx, day):
+        """First day of the weekly-duty week holding `day`: weeks start on the shift's day_index (Monday by default), as in Phase 1."""
+        return day - (day_weekday(day) - self.conf(duty_id, sh_idx).get('day_index', 0)) % 7
+
+    def is_active(self, duty_id, sh_idx, day):
+        """Duty-level and shift-level active_range both apply."""
+        return self.active[duty_id].contains(day) and self.shift_active[(duty_id, sh_idx)].contains(day)
+
+    def ids_where(self, weekly=None, special=None, off_balance=None):
+        """Ordered duty list filtered by flags (None = don't care)."""
+        return [d for d in self.duties
+                if (weekly is None or bool(d.get('is_weekly')) == weekly)
+                and (special is None or bool(d.get('is_special')) == special)
+                and (off_balance is None or bool(d.get('is_off_balance')) == off_balance)]
+
+    def excluded_everywhere(self, duty_ids, employee_ids):
+        """Employees excluded from ALL shifts of ALL given duties."""
+        excluded = set(employee_ids)
+        for d in self.duties:
+            if d['id'] not in duty_ids: continue
+            for sh_idx in range(len(d['shift_config'])):
+                excluded &= self.excluded[(d['id'], sh_idx)]
+        return excluded
+
+    def handicap(self, duty_id, eid, positive_only=False):
+        """Sum of per-shift handicaps of an employee for one duty."""
+        key = (duty_id, eid, positive_only)
+        if key not in self._handicaps:
+            total = 0
+            for conf in self.by_id[duty_id]['shift_config']:
+                val = int(conf.get('handicaps', {}).get(str(eid), 0))
+                if val > 0 or not positive_only: total += val
+            self._handicaps[key] = total
+        return self._handicaps[key]
+
+class OccupancyIndex:
+    """
+    Per-employee occupancy map {employee_id: {day_ordinal: [rows]}}.
+    Only normal and weekly duties are indexed, because off-balance and special
+    duties never make someone "busy". Must be kept in step with every append
+    and every swap (see place()/reassign() in run_auto_scheduler_logic).
+    """
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.days = {}
+
+    def counts(self, row):
+        duty_id = int(row['duty_id'])
+        return duty_id not in self.catalog.off_balance_ids and duty_id not in self.catalog.special_ids
+
+    def add(self, row):
+        if row.get('employee_id') is None or not self.counts(row): return
+        emp_days = self.days.setdefault(int(row['employee_id']), {})
+        emp_days.setdefault(row['day'], []).append(row)
+
+    def remove(self, row):
+        if row.get('employee_id') is None or not self.counts(row): return
+        emp_days = self.days.get(int(row['employee_id']), {})
+        day = row['day']
+        rows = emp_days.get(day, [])
+        for i, r in enumerate(rows):
+            if r is row:
+                rows.pop(i); break
+        if not rows: emp_days.pop(day, None)
+
+    def _duty_name(self, rows):
+        d_o = self.catalog.get(rows[0]['duty_id'])
+        return d_o.get('name', 'Unknown') if d_o else 'Unknown'
+
+    def busy_reason(self, eid, day, ignore_yesterday=False, ignore_tomorrow=False):
+        emp_days = self.days.get(eid)
+        if not emp_days: return False
+        rows = emp_days.get(day)
+        if rows: return f"Εργάζεται σήμερα ({self._duty_name(rows)})"
+        if not ignore_yesterday:
+            rows = emp_days.get(day - 1)
+            if rows: return f"Εργάστηκε χθες ({self._duty_name(rows)})"
+        if not ignore_tomorrow:
+            rows = emp_days.get(day + 1)
+            if rows: return f"Έχει βάρδια αύριο ({self._duty_name(rows)})"
+        return False
+
+class SlotIndex:
+    """
+    Rows by slot: (day, duty_id, shift_index) and (day, duty_id), each list in
+    insertion order so lookups return the same row a scan of the list would.
+    A slot never changes once a row exists (swaps only change employee_id),
+    so the index only needs add().
+    """
+    def __init__(self, rows=()):
+        self.by_slot = {}
+        self.by_duty_day = {}
+        for row in rows: self.add(row)
+
+    def add(self, row):
+        self.by_slot.setdefault((row['day'], row['duty_id'], row['shift_index']), []).append(row)
+        self.by_duty_day.setdefault((row['day'], row['duty_id']), []).append(row)
+
+    def rows(self, day, duty_id, shift_index=None):
+        if shift_index is None: return self.by_duty_day.get((day, duty_id), [])
+        return self.by_slot.get((day, duty_id, shift_index), [])
+
+    def filled(self, day, duty_id, shift_index=None):
+        return bool(self.rows(day, duty_id, shift_index))
+
+    def first(self, day, duty_id, shift_index=None):
+        rows = self.rows(day, duty_id, shift_index)
+        return rows[0] if rows else None
+
+class SwapIndex:
+    """
+    Swappable (not manually locked) schedule rows bucketed by
+    employee -> (duty_id, day kind), where the day kind is a bitmask of
+    WEEKEND / SCOREABLE / STRICT_SPECIAL from the calendar. Each bucket holds
+    schedule positions in order, so rows() returns exactly what a filtered scan
+    of the schedule would, in the same order (the balancers shuffle these lists
+    with the run's RNG). Kept in step by place()/reassign().
+    """
+    WEEKEND, SCOREABLE, STRICT_SPECIAL = 1, 2, 4
+
+    def __init__(self, calendar, rows=()):
+        self.calendar = calendar
+        self.by_emp = {}
+        self._rows = []
+        self._pos = {}
+        self._kinds = {}
+        for row in rows: self.add(row)
+
+    def kind(self, day):
+        k = self._kinds.get(day)
+        if k is None:
+            k = ((self.WEEKEND if day_weekday(day) in (5, 6) else 0)
+                 | (self.SCOREABLE if self.calendar.is_scoreable(day) else 0)
+                 | (self.STRICT_SPECIAL if self.calendar.is_strict_special(day) else 0))
+            self._kinds[day] = k
+        return k
+
+    def _bucket(self, eid, row):
+        return self.by_emp.setdefault(eid, {}).setdefault((row['duty_id'], self.kind(row['day'])), [])
+
+    def add(self, row):
+        # Positions follow schedule order as long as rows are added as they are appended
+        pos = len(self._rows)
+        self._rows.append(row)
+        if row.get('manually_locked') or row.get('employee_id') is None: return
+        self._pos[id(row)] = pos
+        self._bucket(row['employee_id'], row).append(pos)
+
+    def move(self, row, old_eid, new_eid):
+        pos = self._pos.get(id(row))
+        if pos is None: return
+        bucket = self._bucket(old_eid, row)
+        del bucket[bisect.bisect_left(bucket, pos)]
+        bisect.insort(self._bucket(new_eid, row), pos)
+
+    def rows(self, eid, duty_ids, kinds=None):
+        """Rows of eid in duty_ids (and, if given, with kind(day) in kinds), in schedule order."""
+        runs = [b for (duty_id, k), b in self.by_emp.get(eid, {}).items()
+                if b and duty_id in duty_ids and (kinds is None or k in kinds)]
+        if not runs: return []
+        positions = runs[0] if len(runs) == 1 else sorted(p for b in runs for p in b)
+        return [self._rows[p] for p in positions]
+
+    @classmethod
+    def kinds_where(cls, **flags):
+        """All day kinds matching the given flags, e.g. kinds_where(weekend=True, strict_special=False)."""
+        bits = {'weekend': cls.WEEKEND, 'scoreable': cls.SCOREABLE, 'strict_special': cls.STRICT_SPECIAL}
+        return frozenset(k for k in range(8)
+                         if all(bool(k & bits[name]) == want for name, want in flags.items()))
+
+class ScoreLedger:
+    """
+    Running per-employee totals for one scoring rule.
+    `weight(row, eid)` is what a row is worth to the employee holding it (0 = not
+    counted). Rows are summed once at build time; after that the ledger only
+    sees deltas: add() for new rows, move() when a row changes hands.
+
+    Ranking: employees are kept in score buckets, each bucket ordered by the
+    employee's position in `scores` -- the same order a stable
+    sorted(scores, key=scores.get) gives. A score change moves one employee
+    between buckets (bisect), so the balancing loops never re-sort.
+    """
+    def __init__(self, employee_ids, weight, rows=(), base=None):
+        self.weight = weight
+        self.scores = {eid: 0 for eid in employee_ids}
+        if base:
+            for eid in self.scores: self.scores[eid] += base.get(eid, 0)
+        for row in rows:
+            eid = row.get('employee_id')
+            if eid in self.scores: self.scores[eid] += weight(row, eid)
+        self._ids = list(self.scores)
+        self._pos = {eid: i for i, eid in enumerate(self._ids)}
+        self._buckets = {}
+        for eid, score in self.scores.items(): self._buckets.setdefault(score, []).append(self._pos[eid])
+        self._levels = sorted(self._buckets)
+
+    def _shift(self, eid, delta):
+        if not delta: return
+        old = self.scores[eid]; new = old + delta
+        self.scores[eid] = new
+        pos = self._pos[eid]
+        bucket = self._buckets[old]
+        bucket.pop(bisect.bisect_left(bucket, pos))
+        if not bucket:
+            del self._buckets[old]
+            self._levels.pop(bisect.bisect_left(self._levels, old))
+        if new not in self._buckets:
+            self._buckets[new] = []
+            bisect.insort(self._levels, new)
+        bisect.insort(self._buckets[new], pos)
+
+    def add(self, row):
+        eid = row.get('employee_id')
+        if eid in self.scores: self._shift(eid, self.weight(row, eid))
+
+    def move(self, row, old_eid, new_eid):
+        if old_eid in self.scores: self._shift(old_eid, -self.weight(row, old_eid))
+        if new_eid in self.scores: self._shift(new_eid, self.weight(row, new_eid))
+
+    def lowest(self):
+        return self._ids[self._buckets[self._levels[0]][0]] if self._levels else None
+
+    def highest(self):
+        return self._ids[self._buckets[self._levels[-1]][-1]] if self._levels else None
+
+    def ranked(self, below=None):
+        """Employee ids by ascending score (ties by position), optionally only score < below."""
+        out = []
+        for level in self._levels:
+            if below is not None and level >= below: break
+            out.extend(self._ids[p] for p in self._buckets[level])
+        return out
+
+    def ranked_desc(self, above=None):
+        """Exact reverse of ranked(), optionally only score > above."""
+        out = []
+        for level in reversed(self._levels):
+            if above is not None and level <= above: break
+            out.extend(self._ids[p] for p in reversed(self._buckets[level]))
+        return out
+
+    def ranked_items(self):
+        return [(eid, self.scores[eid]) for eid in self.ranked()]
+
+    def count_below(self, limit):
+        n = 0
+        for level in self._levels:
+            if level >= limit: break
+            n += len(self._buckets[level])
+        return n
+
+class ScoreMatrix:
+    """
+    Schedule as dense NumPy arrays for whole-history scoring: `counts[e, d, k]` is
+    how many rows employee e holds on day first_day + d for duty k (duty_ids
+    order), `protected` the same for within-hours rows held by their default
+    employee. Calendar masks (weekend, scoreable, strict_special) run along the
+    day axis. Scores, spreads and window sums are reductions over these arrays;
+    rows outside [first_day, last_day] or for unknown employees/duties are
+    ignored. Read-only: the engine's live scores stay in ScoreLedger.
+    """
+    def __init__(self, employee_ids, catalog, calendar, rows, first_day, last_day, row_days=None):
+        """rows: internal rows (ordinal 'day', see compile_rows), or DB rows with their days in row_days (see ordinal_days)."""
+        if np is None: raise RuntimeError("ScoreMatrix needs numpy")
+        self.employee_ids = list(employee_ids)
+        self.duty_ids = [d['id'] for d in catalog.duties]
+        self.catalog = catalog
+        self.first_day = first_day
+        n_days = max(0, last_day - first_day + 1)
+
+        days = range(first_day, first_day + n_days)
+        self.weekend = np.array([day_weekday(d) in (5, 6) for d in days], dtype=bool)
+        self.scoreable = np.array([calendar.is_scoreable(d) for d in days], dtype=bool)
+        self.strict_special = np.array([calendar.is_strict_special(d) for d in days], dtype=bool)
+        # First day index of every ISO week in range (weeks are contiguous Mon-Sun runs)
+        self.week_starts = np.array([i for i, d in enumerate(days) if i == 0 or day_weekday(d) == 0], dtype=np.intp)
+
+        if row_days is None: row_days = np.array([r['day'] for r in rows], dtype=np.int64)
+        emp_pos = {eid: i for i, eid in enumerate(self.employee_ids)}
+        duty_pos = {d: k for k, d in enumerate(self.duty_ids)}
+        emp = np.array([emp_pos.get(r.get('employee_id'), -1) for r in rows], dtype=np.intp)
+        duty = np.array([duty_pos.get(int(r['duty_id']), -1) for r in rows], dtype=np.intp)
+        shift = np.array([int(r.get('shift_index') or 0) for r in rows], dtype=np.intp)
+        day = np.asarray(row_days, dtype=np.intp) - first_day
+        n_emp, n_duties = len(self.employee_ids), len(self.duty_ids)
+        keep = (emp >= 0) & (duty >= 0) & (day >= 0) & (day < n_days)
+        emp, duty, shift, day = emp[keep], duty[keep], shift[keep], day[keep]
+
+        # Within-hours default employee per (duty, shift) position, -1 where there is none
+        width = max([len(d.get('shift_config') or ()) for d in catalog.duties] + [1])
+        owner = np.full((max(n_duties, 1), width), -1, dtype=np.intp)
+        for k, duty_id in enumerate(self.duty_ids):
+            for sh in range(width):
+                conf = catalog.conf(duty_id, sh)
+                if conf.get('is_within_hours') and conf.get('default_employee_id') in emp_pos:
+                    owner[k, sh] = emp_pos[conf['default_employee_id']]
+        in_table = (shift >= 0) & (shift < width)
+        protected = in_table & (owner[duty, np.where(in_table, shift, 0)] == emp)
+
+        shape = (n_emp, n_days, n_duties)
+        self.counts = np.zeros(shape, dtype=np.int32)
+        self.protected = np.zeros(shape, dtype=np.int32)
+        np.add.at(self.counts, (emp, day, duty), 1)
+        np.add.at(self.protected, (emp[protected], day[protected], duty[protected]), 1)
+
+    def duty_mask(self, duty_ids):
+        return np.array([d in duty_ids for d in self.duty_ids], dtype=bool)
+
+    def _window(self, first_day=None, last_day=None):
+        lo = 0 if first_day is None else max(0, first_day - self.first_day)
+        hi = self.counts.shape[1] if last_day is None else max(0, last_day - self.first_day + 1)
+        return slice(lo, hi)
+
+    def on_days(self, day_mask=None, first_day=None, last_day=None):
+        """E x K rows held on the masked days of the window."""
+        w = self._window(first_day, last_day)
+        counts = self.counts[:, w]
+        if day_mask is None: return counts.sum(axis=1)
+        return np.einsum('edk,d->ek', counts, day_mask[w].astype(np.int32))
+
+    def scored(self, first_day=None, last_day=None):
+        """
+        E x K rows that score (balance ledger rule): weekly duties only on
+        scoreable days, within-hours rows of their default employee only on
+        scoreable days, everything else always.
+        """
+        w = self._window(first_day, last_day)
+        off_days = (~self.scoreable[w]).astype(np.int32)
+        all_rows = self.counts[:, w].sum(axis=1)
+        unscored = np.einsum('edk,d->ek', self.protected[:, w], off_days)
+        weekly = self.duty_mask(self.catalog.weekly_ids)
+        unscored[:, weekly] = np.einsum('edk,d->ek', self.counts[:, w][:, :, weekly], off_days)
+        return all_rows - unscored
+
+    def weeks_worked(self, first_day=None, last_day=None):
+        """E x K distinct ISO weeks with at least one row (how weekly duties are counted)."""
+        w = self._window(first_day, last_day)
+        starts = self.week_starts[(self.week_starts >= w.start) & (self.week_starts < w.stop)] - w.start
+        counts = self.counts[:, w]
+        if counts.shape[1] == 0: return np.zeros((counts.shape[0], counts.shape[2]), dtype=np.int32)
+        if not len(starts) or starts[0] != 0: starts = np.concatenate(([0], starts))
+        return (np.add.reduceat(counts, starts, axis=1) > 0).sum(axis=1)
+
+    def scores(self, duty_ids, first_day=None, last_day=None, day_mask=None, scored=True):
+        """Per-employee score vector over duty_ids: scored rows (or, with day_mask, rows on those days)."""
+        per_duty = self.on_days(day_mask, first_day, last_day) if day_mask is not None or not scored \
+            else self.scored(first_day, last_day)
+        return per_duty[:, self.duty_mask(duty_ids)].sum(axis=1)
+
+    @staticmethod
+    def spread(vector):
+        return int(vector.max() - vector.min()) if len(vector) else 0
+
+class RotationQueue:
+    """
+    One rotation queue: the `current` round (front = next in line) and the
+    `next` round (already served, in serving order), as deques with a per-round
+    instance-count map, so membership and count checks are O(1).
+    The healing steps (prune / missing / keep_only / promote / reset) are the
+    same rules get_q always applied; to_json() gives back the two lists stored
+    in rotation_queues / next_round_queues.
+    """
+    def __init__(self, current=(), next_round=()):
+        self.current = deque(int(x) for x in current)
+        self.next = deque(int(x) for x in next_round)
+        self._counts = ({}, {})
+        for counts, dq in zip(self._counts, (self.current, self.next)):
+            for eid in dq: counts[eid] = counts.get(eid, 0) + 1
+
+    @classmethod
+    def from_json(cls, state, key):
+        """state = (rotation_queues, next_round_queues) as loaded from JSON."""
+        rotation_queues, next_round_queues = state
+        return cls(rotation_queues.get(key) or [], next_round_queues.get(key) or [])
+
+    def to_json(self):
+        return list(self.current), list(self.next)
+
+    def _inc(self, which, eid, n=1):
+        counts = self._counts[which]
+        c = counts.get(eid, 0) + n
+        if c: counts[eid] = c
+        else: del counts[eid]
+
+    def in_current(self, eid):
+        return eid in self._counts[0]
+
+    def in_next(self, eid):
+        return eid in self._counts[1]
+
+    def count(self, eid):
+        return self._counts[0].get(eid, 0) + self._counts[1].get(eid, 0)
+
+    def candidates(self):
+        return list(self.current) + list(self.next)
+
+    def ids(self):
+        return set(self._counts[0]) | set(self._counts[1])
+
+    @staticmethod
+    def _remove_last(dq, eid):
+        dq.reverse(); dq.remove(eid); dq.reverse()
+
+    def prune(self, target_count):
+        """Drop instances above target_count, latest first (next round, then current). Returns {eid: excess}."""
+        pruned = {}
+        for eid in self.ids():
+            excess = self.count(eid) - target_count
+            if excess <= 0: continue
+            pruned[eid] = excess
+            for _ in range(excess):
+                if self.in_next(eid):
+                    self._remove_last(self.next, eid); self._inc(1, eid, -1)
+                else:
+                    self._remove_last(self.current, eid); self._inc(0, eid, -1)
+        return pruned
+
+    def missing(self, eligible_ids, target_count):
+        """Instances needed to bring every eligible id up to target_count, in eligible_ids order."""
+        to_add = []
+        for eid in eligible_ids:
+            needed = target_count - self.count(eid)
+            if needed > 0: to_add.extend([eid] * needed)
+        return to_add
+
+    def extend(self, eids):
+        for eid in eids:
+            self.current.append(eid); self._inc(0, eid)
+
+    def keep_only(self, allowed):
+        """Remove every instance whose id fails `allowed(eid)`, keeping order."""
+        if all(allowed(eid) for eid in self.ids()): return
+        for which, dq in ((0, self.current), (1, self.next)):
+            kept = [eid for eid in dq if allowed(eid)]
+            dq.clear(); dq.extend(kept)
+            self._counts[which].clear()
+            for eid in kept: self._inc(which, eid)
+
+    def promote(self, order):
+        """Next round becomes the current one, one instance per id, in `order`."""
+        promoted = [eid for eid in order if self.in_next(eid)]
+        self.next.clear(); self._counts[1].clear()
+        self.current.clear(); self._counts[0].clear()
+        self.extend(promoted)
+
+    def reset(self, eids):
+        self.current.clear(); self._counts[0].clear()
+        self.extend(eids)
+
+    def served(self, eid):
+        """Move the first instance of eid to the end of the next round."""
+        if self.in_current(eid):
+            self.current.remove(eid); self._inc(0, eid, -1)
+        elif self.in_next(eid):
+            self.next.remove(eid); self._inc(1, eid, -1)
+        else:
+            return
+        self.next.append(eid); self._inc(1, eid)
+
+class MinCostFlow:
+    """
+    Pure-Python min-cost flow (successive shortest paths with potentials).
+    Edge costs may be negative if the graph has no negative cycle: the first
+    potentials come from Bellman-Ford, later rounds run Dijkstra on reduced
+    costs. solve() augments while the cheapest source-sink path still has
+    negative cost, i.e. it finds the cheapest flow of any size.
+    """
+    def __init__(self, n):
+        self.graph = [[] for _ in range(n)]  # edge = [to, cap, cost, index of reverse edge]
+
+    def add_node(self):
+        self.graph.append([])
+        return len(self.graph) - 1
+
+    def add_edge(self, u, v, cap, cost):
+        self.graph[u].append([v, cap, cost, len(self.graph[v])])
+        self.graph[v].append([u, 0, -cost, len(self.graph[u]) - 1])
+        return u, len(self.graph[u]) - 1
+
+    def flow(self, handle):
+        u, i = handle
+        to, _, _, rev = self.graph[u][i]
+        return self.graph[to][rev][1]
+
+    def _initial_potentials(self, source):
+        INF = float('inf')
+        pot = [INF] * len(self.graph)
+        pot[source] = 0
+        queue = deque([source]); queued = {source}
+        while queue:
+            u = queue.popleft(); queued.discard(u)
+            for v, cap, cost, _ in self.graph[u]:
+                if cap > 0 and pot[u] + cost < pot[v]:
+                    pot[v] = pot[u] + cost
+                    if v not in queued: queue.append(v); queued.add(v)
+        # Nodes unreachable now stay unreachable: flow only ever passes reachable nodes
+        return [p if p != INF else 0 for p in pot]
+
+    def solve(self, source, sink):
+        """Returns (units of flow, total cost)."""
+        graph = self.graph
+        pot = self._initial_potentials(source)
+        total_flow = total_cost = 0
+        while True:
+            dist = {source: 0}
+            prev = {}
+            heap = [(0, source)]
+            done = set()
+            while heap:
+                d, u = heapq.heappop(heap)
+                if u in done: continue
+                done.add(u)
+                pu = pot[u]
+                for i, (v, cap, cost, _) in enumerate(graph[u]):
+                    if cap <= 0 or v in done: continue
+                    nd = d + cost + pu - pot[v]
+                    if nd < dist.get(v, nd + 1):
+                        dist[v] = nd; prev[v] = (u, i)
+                        heapq.heappush(heap, (nd, v))
+            if sink not in done: break
+            path_cost = dist[sink] + pot[sink] - pot[source]
+            if path_cost >= 0: break
+            for v in done: pot[v] += dist[v]
+
+            push = None; v = sink
+            while v != source:
+                u, i = prev[v]
+                push = graph[u][i][1] if push is None else min(push, graph[u][i][1])
+                v = u
+            v = sink
+            while v != source:
+                u, i = prev[v]
+                edge = graph[u][i]
+                edge[1] -= push
+                graph[v][edge[3]][1] += push
+                v = u
+            total_flow += push; total_cost += push * path_cost
+        return total_flow, total_cost
+
 def get_staff_users(cursor):
     # Updated: Ordered by seniority ASC (Least Senior First) as requested
     cursor.execute("SELECT id, name, surname, seniority FROM users WHERE role = 'staff' ORDER BY seniority ASC, id ASC")
@@ -81,7 +837,7 @@ def get_staff_users(cursor):
         'surname': u['surname'] or ''
     } for u in users]
 
-def load_state_for_scheduler(start_date=None, *args, **kwargs):
+def load_state_for_scheduler(start_date=None, end_date=None, *args, **kwargs):
     conn = get_db()
     if not conn: return None
     cur = conn.cursor(cursor_factory=RealDictCursor)
@@ -95,6 +851,9 @@ def load_state_for_scheduler(start_date=None, *args, **kwargs):
         # New History State Table
         cur.execute("CREATE TABLE IF NOT EXISTS scheduler_history_state (month DATE PRIMARY KEY, rotation_queues JSONB, next_round_queues JSONB)")
         
+        # Last month a multi-month run completed (see run_scheduler_months), so it can resume after a failure
+        cur.execute("CREATE TABLE IF NOT EXISTS scheduler_run_checkpoints (start_month DATE, end_month DATE, completed_month DATE, PRIMARY KEY (start_month, end_month))")
+        
         conn.commit()
     except Exception as e:
         print(f"Error initializing table: {e}", flush=True)
@@ -103,11 +862,31 @@ def load_state_for_scheduler(start_date=None, *args, **kwargs):
     employees = get_staff_users(cur)
     cur.execute("SELECT * FROM duties ORDER BY id")
     duties = cur.fetchall()
-    cur.execute("SELECT * FROM schedule")
-    schedule = cur.fetchall()
+
+    special_dates = []
+    try:
+        cur.execute("SELECT date FROM special_dates")
+        rows = cur.fetchall()
+        special_dates = [str(r['date']) for r in rows]
+    except: conn.rollback()
+
+    if start_date and end_date:
+        # History window: what the balancing windows read, plus older rows on
+        # special dates (exact or recurring 2000-MM-DD) for the special-date scores.
+        window_start = history_window_start(start_date, end_date)
+        recurring = [d[5:] for d in special_dates if d.startswith('2000-')]
+        cur.execute("SELECT * FROM schedule WHERE date >= %s OR date::text = ANY(%s::text[]) OR to_char(date, 'MM-DD') = ANY(%s::text[])",
+                    (window_start, special_dates, recurring))
+        schedule = cur.fetchall()
+        cur.execute("SELECT * FROM unavailability WHERE date >= %s AND date <= %s",
+                    (start_date - timedelta(days=1), end_date + timedelta(days=1)))
+        unavail = cur.fetchall()
+    else:
+        cur.execute("SELECT * FROM schedule")
+        schedule = cur.fetchall()
+        cur.execute("SELECT * FROM unavailability")
+        unavail = cur.fetchall()
     for s in schedule: s['date'] = str(s['date'])
-    cur.execute("SELECT * FROM unavailability")
-    unavail = cur.fetchall()
     for u in unavail: u['date'] = str(u['date'])
     
     # --- LOAD STATE (PERSISTENCE LOGIC) ---
@@ -136,13 +915,6 @@ def load_state_for_scheduler(start_date=None, *args, **kwargs):
             print(f"Error loading history state: {e}", flush=True)
 
     
-    special_dates = []
-    try:
-        cur.execute("SELECT date FROM special_dates")
-        rows = cur.fetchall()
-        special_dates = [str(r['date']) for r in rows]
-    except: pass
-    
     preferences = {}
     preferences = {}
     if start_date:
@@ -175,14 +947,26 @@ def calculate_db_balance(start_str=None, end_str=None):
         for r in cur.fetchall(): special_dates_set.add(str(r['date']))
     except: pass
     conn.close()
-    
-    # 1. Determine Date Range
+
+    if np is not None: return balance_stats_matrix(employees, duties, schedule, special_dates_set, start_str, end_str)
+    return balance_stats(employees, duties, schedule, special_dates_set, start_str, end_str)
+
+def balance_view(start_str=None, end_str=None):
+    """('YYYY-MM', 'YYYY-MM') -> (first, last) date of the balance view; everything without a range."""
     if start_str and end_str:
         view_start = dt.strptime(start_str, '%Y-%m').date().replace(day=1)
         end_dt = dt.strptime(end_str, '%Y-%m').date()
         view_end = (end_dt + relativedelta(months=1)) - timedelta(days=1)
     else:
         view_start = dt.min.date(); view_end = dt.max.date()
+    return view_start, view_end
+
+def balance_stats(employees, duties, schedule, special_dates_set, start_str=None, end_str=None):
+    """Per-employee balance report (see calculate_db_balance), row by row."""
+    catalog = DutyCatalog(duties)
+
+    # 1. Determine Date Range
+    view_start, view_end = balance_view(start_str, end_str)
 
     # 2. Initialize Stats
     stats = {
@@ -200,41 +984,36 @@ def calculate_db_balance(start_str=None, end_str=None):
     
     # --- STEP A: APPLY BASE HANDICAPS (Static Offset) ---
     for e in employees:
-        eid_str = str(e['id'])
         for d in duties:
             if d.get('is_off_balance'): continue 
-            
-            for conf in d.get('shift_config', []):
-                val = int(conf.get('handicaps', {}).get(eid_str, 0))
-                if val > 0:
-                    stats[e['id']]['effective_total'] += val
-
-    # Helper for strict special date check
-    def check_special(d_date):
-        if str(d_date) in special_dates_set: return True
-        recurring_key = f"2000-{d_date.strftime('%m-%d')}"
-        if recurring_key in special_dates_set: return True
-        return False
+            stats[e['id']]['effective_total'] += catalog.handicap(d['id'], e['id'], positive_only=True)
 
-    # --- STEP B: PROCESS SCHEDULE ---
+    # Calendar for the rows in view (strict special / scoreable / ISO week lookups)
+    view_first, view_last = view_start.toordinal(), view_end.toordinal()
+    row_days = []
     for s in schedule:
+        try: row_days.append(to_day(s['date']))
+        except (TypeError, ValueError): row_days.append(None)
+    in_view = [d for d in row_days if d is not None and view_first <= d <= view_last]
+    calendar = HorizonCalendar(special_dates_set, min(in_view, default=view_first), max(in_view, default=view_first - 1))
+
+    # --- STEP B: PROCESS SCHEDULE ---
+    for s, s_day in zip(schedule, row_days):
         eid = s['employee_id']
         if not eid or eid not in stats: continue
         
         try:
-            s_date = dt.strptime(str(s['date']), '%Y-%m-%d').date()
-            if s_date < view_start or s_date > view_end: continue
+            if s_day is None or s_day < view_first or s_day > view_last: continue
             
-            duty = next((d for d in duties if d['id'] == s['duty_id']), None)
+            duty = catalog.get(s['duty_id'])
             if not duty: continue
             
-            shift_idx = int(s.get('shift_index', 0))
-            conf = duty['shift_config'][shift_idx] if duty.get('shift_config') and len(duty['shift_config']) > shift_idx else {}
+            conf = catalog.conf(duty['id'], s.get('shift_index', 0))
 
             # --- LOGIC A: WEEKLY DUTIES ---
             if duty.get('is_weekly'):
                 # 1. Update Counter (Count unique weeks for display)
-                iso_year, iso_week, _ = s_date.isocalendar()
+                iso_year, iso_week = calendar.week(s_day)
                 week_key = f"{duty['id']}_{iso_year}_{iso_week}"
                 
                 if week_key not in stats[eid]['_seen_weeks']:
@@ -242,12 +1021,12 @@ def calculate_db_balance(start_str=None, end_str=None):
                     stats[eid]['_seen_weeks'].add(week_key)
 
                 # 1b. Special-date counter (each individual strictly special day)
-                if check_special(s_date):
+                if calendar.is_strict_special(s_day):
                     stats[eid]['special_date_counts'][duty['id']] += 1
 
                 # 2. Update Score (Only on Scoreable Days: Sat/Sun/Special)
                 if not duty.get('is_off_balance'):
-                    if is_scoreable_day(s_date, special_dates_set):
+                    if calendar.is_scoreable(s_day):
                         stats[eid]['total'] += 1
                         stats[eid]['effective_total'] += 1
                         # SK Score: weekly duties on scoreable days count
@@ -262,7 +1041,7 @@ def calculate_db_balance(start_str=None, end_str=None):
             stats[eid]['duty_counts'][duty['id']] += 1
 
             # Special-date counter (each individual strictly special day)
-            if check_special(s_date):
+            if calendar.is_strict_special(s_day):
                 stats[eid]['special_date_counts'][duty['id']] += 1
             
             # Checks for Score
@@ -271,7 +1050,7 @@ def calculate_db_balance(start_str=None, end_str=None):
             
             # Protected Default Logic: Don't score M-F for default owner
             if conf.get('is_within_hours') and conf.get('default_employee_id') == eid:
-                if not is_scoreable_day(s_date, special_dates_set):
+                if not calendar.is_scoreable(s_day):
                     continue
 
             # Add Score
@@ -279,15 +1058,15 @@ def calculate_db_balance(start_str=None, end_str=None):
             stats[eid]['effective_total'] += 1 
             
             # SK Score (Weekends for Weekly and Daily duties)
-            if not duty.get('is_special') and not duty.get('is_off_balance') and is_scoreable_day(s_date, special_dates_set):
+            if not duty.get('is_special') and not duty.get('is_off_balance') and calendar.is_scoreable(s_day):
                 stats[eid]['sk_score'] += 1
 
         except: pass
 
     # 4. Clean up and compute combined special scores
     final_stats = []
-    normal_ids = set(d['id'] for d in duties if not d.get('is_off_balance') and not d.get('is_special'))
-    offbal_ids = set(d['id'] for d in duties if d.get('is_off_balance') and not d.get('is_special'))
+    normal_ids = catalog.normal_ids
+    offbal_ids = catalog.off_balance_scored_ids
     for s in stats.values():
         del s['_seen_weeks']
         s['special_normal'] = sum(v for k, v in s['special_date_counts'].items() if k in normal_ids)
@@ -296,83 +1075,305 @@ def calculate_db_balance(start_str=None, end_str=None):
 
     return final_stats
 
+def balance_stats_matrix(employees, duties, schedule, special_dates_set, start_str=None, end_str=None):
+    """balance_stats() computed on a ScoreMatrix: same report, vectorized reductions instead of the row loop."""
+    catalog = DutyCatalog(duties)
+    view_start, view_end = balance_view(start_str, end_str)
+    view_first, view_last = view_start.toordinal(), view_end.toordinal()
+
+    emp_ids = [e['id'] for e in employees]
+    schedule = [s for s in schedule if s.get('date') and s.get('duty_id') is not None]
+    row_days = ordinal_days(s['date'] for s in schedule)
+    in_view = row_days[(row_days >= view_first) & (row_days <= view_last)]
+    first = int(in_view.min()) if len(in_view) else view_first; last = int(in_view.max()) if len(in_view) else view_first - 1
+    m = ScoreMatrix(emp_ids, catalog, HorizonCalendar(special_dates_set, first, last), schedule, first, last, row_days)
+
+    duty_ids = m.duty_ids
+    weekly = m.duty_mask(catalog.weekly_ids)
+    per_row = m.counts.sum(axis=1)                                       # E x K rows held
+    duty_counts = np.where(weekly, m.weeks_worked(), per_row)            # weekly duties: distinct ISO weeks
+    special_counts = m.on_days(m.strict_special)
+    totals = m.scored()[:, ~m.duty_mask(catalog.off_balance_ids)].sum(axis=1)
+    sk = m.on_days(m.scoreable)[:, m.duty_mask(catalog.normal_ids)].sum(axis=1)
+    special_normal = special_counts[:, m.duty_mask(catalog.normal_ids)].sum(axis=1)
+    special_offbalance = special_counts[:, m.duty_mask(catalog.off_balance_scored_ids)].sum(axis=1)
+
+    final_stats = []
+    for i, e in enumerate(employees):
+        handicap = sum(catalog.handicap(d['id'], e['id'], positive_only=True) for d in duties if not d.get('is_off_balance'))
+        final_stats.append({
+            'name': e['name'],
+            'total': int(totals[i]),
+            'effective_total': int(totals[i]) + handicap,
+            'sk_score': int(sk[i]),
+            'duty_counts': {d: int(duty_counts[i, k]) for k, d in enumerate(duty_ids)},
+            'special_date_counts': {d: int(special_counts[i, k]) for k, d in enumerate(duty_ids)},
+            'special_normal': int(special_normal[i]),
+            'special_offbalance': int(special_offbalance[i]),
+        })
+    return final_stats
+
 # ==========================================
 # 6. SCHEDULER ALGORITHM (TRANSLATED & CLEAN LOGS)
 # ==========================================
-def run_auto_scheduler_logic(db, start_date, end_date):
-    logs = []
-    
-    def log(msg):
-        timestamp = dt.now().strftime('%H:%M:%S.%f')[:-3]
-        log_entry = f"[{timestamp}] {msg}"
-        logs.append(log_entry)
-        print(f"[SCHEDULER] {log_entry}", flush=True) 
-    
-    employees = [{'id': int(e['id']), 'name': e['name']} for e in db['employees']]
-    emp_map = {e['id']: e['name'] for e in employees}
-    double_duty_prefs = db.get('preferences', {})
-    
-    if not employees:
-        log("❌ ΣΦΑΛΜΑ: Δεν βρέθηκαν υπάλληλοι.")
-        return [], {"rotation_queues": {}, "next_round_queues": {}, "logs": logs}
-    
-    log(f"🏁 ΕΚΚΙΝΗΣΗ ΧΡΟΝΟΠΡΟΓΡΑΜΜΑΤΙΣΤΗ: {start_date.strftime('%Y-%m')}")
-    log(f"ℹ️  Υπάλληλοι: {len(employees)}")
-    log(f"ℹ️  Σειρά Εργαζομένων (Top 5): {[e['name'] for e in employees[:5]]}")
-    log(f"ℹ️  Προτιμήσεις Διπλοβάρδιας: {len(double_duty_prefs)} άτομα")
-    
-    duties = db['service_config']['duties']
-    special_dates_set = set(db['service_config'].get('special_dates', []))
-    
-    raw_schedule = db['schedule']; schedule = []; history = []
-    
-    locked_count = 0
-    for s in raw_schedule:
-        try:
-            s_date = dt.strptime(s['date'], '%Y-%m-%d').date()
-            if start_date <= s_date <= end_date:
+# Log verbosity: summary = phase headers & outcomes, phase = + assignments/swaps,
+# trace = + queue healing and double-duty diagnostics
+LOG_SUMMARY, LOG_PHASE, LOG_TRACE = 0, 1, 2
+LOG_LEVELS = {'summary': LOG_SUMMARY, 'phase': LOG_PHASE, 'trace': LOG_TRACE}
+
+class RunMetrics:
+    """
+    Wall time and counters per phase of one scheduler run, returned as
+    res_meta['metrics']. begin() closes the open phase and starts a new one;
+    every phase carries the same counters (iterations are balancing rounds,
+    placed/unfilled are slots of the assignment phases).
+    """
+    COUNTERS = ('iterations', 'swaps_attempted', 'swaps_performed', 'placed', 'unfilled')
+
+    def __init__(self):
+        self.phases = []
+        self.busy_calls = 0
+        self._t0 = time.perf_counter()
+        self._open = None
+
+    def begin(self, name):
+        self.end()
+        self._open = {'name': name, **dict.fromkeys(self.COUNTERS, 0),
+                      '_t0': time.perf_counter(), '_busy0': self.busy_calls}
+        self.phases.append(self._open)
+
+    def end(self, final_spread=None):
+        p = self._open
+        if p is None: return
+        p['wall_ms'] = round((time.perf_counter() - p.pop('_t0')) * 1000, 3)
+        p['busy_calls'] = self.busy_calls - p.pop('_busy0')
+        if final_spread is not None: p['final_spread'] = final_spread
+        self._open = None
+
+    def count(self, key, n=1):
+        if self._open is not None: self._open[key] += n
+
+    def set(self, key, value):
+        if self._open is not None: self._open[key] = value
+
+    def to_json(self):
+        self.end()
+        totals = {k: sum(p[k] for p in self.phases) for k in self.COUNTERS}
+        final_spreads = {}
+        for p in self.phases:
+            if 'final_spread' in p: final_spreads[p['name']] = p['final_spread']
+            # Multi-dimension phases (local search) report one spread per score dimension
+            for dim, spread in p.get('final_spreads', {}).items(): final_spreads[f"{p['name']}.{dim}"] = spread
+        return {
+            'total_ms': round((time.perf_counter() - self._t0) * 1000, 3),
+            'is_user_busy_calls': self.busy_calls,
+            'swaps_attempted': totals['swaps_attempted'],
+            'swaps_performed': totals['swaps_performed'],
+            'unfilled_slots': totals['unfilled'],
+            'final_spreads': final_spreads,
+            'phases': self.phases,
+        }
+
+class CancelToken:
+    """Cooperative cancellation flag for a running scheduler; cancel() may be called from any thread."""
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+# run_balance engines: 'swap' = iterative donor/receiver swaps, 'flow' = min-cost-flow moves
+BALANCERS = ('swap', 'flow')
+
+# Phase 2 slot filling: 'greedy' = slot by slot from the queue, 'matching' = whole day as a min-cost matching
+DAILY_ASSIGNERS = ('greedy', 'matching')
+# Matching cost of one point of normal score above the lowest, in queue positions
+MATCHING_SCORE_WEIGHT = 8
+
+# Local-search objective: sum over score dimensions of weight * sum(score^2)
+OBJECTIVE_WEIGHTS = {'normal': 1.0, 'off_balance': 1.0, 'special_normal': 2.0, 'special_off_balance': 1.0, 'sk': 2.0}
+
+class SchedulerRun:
+    """
+    State of one run_auto_scheduler_logic run, shared by its stages: period rows and
+    history, the occupancy/slot/swap indexes, live score ledgers, rotation queues, RNG,
+    logs and metrics. Setup runs here; the stage functions (SCHEDULER_STAGES) take the
+    run and work through its helpers (place/reassign, get_q, the balancers).
+    """
+    def __init__(self, db, start_date, end_date, log_level='trace', log_flush=True, seed=None, balancer='swap',
+                 optimize_budget=0, optimize_max_moves=None, deadline=None, cancel_token=None,
+                 daily_assign='greedy', phases=None):
+        self.end_date = end_date; self.seed = seed; self.log_flush = log_flush
+        self.balancer = balancer; self.daily_assign = daily_assign
+        self.optimize_budget = optimize_budget; self.optimize_max_moves = optimize_max_moves
+        self.deadline = deadline; self.cancel_token = cancel_token
+        self.logs = []
+        self.metrics = RunMetrics()
+        # All randomness goes through this private RNG: same inputs + same seed -> same schedule.
+        # Without a seed one is drawn, and it is returned in res_meta['seed'] to replay the run.
+        if self.seed is None: self.seed = random.SystemRandom().randrange(2**32)
+        self.rng = random.Random(self.seed)
+        if log_level not in LOG_LEVELS:
+            raise ValueError(f"Unknown log_level: {log_level}")
+        self.verbosity = LOG_LEVELS[log_level]
+        if self.balancer not in BALANCERS:
+            raise ValueError(f"Unknown balancer: {self.balancer}")
+        if self.daily_assign not in DAILY_ASSIGNERS:
+            raise ValueError(f"Unknown daily_assign: {self.daily_assign}")
+        # A subset of stages touches up the stored schedule: its unlocked rows are kept, and
+        # assignment stages only fill empty slots
+        self.selected_stages = resolve_stages(phases)
+        keep_schedule = phases is not None
+
+        # Anytime execution: every phase loop polls should_stop() (deadline is a time.monotonic()
+        # value). A stopped phase keeps what it has placed/swapped, later phases do nothing, and
+        # res_meta reports the reason and the phases that were cut short.
+        self.stop = {'reason': None, 'cut_short': []}
+
+        # surname / real_name (get_staff_users) order the off-balance queues
+        self.employees = [{'id': int(e['id']), 'name': e['name'], 'surname': e.get('surname') or '', 'real_name': e.get('real_name') or e['name']}
+                          for e in db['employees']]
+        self.emp_map = {e['id']: e['name'] for e in self.employees}
+        self.emp_ids = [e['id'] for e in self.employees]
+        self.double_duty_prefs = db.get('preferences', {})
+
+        if not self.employees:
+            self.log("❌ ΣΦΑΛΜΑ: Δεν βρέθηκαν υπάλληλοι.", LOG_SUMMARY)
+            return
+
+        self.metrics.begin('setup')
+        self.log(f"🏁 ΕΚΚΙΝΗΣΗ ΧΡΟΝΟΠΡΟΓΡΑΜΜΑΤΙΣΤΗ: {start_date.strftime('%Y-%m')}", LOG_SUMMARY)
+        self.log(f"ℹ️  Υπάλληλοι: {len(self.employees)}", LOG_SUMMARY)
+        self.log(f"ℹ️  Σειρά Εργαζομένων (Top 5): {[e['name'] for e in self.employees[:5]]}", LOG_SUMMARY)
+        self.log(f"ℹ️  Προτιμήσεις Διπλοβάρδιας: {len(self.double_duty_prefs)} άτομα", LOG_SUMMARY)
+        self.log(f"ℹ️  Seed: {self.seed}", LOG_SUMMARY)
+
+        self.duties = db['service_config']['duties']
+        self.catalog = DutyCatalog(self.duties)
+        self.special_dates_set = set(db['service_config'].get('special_dates', []))
+
+        # Dates become integer day ordinals once here; see to_day()/serialize_rows()
+        self.start_day = start_date.toordinal(); self.end_day = self.end_date.toordinal()
+        self.schedule = []; self.history = []
+        rows = compile_rows(db['schedule'])
+
+        # Calendar from the history window (see history_window_start) to the last stored row.
+        # Older days only come up for special-date rows and are computed on demand.
+        window_day = history_window_start(start_date, self.end_date).toordinal()
+        self.calendar = HorizonCalendar(self.special_dates_set, window_day, max([s['day'] for s in rows] + [self.end_day]))
+
+        locked_count = 0
+        for s in rows:
+            if self.start_day <= s['day'] <= self.end_day:
                 if s.get('manually_locked'): 
-                    schedule.append(s)
+                    self.schedule.append(s)
                     locked_count += 1
-            else: 
-                history.append(s)
-        except: pass
-        
-    log(f"🔒 Διατηρήθηκαν {locked_count} κλειδωμένες βάρδιες.")
+                elif keep_schedule:
+                    self.schedule.append(s)
+            elif s['day'] >= window_day or self.calendar.is_strict_special(s['day']):
+                self.history.append(s)
 
-    unavail_map = {(int(u['employee_id']), str(u['date'])) for u in db['unavailability']}
-    rot_q = db['service_config']['rotation_queues']
-    nxt_q = db['service_config']['next_round_queues']
+        self.log(f"🔒 Διατηρήθηκαν {locked_count} κλειδωμένες βάρδιες.", LOG_SUMMARY)
+        if keep_schedule:
+            self.log(f"🧩 Φάσεις: {', '.join(self.selected_stages)} (πάνω στις {len(self.schedule) - locked_count} υπάρχουσες βάρδιες)", LOG_SUMMARY)
+        self.log(f"📚 Ιστορικό: {len(self.history)} βάρδιες (από {day_str(window_day)} + αργίες).", LOG_SUMMARY)
 
-    for d in duties:
-        if d.get('shifts_per_day') is None: d['shifts_per_day'] = 1
-        if d.get('shift_config') is None: d['shift_config'] = []
-        while len(d['shift_config']) < d['shifts_per_day']: d['shift_config'].append({})
-
-    # --- Helpers ---
-    def is_user_busy(eid, check_date, current_schedule, ignore_yesterday=False, ignore_tomorrow=False):
-        d_str = check_date.strftime('%Y-%m-%d')
-        prev_str = (check_date - timedelta(days=1)).strftime('%Y-%m-%d')
-        next_str = (check_date + timedelta(days=1)).strftime('%Y-%m-%d')
-        for s in current_schedule + history:
-            if int(s['employee_id']) == eid:
-                # Only normal and weekly duties count — off-balance and special are ignored
-                d_o = next((d for d in duties if d['id']==int(s['duty_id'])), None)
-                if d_o and (d_o.get('is_off_balance') or d_o.get('is_special')): continue
-                if s['date'] == d_str: return f"Εργάζεται σήμερα ({d_o.get('name', 'Unknown')})"
-                if not ignore_yesterday and s['date'] == prev_str: return f"Εργάστηκε χθες ({d_o.get('name', 'Unknown')})"
-                if not ignore_tomorrow and s['date'] == next_str: return f"Έχει βάρδια αύριο ({d_o.get('name', 'Unknown')})"
-        return False
+        self.unavail_map = {(int(u['employee_id']), to_day(u['date'])) for u in db['unavailability']}
+        self.rot_q = db['service_config']['rotation_queues']
+        self.nxt_q = db['service_config']['next_round_queues']
+
+        # --- Indexes ---
+        self.occupancy = OccupancyIndex(self.catalog)
+        for s in self.history + self.schedule: self.occupancy.add(s)
+        self.slot_index = SlotIndex(self.schedule)
+        self.history_slot_index = SlotIndex(self.history)
+        # Balancer swap candidates; schedule only holds rows inside [start_day, end_day]
+        self.swap_index = SwapIndex(self.calendar, self.schedule)
+
+        # Live score ledgers (run_balance, Phase 5, Phase 6) see every placement and swap
+        self.ledgers = []
+
+        self.scoreable = self.calendar.is_scoreable
+        self.strict_special = self.calendar.is_strict_special
 
-    def get_q(key, excluded_ids=[]):
-        cq = rot_q.get(key, []); nq = nxt_q.get(key, [])
-        valid_ids = set(e['id'] for e in employees)
+        self.queues = {}
+        self.valid_ids = set(e['id'] for e in self.employees)
+
+        # --- Balance ledgers (Phase 2 matching, balancing phases) ---
+        self.lookback_day = to_day(balance_lookback_start(start_date))
+
+        self.balance_ledgers = {}
+
+        # Score dimensions for the local search (Phase 9), filled in as the phases open them
+        self.dimension_ledgers = {}
+
+        # Scoreable daily-normal shifts per employee within the period (Phase 5 fallback swaps)
+        self.period_sk = self.open_ledger(self.emp_ids, lambda s, eid: 1 if s['duty_id'] in self.catalog.daily_normal_ids and self.scoreable(s['day']) else 0,
+                                          self.schedule).scores
+    
+    def log(self, msg, level=LOG_PHASE):
+        # msg may be a callable so that disabled levels never pay for the f-string
+        if level > self.verbosity: return
+        if callable(msg): msg = msg()
+        timestamp = dt.now().strftime('%H:%M:%S.%f')[:-3]
+        log_entry = f"[{timestamp}] {msg}"
+        self.logs.append(log_entry)
+        print(f"[SCHEDULER] {log_entry}", flush=self.log_flush) 
+
+    def should_stop(self, phase):
+        if self.stop['reason'] is None:
+            if self.cancel_token is not None and self.cancel_token.cancelled: self.stop['reason'] = 'cancelled'
+            elif self.deadline is not None and time.monotonic() >= self.deadline: self.stop['reason'] = 'deadline'
+            else: return False
+            self.log(f"⏹️ Διακοπή εκτέλεσης ({self.stop['reason']}) στη φάση {phase}. Επιστρέφεται το πρόγραμμα ως έχει.", LOG_SUMMARY)
+        if phase not in self.stop['cut_short']: self.stop['cut_short'].append(phase)
+        return True
+
+    def open_ledger(self, employee_ids, weight, rows, base=None):
+        ledger = ScoreLedger(employee_ids, weight, rows, base)
+        self.ledgers.append(ledger)
+        return ledger
+
+    def place(self, row):
+        self.schedule.append(row)
+        self.occupancy.add(row)
+        self.slot_index.add(row)
+        self.swap_index.add(row)
+        for ledger in self.ledgers: ledger.add(row)
+        self.metrics.count('placed')
+
+    def reassign(self, row, eid):
+        old_eid = row['employee_id']
+        self.occupancy.remove(row)
+        row['employee_id'] = eid
+        self.occupancy.add(row)
+        self.swap_index.move(row, old_eid, eid)
+        for ledger in self.ledgers: ledger.move(row, old_eid, eid)
+
+    def is_user_busy(self, eid, day, ignore_yesterday=False, ignore_tomorrow=False):
+        self.metrics.busy_calls += 1
+        return self.occupancy.busy_reason(eid, day, ignore_yesterday, ignore_tomorrow)
+
+    def queue_for(self, key):
+        if key not in self.queues: self.queues[key] = RotationQueue.from_json((self.rot_q, self.nxt_q), key)
+        return self.queues[key]
+
+    def save_queues(self):
+        for key, q in self.queues.items():
+            self.rot_q[key], self.nxt_q[key] = q.to_json()
+
+    def get_q(self, key, excluded_ids=()):
+        q = self.queue_for(key)
         
         # New Logic: SK Queues
         is_sk_queue = key == "sk_all"
         
         # Log queue state before
-        log(f"   🔢 [Queue {key}] Initial CQ: {[emp_map.get(x, x) for x in cq]}, NQ: {[emp_map.get(x, x) for x in nq]}")
+        self.log(lambda: f"   🔢 [Queue {key}] Initial CQ: {[self.emp_map.get(x, x) for x in q.current]}, NQ: {[self.emp_map.get(x, x) for x in q.next]}", LOG_TRACE)
 
         # HEALING: Universal Queue Normalization
         # - SK Queues: Target = 2 instances per employee (for Double Duty logic)
@@ -382,527 +1383,270 @@ def run_auto_scheduler_logic(db, start_date, end_date):
         
         # 1. Prune Excess (> target_count)
         # Remove from END of combined queue (NQ first, then CQ)
-        counts = {}
-        for x in cq + nq:
-            counts[x] = counts.get(x, 0) + 1
-        
-        for eid, c in counts.items():
-            if c > target_count:
-                excess = c - target_count
-                log(f"   ✂️ [Queue {key}] Pruning {excess} excess instances of {emp_map.get(eid, eid)} (Target: {target_count})")
-                for _ in range(excess):
-                    if eid in nq:
-                        idx = len(nq) - 1 - nq[::-1].index(eid)
-                        nq.pop(idx)
-                    elif eid in cq:
-                        idx = len(cq) - 1 - cq[::-1].index(eid)
-                        cq.pop(idx)
+        for eid, excess in q.prune(target_count).items():
+            self.log(lambda: f"   ✂️ [Queue {key}] Pruning {excess} excess instances of {self.emp_map.get(eid, eid)} (Target: {target_count})", LOG_TRACE)
                         
         # 2. Add Missing (< target_count)
-        all_instances = cq + nq
-        valid_targets = [eid for eid in valid_ids if eid not in excluded_ids]
-        to_add = []
-        for eid in valid_targets:
-            count = all_instances.count(eid)
-            if count < target_count:
-                needed = target_count - count
-                to_add.extend([eid] * needed)
+        to_add = q.missing([eid for eid in self.valid_ids if eid not in excluded_ids], target_count)
         
         if to_add:
-             log(f"   🩹 [Queue {key}] Inflating Queue with missing instances (Target {target_count}): {[emp_map.get(x,x) for x in to_add]}")
-             cq.extend(to_add)
+             self.log(lambda: f"   🩹 [Queue {key}] Inflating Queue with missing instances (Target {target_count}): {[self.emp_map.get(x,x) for x in to_add]}", LOG_TRACE)
+             q.extend(to_add)
 
-        cq = [int(x) for x in cq if int(x) in valid_ids and int(x) not in excluded_ids]
-        nq = [int(x) for x in nq if int(x) in valid_ids and int(x) not in excluded_ids]
-        
-        # Note: The previous logic that calculated 'known' and 'missing' sets is now redundant
-        # because step #2 above ensures every valid employee has at least target_count instances.
+        q.keep_only(lambda x: x in self.valid_ids and x not in excluded_ids)
         
-        if not cq: 
-            if nq: 
-                log(f"   🆙 [Queue {key}] CQ empty. PROMOTING NQ -> CQ.")
-                cq = [e['id'] for e in employees if e['id'] in nq]
-                nq = [] 
+        if not q.current: 
+            if q.next: 
+                self.log(lambda: f"   🆙 [Queue {key}] CQ empty. PROMOTING NQ -> CQ.", LOG_TRACE)
+                q.promote(self.emp_ids)
             else: 
                 # Re-populate from scratch
-                log(f"   🔄 [Queue {key}] Empty. Repopulating full list.")
+                self.log(lambda: f"   🔄 [Queue {key}] Empty. Repopulating full list.", LOG_TRACE)
                 
                 # Determine source list based on queue type
                 # Default: Least Senior First (employees is already sorted this way)
-                source_employees = employees
+                source_employees = self.employees
                 
                 # Off-Balance Check: Sort by Surname ASC
                 if key.startswith("off_") or key.startswith("weekly_off_"):
                      # Sort by surname, then name (Default is ASC)
-                     source_employees = sorted(employees, key=lambda x: (x['surname'], x['real_name']))
+                     source_employees = sorted(self.employees, key=lambda x: (x['surname'], x['real_name']))
                 
-                if is_sk_queue:
-                    valid_all = [e['id'] for e in source_employees if e['id'] not in excluded_ids]
-                    # Append Full List TWICE (non-adjacent)
-                    cq = valid_all + valid_all
-                else:
-                    cq = [e['id'] for e in source_employees if e['id'] not in excluded_ids]
+                valid_all = [e['id'] for e in source_employees if e['id'] not in excluded_ids]
+                # SK: Append Full List TWICE (non-adjacent)
+                q.reset(valid_all + valid_all if is_sk_queue else valid_all)
         
-        rot_q[key] = cq; nxt_q[key] = nq
-        return cq, nq
-
-    def rotate_assigned_user(key, user_id):
-        cq = rot_q.get(key, []); nq = nxt_q.get(key, [])
-        cq = [int(x) for x in cq]; nq = [int(x) for x in nq]
-        if user_id in cq: cq.remove(user_id); nq.append(user_id)
-        elif user_id in nq: nq.remove(user_id); nq.append(user_id)
-        rot_q[key] = cq; nxt_q[key] = nq
-
-    # --- PHASE 0: Workhours ---
-    log("▶️ Φάση 0: Ανάθεση Ωραρίου Γραφείου...")
-    workhour_slots = []
-    for duty in duties:
-        if duty.get('is_special') or duty.get('is_weekly') or duty.get('is_off_balance'): continue
-        for sh_idx in range(duty['shifts_per_day']):
-            if duty['shift_config'][sh_idx].get('is_within_hours'): workhour_slots.append({'duty': duty, 'sh_idx': sh_idx, 'conf': duty['shift_config'][sh_idx]})
-    
-    curr = start_date
-    while curr <= end_date:
-        d_str = curr.strftime('%Y-%m-%d')
-        for slot in workhour_slots:
-            duty = slot['duty']; sh_idx = slot['sh_idx']; conf = slot['conf']
-            if not is_in_period(curr, duty.get('active_range')) or not is_in_period(curr, conf.get('active_range')): continue
-            if any(s['date']==d_str and int(s['duty_id'])==int(duty['id']) and int(s['shift_index'])==sh_idx for s in schedule): continue
-            
-            chosen_id = None
-            default_id = conf.get('default_employee_id')
-            default_excluded = default_id in [int(x) for x in conf.get('excluded_ids',[])]
-            
-            busy_reason_def = is_user_busy(default_id, curr, schedule, True) if default_id else "No Default"
-            needs_cover = not default_id or (default_id, d_str) in unavail_map or busy_reason_def != False or (is_scoreable_day(curr, special_dates_set) and default_excluded)
-            
-            if not needs_cover: chosen_id = default_id
-            else:
-                if default_id:
-                     log(f"      ⚠️ {d_str} {duty['name']}: Default {emp_map.get(default_id)} skipped. Busy: {busy_reason_def}, Unavail: {(default_id, d_str) in unavail_map}, Excl: {default_excluded}")
+        return q
 
-            if not chosen_id:
-                # Use SK queue if scoreable day (Sat/Sun/Special)
-                is_sk = is_scoreable_day(curr, special_dates_set)
-                
-                # MERGE: Use unified 'sk_all' queue for ALL SK assignments
-                if is_sk:
-                    q_key = "sk_all"
-                else:
-                    q_key = f"cover_{duty['id']}_{sh_idx}"
-
-                # --- Double Duty Logic (Cover) ---
-                # 1. SUNDAY LOOKBACK
-                is_strict_special = d_str in special_dates_set or f"2000-{d_str[5:]}" in special_dates_set
-                if is_sk and curr.weekday() == 6 and not is_strict_special: # Sunday AND Not Special
-                    yesterday_str = (curr - timedelta(days=1)).strftime('%Y-%m-%d')
-                    log(f"      🕵️ [Phase 0] Sunday {d_str}: Checking Double Duty for {duty['name']} (Lookback to {yesterday_str})...")
-                    
-                    prev_s = next((s for s in schedule if s['date']==yesterday_str and int(s['duty_id'])==int(duty['id']) and int(s['shift_index'])==sh_idx), None)
-                    if prev_s:
-                        p_uid = int(prev_s['employee_id'])
-                        log(f"      🔎 [Phase 0] Found Saturday Worker: {emp_map.get(p_uid)} (ID: {p_uid})")
-
-                        p_uid = int(prev_s['employee_id'])
-                        if p_uid in double_duty_prefs:
-                            # Check availability AND if they have quota left in SK Queue (>= 1 instance)
-                             quota_left = (rot_q.get('sk_all',[]) + nxt_q.get('sk_all',[])).count(p_uid)
-                             
-                             log(f"      🔍 [Phase 0] Checking Double Duty for {emp_map.get(p_uid)} (Sat {yesterday_str}). Quota: {quota_left}, Pref: True")
-                             
-                             if quota_left > 0:
-                                 is_unavail = (p_uid, d_str) in unavail_map
-                                 busy_reason = is_user_busy(p_uid, curr, schedule, True)
-                                 
-                                 if not is_unavail and not busy_reason:
-                                     chosen_id = p_uid
-                                     log(f"      🔗 {d_str} {duty['name']}: Double Duty (Cover Sun) -> {emp_map.get(chosen_id)}")
-                                 else:
-                                     log(f"      ❌ [Phase 0] Double Duty Failed for {emp_map.get(p_uid)}: Unavail={is_unavail}, Busy={busy_reason}")
-                             else:
-                                 log(f"      ❌ [Phase 0] Double Duty Failed for {emp_map.get(p_uid)}: No Quota Left ({quota_left})")
-                        else:
-                             log(f"      ℹ️ [Phase 0] Sat worker {emp_map.get(p_uid)} does NOT want Double Duty.")
-
-                if not chosen_id:
-                    cq, nq = get_q(q_key, [int(x) for x in conf.get('excluded_ids',[])])
-                    candidates = cq + nq
-                    
-                    # Sort by Double Duty Preference if Saturday AND quota >= 2
-                    if is_sk and curr.weekday() == 5: # Saturday
-                         # Prioritize if they want Double Duty AND have >= 2 instances in queue
-                         candidates.sort(key=lambda x: (
-                             1 if x in double_duty_prefs and candidates.count(x) >= 2 else 0, 
-                             random.random()
-                         ), reverse=True)
-                    else:
-                         candidates.sort(key=lambda x: double_duty_prefs.get(x, False), reverse=True)
-
-                    for cand in candidates:
-                        busy_r = is_user_busy(cand, curr, schedule, False)
-                        if (cand, d_str) not in unavail_map and not busy_r: 
-                            chosen_id = cand; break
-                    
-                    if chosen_id: rotate_assigned_user(q_key, chosen_id)
-
-                if chosen_id and is_sk and curr.weekday() == 5: # Saturday
-                     # REMOVED Lookahead as per user request (Doc update)
-                     pass
-            
-            if chosen_id: 
-                schedule.append({"date": d_str, "duty_id": duty['id'], "shift_index": sh_idx, "employee_id": chosen_id, "manually_locked": False})
-                log(f"      ✅ {d_str} {duty['name']} -> {emp_map.get(chosen_id)}")
-            else: 
-                log(f"      ❌ {d_str} {duty['name']}: Δεν βρέθηκε διαθέσιμος υπάλληλος (Ωράριο).")
-        curr += timedelta(days=1)
-
-    # --- PHASE 1: Weekly ---
-    log("▶️ Φάση 1: Ανάθεση Εβδομαδιαίων Υπηρεσιών...")
-    for duty in [d for d in duties if d.get('is_weekly') and not d.get('is_special') and not d.get('is_off_balance')]:
-        for sh_idx in range(duty['shifts_per_day']):
-            if duty['shift_config'][sh_idx].get('is_within_hours'): continue
-            q_key = f"weekly_{duty['id']}_{sh_idx}"; excl = [int(x) for x in duty['shift_config'][sh_idx].get('excluded_ids', [])]
-            
-            curr = start_date
-            while curr <= end_date:
-                # Check if this is the start day of the week for this duty
-                # Default to Monday (0) if day_index is missing
-                target_day = duty['shift_config'][sh_idx].get('day_index', 0) 
-                
-                # --- FIX: Handle Partial First Week ---
-                # If we are at start_date and it's NOT the target start day (e.g. Month starts on Wed, but Duty starts Mon)
-                # We must look back at the previous day (end of prev month) and continue that user's assignment.
-                if curr == start_date and curr.weekday() != target_day:
-                    log(f"      ℹ️ {curr.strftime('%Y-%m-%d')} {duty['name']}: Μερική εβδομάδα έναρξης. Έλεγχος για προηγούμενο ανάδοχο...")
-                    prev_date = curr - timedelta(days=1)
-                    p_str = prev_date.strftime('%Y-%m-%d')
-                    
-                    # Look in HISTORY (or schedule if manual)
-                    prev_s = next((s for s in history + schedule if s['date'] == p_str and int(s['duty_id']) == duty['id'] and int(s.get('shift_index',0)) == sh_idx), None)
-                    
-                    if prev_s:
-                        prev_uid = int(prev_s['employee_id'])
-                        log(f"      ↪️ Βρέθηκε προηγούμενος: {emp_map.get(prev_uid)}. Επέκταση έως την επόμενη {target_day}...")
-                        
-                        # Fill until we hit the target day or end_date
-                        while curr <= end_date and curr.weekday() != target_day:
-                            d_str = curr.strftime('%Y-%m-%d')
-                            if not any(s['date'] == d_str and int(s['duty_id']) == duty['id'] for s in schedule):
-                                # Skip if Sunday and not in active range? (Keep consistent with main logic)
-                                if not (curr.weekday()==6 and not is_in_period(curr, duty.get('sunday_active_range'))):
-                                     schedule.append({"date": d_str, "duty_id": duty['id'], "shift_index": sh_idx, "employee_id": prev_uid, "manually_locked": False})
-                                     log(f"      ✅ {d_str} {duty['name']} -> {emp_map.get(prev_uid)} (Extension)")
-                            curr += timedelta(days=1)
-                        continue # Now curr matches target_day (or end_date), main loop continues
-                    else:
-                        log(f"      ⚠️ Δεν βρέθηκε προηγούμενος για {p_str}. Η μερική εβδομάδα θα παραμείνει κενή.")
-
-                if curr.weekday() != target_day:
-                    curr += timedelta(days=1); continue
+    def rotate_assigned_user(self, key, user_id):
+        self.queue_for(key).served(user_id)
 
-                d_str = curr.strftime('%Y-%m-%d')
-                if any(s['date'] == d_str and int(s['duty_id']) == duty['id'] for s in schedule):
-                    curr += timedelta(days=1); continue
-
-                w_start = curr; w_end = w_start + timedelta(days=6) # logic might differ if day_index != 0
-                
-                chosen = None
-
-                # Continuity Check (Standard - for full weeks)
-                if w_start > start_date:
-                    prev_day = w_start - timedelta(days=1)
-                    p_str = prev_day.strftime('%Y-%m-%d')
-                    prev_s = next((s for s in schedule if s['date'] == p_str and int(s['duty_id']) == duty['id']), None)
-                    if prev_s:
-                        cand = int(prev_s['employee_id'])
-                        if (cand, d_str) not in unavail_map and not is_user_busy(cand, curr, schedule, False):
-                            chosen = cand
-                            log(f"      🔄 {d_str} {duty['name']}: Συνέχιση από {emp_map.get(chosen)}")
-
-                if not chosen:
-                    cq, nq = get_q(q_key, excl)
-                    for cand in (cq+nq):
-                        if (cand, d_str) not in unavail_map and not is_user_busy(cand, curr, schedule, False): 
-                            chosen = cand; break
-                    if chosen: rotate_assigned_user(q_key, chosen)
-
-                if chosen:
-                    schedule.append({"date": d_str, "duty_id": duty['id'], "shift_index": sh_idx, "employee_id": chosen, "manually_locked": False})
-                    log(f"      ✅ {d_str} {duty['name']} -> {emp_map.get(chosen)}")
-                    
-                    t = curr + timedelta(days=1)
-                    while t <= w_end and t <= end_date:
-                         # Skip if Sunday and not in range 
-                         if not (t.weekday()==6 and not is_in_period(t, duty.get('sunday_active_range'))):
-                             if not any(s['date']==t.strftime('%Y-%m-%d') and int(s['duty_id'])==int(duty['id']) for s in schedule):
-                                 schedule.append({"date": t.strftime('%Y-%m-%d'), "duty_id": duty['id'], "shift_index": sh_idx, "employee_id": chosen, "manually_locked": False})
-                         t += timedelta(days=1)
-                else:
-                    log(f"      ❌ {d_str} {duty['name']}: Δεν βρέθηκε διαθέσιμος υπάλληλος.")
-                
-                curr = w_end + timedelta(days=1)
-
-    # --- PHASE 2: Daily ---
-    log("▶️ Φάση 2: Ανάθεση Καθημερινών Υπηρεσιών...")
-    curr = start_date
-    while curr <= end_date:
-        d_str = curr.strftime('%Y-%m-%d')
-        iso_weekday = curr.weekday() # 0=Mon ... 6=Sun
-        is_sat = (iso_weekday == 5)
-        is_sun = (iso_weekday == 6)
-        is_special = is_scoreable_day(curr, special_dates_set)
-        
-        # Gather today's needs (Normal Daily Only)
-        slots = []
-        for d in [x for x in duties if not x.get('is_weekly') and not x.get('is_special') and not x.get('is_off_balance')]:
-             if is_in_period(curr, d.get('active_range')):
-                 for i in range(d['shifts_per_day']):
-                     if not d['shift_config'][i].get('is_within_hours') and is_in_period(curr, d['shift_config'][i].get('active_range')):
-                         if not any(s['date']==d_str and int(s['duty_id'])==int(d['id']) and int(s['shift_index'])==i for s in schedule):
-                             slots.append({'d':d, 'i':i, 'c':d['shift_config'][i]})
-        
-        random.shuffle(slots)
-
-        for x in slots:
-            duty = x['d']; duty_id = duty['id']
-            sh_idx = x['i']
-            conf = x['c']
-            
-            q_prefix = "sk_" if (is_sat or is_sun) else "" 
-            # MERGE: Unified 'sk_all' for normal weekend shifts
-            if is_sat or is_sun:
-                 q_key = "sk_all"
-            else:
-                 q_key = f"normal_{duty_id}_sh_{sh_idx}"
-                 
-            excluded_ids = [int(z) for z in conf.get('excluded_ids',[])]
-            
-            cq, nq = get_q(q_key, excluded_ids)
-            chosen = None
-            
-            # 1. SUNDAY: Check Saturday (Lookback)
-            is_strict_special = d_str in special_dates_set or f"2000-{d_str[5:]}" in special_dates_set
-            if is_sun and not is_strict_special:
-                yesterday_str = (curr - timedelta(days=1)).strftime('%Y-%m-%d')
-                log(f"      🕵️ [Phase 2] Sunday {d_str}: Checking Double Duty for {duty['name']} (Lookback to {yesterday_str})...")
-
-                prev_assignment = next((s for s in schedule + history if s['date']==yesterday_str and int(s['duty_id'])==int(duty_id) and int(s.get('shift_index',0))==sh_idx), None)
-                
-                if prev_assignment:
-
-                    prev_uid = int(prev_assignment['employee_id'])
-                    sat_is_scoreable = is_scoreable_day(curr - timedelta(days=1), special_dates_set)
-                    sun_is_scoreable = is_scoreable_day(curr, special_dates_set)
-                    wants_double = prev_uid in double_duty_prefs
-                    
-                    if wants_double and sat_is_scoreable and sun_is_scoreable:
-                         is_unavail = (prev_uid, d_str) in unavail_map
-                         is_busy = is_user_busy(prev_uid, curr, schedule, True, False)
-                         
-                         log(f"      🔍 [Phase 2] Checking Double Duty for {emp_map.get(prev_uid)} (Sat {yesterday_str}). Unavail={is_unavail}, Busy={is_busy}")
-                         
-                         if not is_unavail and not is_busy:
-                              chosen = prev_uid
-                              log(f"      🔄 {d_str} {duty['name']}: Double Duty (Sun) -> {emp_map.get(chosen)} (Linked to Sat)")
-                         else:
-                              log(f"      ❌ [Phase 2] Double Duty Failed for {emp_map.get(prev_uid)}: Busy/Unavail")
-                    else:
-                         if not wants_double: log(f"      ℹ️ [Phase 2] Sat worker {emp_map.get(prev_uid)} does NOT want Double Duty ({wants_double}).")
-                         if not sat_is_scoreable: log(f"      ℹ️ [Phase 2] Yesterday ({yesterday_str}) is NOT scoreable.")
-                         if not sun_is_scoreable: log(f"      ℹ️ [Phase 2] Today ({d_str}) is NOT scoreable.")
-
-            ignore_tmr = False
-            
-            if not chosen:
-                candidates = cq + nq
-                
-                # Sorting Logic
-                def sort_priority(uid):
-                    if is_sat:
-                         sun_date = curr + timedelta(days=1)
-                         sun_is_scoreable = is_scoreable_day(sun_date, special_dates_set)
-                         sat_is_scoreable = is_scoreable_day(curr, special_dates_set)
-                         # Priority if Double Duty Pref AND has quota (>=2 instances)
-                         has_quota = candidates.count(uid) >= 2
-                         if uid in double_duty_prefs and sat_is_scoreable and sun_is_scoreable and has_quota:
-                             return -100 
-                    if is_sun:
-                        yesterday_str = (curr - timedelta(days=1)).strftime('%Y-%m-%d')
-                        if yesterday_str in special_dates_set and uid in double_duty_prefs:
-                            return 50 
-                    return 0
-                
-                candidates.sort(key=sort_priority)
-                
-                for cand in candidates:
-                    if (cand, d_str) in unavail_map: continue
-                    
-                    busy_r = is_user_busy(cand, curr, schedule, False, False)
-                    if not busy_r:
-                        chosen = cand; break
-            
-            if chosen:
-                schedule.append({"date": d_str, "duty_id": duty_id, "shift_index": sh_idx, "employee_id": chosen, "manually_locked": False})
-                rotate_assigned_user(q_key, chosen)
-                log(f"      ✅ {d_str} {duty['name']} -> {emp_map.get(chosen)}")
-            else: 
-                log(f"      ❌ {d_str} {duty['name']}: Δεν βρέθηκε διαθέσιμος υπάλληλος.")
-        curr += timedelta(days=1)
+    def get_balance_ledger(self, target_duties):
+        # One ledger per target set: handicaps + history summed on first use, then kept live
+        key = frozenset(target_duties)
+        if key in self.balance_ledgers: return self.balance_ledgers[key]
 
+        # Determine employees excluded from ALL shifts of ALL target duties
+        globally_excluded = self.catalog.excluded_everywhere(target_duties, self.emp_ids)
+        handicaps = {eid: sum(self.catalog.handicap(d['id'], eid) for d in self.duties if d['id'] in target_duties) for eid in self.emp_ids}
+
+        def weight(s, eid):
+            if s['duty_id'] not in target_duties: return 0
+            s_d = s['day']
+            if s_d < self.lookback_day or s_d > self.end_day: return 0
+            if s['duty_id'] in self.catalog.weekly_ids and not self.scoreable(s_d): return 0
+            conf = self.catalog.conf(s['duty_id'], s['shift_index'])
+            if conf.get('is_within_hours') and conf.get('default_employee_id')==eid and not self.scoreable(s_d): return 0
+            return 1
+
+        self.balance_ledgers[key] = self.open_ledger([eid for eid in self.emp_ids if eid not in globally_excluded],
+                                                     weight, self.history + self.schedule, handicaps)
+        return self.balance_ledgers[key]
 
     # --- BALANCING LOGIC ---
-    lookback_date = (start_date - relativedelta(months=2)).replace(day=1)
-    
-    def get_detailed_scores(target_duties):
-        # Determine employees excluded from ALL shifts of ALL target duties
-        globally_excluded = set(e['id'] for e in employees)
-        for d in duties:
-            if d['id'] not in target_duties: continue
-            for conf in d.get('shift_config', [{}]):
-                exc = set(int(x) for x in conf.get('excluded_ids', []))
-                globally_excluded -= (set(e['id'] for e in employees) - exc)
-        
-        sc = {e['id']: 0 for e in employees if e['id'] not in globally_excluded}
-        for e in employees:
-            if e['id'] in globally_excluded: continue
-            eid_str = str(e['id'])
-            for d in duties:
-                if d['id'] in target_duties:
-                    for c in d.get('shift_config',[]): sc[e['id']] += int(c.get('handicaps',{}).get(eid_str,0))
-        for s in history + schedule:
-            if int(s['duty_id']) not in target_duties: continue
-            s_d = dt.strptime(s['date'], '%Y-%m-%d').date()
-            if s_d < lookback_date or s_d > end_date: continue
-            d_o = next((d for d in duties if d['id']==int(s['duty_id'])), None)
-            if not d_o: continue
-            if d_o.get('is_weekly') and not is_scoreable_day(s_d, special_dates_set): continue
-            conf = d_o['shift_config'][int(s.get('shift_index',0))]
-            if conf.get('is_within_hours') and conf.get('default_employee_id')==int(s['employee_id']) and not is_scoreable_day(s_d, special_dates_set): continue
-            eid = int(s['employee_id'])
-            if eid in sc: sc[eid] += 1
-        return sc
-
-    def run_balance(target, label):
+    def movable_shifts(self, ledger, target, weekday_only):
+        # Same shifts the swap loop may hand over: unlocked, scored, not weekly, not a protected
+        # default-owner slot, and not half of a Sat/Sun pair of a double-duty donor
+        weekday_kinds = SwapIndex.kinds_where(weekend=False, scoreable=False)
+        out = []
+        for donor_id in ledger.scores:
+            for shift in self.swap_index.rows(donor_id, target, weekday_kinds if weekday_only else None):
+                if shift['duty_id'] in self.catalog.weekly_ids: continue
+                conf = self.catalog.conf(shift['duty_id'], shift.get('shift_index', 0))
+                if conf.get('is_within_hours') and conf.get('default_employee_id') == donor_id and not self.scoreable(shift['day']): continue
+                if ledger.weight(shift, donor_id) != 1: continue
+                if donor_id in self.double_duty_prefs and day_weekday(shift['day']) in (5, 6):
+                    partner_day = shift['day'] + (1 if day_weekday(shift['day']) == 5 else -1)
+                    if any(p['employee_id'] == donor_id and not p.get('manually_locked')
+                           for p in self.slot_index.rows(partner_day, shift['duty_id'])): continue
+                out.append(shift)
+        return out
+
+    def run_balance_flow(self, target, label, phase_name):
+        # Moves as min-cost flow: source -> donor (k-th shift given costs the drop in donor score^2)
+        # -> shift -> eligible receiver -> sink (k-th shift taken costs the rise in receiver score^2).
+        # The cheapest flow minimises the sum of squared scores, which also gives the smallest
+        # reachable max-min spread. Receivers are checked against the occupancy at solve time, so
+        # two moves to one receiver on adjacent days can clash: those are re-checked on apply and
+        # the flow is solved again from the new state. A double-duty Sat/Sun pair has to move as
+        # one, which a flow cannot force (it may send one unit of the two), so pairs stay out and
+        # run_balance finishes with the swap loop, whose Double Swap moves them.
+        ledger = self.get_balance_ledger(target)
+        sc = ledger.scores
+        weekday_only = label.endswith("(Weekday Only)")
+        if not sc: return
+        s_init = ledger.ranked_items()
+        self.log(f"   📊 [Initial Balance] Min: {s_init[0][1]} | Max: {s_init[-1][1]} | Range: {s_init[-1][1] - s_init[0][1]}", LOG_SUMMARY)
+        self.log(lambda: f"   📊 [Initial Scores]: {[(self.emp_map.get(k, k), v) for k,v in s_init]}", LOG_PHASE)
+
+        for _ in range(10):
+            if self.should_stop(phase_name): break
+            self.metrics.count('iterations')
+            lo = sc[ledger.lowest()]; hi = sc[ledger.highest()]
+            if hi - lo <= 1: break
+            shifts = self.movable_shifts(ledger, target, weekday_only)
+            flow = MinCostFlow(2)
+            give = {}; take = {}
+            for eid, score in sc.items():
+                if score - lo >= 2:
+                    give[eid] = flow.add_node()
+                    for k in range(1, score - lo + 1): flow.add_edge(0, give[eid], 1, -2 * (score - k) - 1)
+                if hi - score >= 2:
+                    take[eid] = flow.add_node()
+                    for k in range(1, hi - score + 1): flow.add_edge(take[eid], 1, 1, 2 * (score + k) - 1)
+            arcs = []
+            for shift in shifts:
+                donor_id = shift['employee_id']
+                if donor_id not in give: continue
+                s_date = shift['day']
+                excl = self.catalog.excluded_for(shift['duty_id'], shift.get('shift_index', 0))
+                node = None
+                for rec_id in take:
+                    if rec_id == donor_id or rec_id in excl or sc[rec_id] > sc[donor_id] - 2: continue
+                    if (rec_id, s_date) in self.unavail_map or ledger.weight(shift, rec_id) != 1: continue
+                    self.metrics.count('swaps_attempted')
+                    if self.is_user_busy(rec_id, s_date, False): continue
+                    if node is None:
+                        node = flow.add_node()
+                        flow.add_edge(give[donor_id], node, 1, 0)
+                    arcs.append((shift, rec_id, flow.add_edge(node, take[rec_id], 1, 0)))
+            moved, _ = flow.solve(0, 1)
+            if not moved: break
+
+            applied = 0
+            for shift, rec_id, arc in arcs:
+                if not flow.flow(arc): continue
+                if self.is_user_busy(rec_id, shift['day'], False): continue
+                donor_id = shift['employee_id']
+                self.reassign(shift, rec_id)
+                applied += 1
+                self.metrics.count('swaps_performed')
+                self.log(lambda: f"   🔄 Swap: {self.emp_map.get(donor_id)} ({day_str(shift['day'])}) -> {self.emp_map.get(rec_id)}", LOG_PHASE)
+            if not applied: break
+
+        s_fin = ledger.ranked_items()
+        self.log(f"   🌊 [Flow Balance] Min: {s_fin[0][1]} | Max: {s_fin[-1][1]} | Range: {s_fin[-1][1] - s_fin[0][1]}", LOG_SUMMARY)
+
+    def run_balance(self, target, label, phase_name):
         if not target: return
-        log(f"⚖️ Εξισορρόπηση {label}...")
+        self.metrics.begin(phase_name)
+        if self.balancer == 'flow':
+            self.log(f"⚖️ Εξισορρόπηση {label} (flow)...", LOG_SUMMARY)
+            self.run_balance_flow(target, label, phase_name)
+        else:
+            self.log(f"⚖️ Εξισορρόπηση {label}...", LOG_SUMMARY)
         
         swaps_performed = 0
         stagnation_limit = 2
         stagnation_count = 0
         
+        ledger = self.get_balance_ledger(target)
+        sc = ledger.scores
+        weekday_only = label.endswith("(Weekday Only)")
+        weekday_kinds = SwapIndex.kinds_where(weekend=False, scoreable=False)
+
         for iteration in range(500): 
-            sc = get_detailed_scores(target)
-            if not sc: break
+            if not sc or self.should_stop(phase_name): break
+            self.metrics.count('iterations')
             
             if iteration == 0:
-                 s_init = sorted(sc.items(), key=lambda x: x[1])
-                 log(f"   📊 [Initial Balance] Min: {s_init[0][1]} | Max: {s_init[-1][1]} | Range: {s_init[-1][1] - s_init[0][1]}")
-                 log(f"   📊 [Initial Scores]: {[(emp_map.get(k, k), v) for k,v in s_init]}")
-            s_ids = sorted(sc.keys(), key=lambda k: sc[k])
-            if len(s_ids) < 2: break
-            min_id, max_id = s_ids[0], s_ids[-1]
+                 s_init = ledger.ranked_items()
+                 self.log(f"   📊 [Initial Balance] Min: {s_init[0][1]} | Max: {s_init[-1][1]} | Range: {s_init[-1][1] - s_init[0][1]}", LOG_SUMMARY)
+                 self.log(lambda: f"   📊 [Initial Scores]: {[(self.emp_map.get(k, k), v) for k,v in s_init]}", LOG_PHASE)
+            if len(sc) < 2: break
+            min_id, max_id = ledger.lowest(), ledger.highest()
             diff = sc[max_id] - sc[min_id]
             
             if diff <= 1:
-                log(f"✅ Η Εξισορρόπηση ολοκληρώθηκε επιτυχώς (Διαφορά: {diff}).")
+                self.log(f"✅ Η Εξισορρόπηση ολοκληρώθηκε επιτυχώς (Διαφορά: {diff}).", LOG_SUMMARY)
                 break
                 
             move_made = False
             diagnostics = []
             
-            potential_donors = [uid for uid in s_ids if sc[uid] > sc[min_id] + 1]
-            potential_donors.reverse()
+            potential_donors = ledger.ranked_desc(above=sc[min_id] + 1)
             
             for donor_id in potential_donors:
-                donor_shifts = [s for s in schedule if int(s['employee_id'])==donor_id and int(s['duty_id']) in target and not s.get('manually_locked')]
-                if label.endswith("(Weekday Only)"):
-                    # Phase 8: Filter for strictly Weekday non-Special shifts
-                    donor_shifts = [c for c in donor_shifts 
-                                    if start_date <= dt.strptime(c['date'], '%Y-%m-%d').date() <= end_date
-                                    and dt.strptime(c['date'], '%Y-%m-%d').date().weekday() not in [5, 6]
-                                    and not is_scoreable_day(c['date'], special_dates_set)]
-                else:
-                    donor_shifts = [c for c in donor_shifts if start_date <= dt.strptime(c['date'], '%Y-%m-%d').date() <= end_date]
+                if self.should_stop(phase_name): break
+                # Phase 8: strictly Weekday non-Special shifts
+                donor_shifts = self.swap_index.rows(donor_id, target, weekday_kinds if weekday_only else None)
                 
-                random.shuffle(donor_shifts)
+                self.rng.shuffle(donor_shifts)
                 
                 if not donor_shifts: continue
 
                 for shift in donor_shifts:
-                    if int(shift['employee_id']) != donor_id: continue
+                    if shift['employee_id'] != donor_id: continue
 
-                    s_date = dt.strptime(shift['date'], '%Y-%m-%d').date()
-                    d_obj = next((d for d in duties if d['id']==int(shift['duty_id'])),None)
-                    conf = d_obj.get('shift_config', [{}])[int(shift.get('shift_index',0))] if d_obj else {}
+                    s_date = shift['day']
+                    conf = self.catalog.conf(shift['duty_id'], shift.get('shift_index',0))
+                    excl = self.catalog.excluded_for(shift['duty_id'], shift.get('shift_index',0))
                     
-                    if conf.get('is_within_hours') and conf.get('default_employee_id')==donor_id and not is_scoreable_day(s_date, special_dates_set): 
-                        if stagnation_count >= stagnation_limit: diagnostics.append(f"Βάρδια {shift['date']}: Κλειδωμένο Ωράριο")
+                    if conf.get('is_within_hours') and conf.get('default_employee_id')==donor_id and not self.scoreable(s_date): 
+                        if stagnation_count >= stagnation_limit: diagnostics.append(f"Βάρδια {day_str(shift['day'])}: Κλειδωμένο Ωράριο")
                         continue
                     
-                    if d_obj and d_obj.get('is_weekly'): 
-                        if stagnation_count >= stagnation_limit: diagnostics.append(f"Βάρδια {shift['date']}: Κλειδωμένη Εβδομαδιαία")
+                    if shift['duty_id'] in self.catalog.weekly_ids: 
+                        if stagnation_count >= stagnation_limit: diagnostics.append(f"Βάρδια {day_str(shift['day'])}: Κλειδωμένη Εβδομαδιαία")
                         continue
                     
                     # --- ATOMIC SWAP LOGIC ---
                     is_pair = False
                     partner_shift = None
                     
-                    if donor_id in double_duty_prefs:
-                        wd = s_date.weekday()
+                    if donor_id in self.double_duty_prefs:
+                        wd = day_weekday(s_date)
                         target_offset = 0
                         if wd == 5: target_offset = 1 
                         elif wd == 6: target_offset = -1 
                         
                         if target_offset != 0:
-                            partner_date = s_date + timedelta(days=target_offset)
-                            partner_str = partner_date.strftime('%Y-%m-%d')
-                            partner_shift = next((s for s in schedule 
-                                                  if s['date'] == partner_str 
-                                                  and int(s['employee_id']) == donor_id 
-                                                  and int(s['duty_id']) == int(shift['duty_id'])
+                            partner_day = s_date + target_offset
+                            partner_shift = next((s for s in self.slot_index.rows(partner_day, shift['duty_id'])
+                                                  if s['employee_id'] == donor_id 
                                                   and not s.get('manually_locked')), None)
                             if partner_shift:
                                 is_pair = True
                     
-                    valid_receivers = [uid for uid in s_ids if sc[uid] < sc[donor_id] - 1]
+                    valid_receivers = ledger.ranked(below=sc[donor_id] - 1)
                     
                     swap_success = False
                     
                     for rec_id in valid_receivers:
                         if rec_id == donor_id: continue
-                        if rec_id in [int(x) for x in conf.get('excluded_ids',[])]: 
-                            if stagnation_count >= stagnation_limit: diagnostics.append(f"Ο/Η {emp_map[rec_id]} Εξαιρείται")
+                        self.metrics.count('swaps_attempted')
+                        if rec_id in excl: 
+                            if stagnation_count >= stagnation_limit: diagnostics.append(f"Ο/Η {self.emp_map[rec_id]} Εξαιρείται")
                             continue
                         
-                        if (rec_id, shift['date']) in unavail_map: 
-                             if stagnation_count >= stagnation_limit: diagnostics.append(f"Ο/Η {emp_map[rec_id]} κώλυμα {shift['date']}")
+                        if (rec_id, shift['day']) in self.unavail_map: 
+                             if stagnation_count >= stagnation_limit: diagnostics.append(f"Ο/Η {self.emp_map[rec_id]} κώλυμα {day_str(shift['day'])}")
                              continue
-                        if is_user_busy(rec_id, s_date, schedule, False): 
-                             if stagnation_count >= stagnation_limit: diagnostics.append(f"Ο/Η {emp_map[rec_id]} απασχολημένος {shift['date']}")
+                        if self.is_user_busy(rec_id, s_date, False): 
+                             if stagnation_count >= stagnation_limit: diagnostics.append(f"Ο/Η {self.emp_map[rec_id]} απασχολημένος {day_str(shift['day'])}")
                              continue
 
                         if is_pair and partner_shift:
-                            p_date = dt.strptime(partner_shift['date'], '%Y-%m-%d').date()
-                            if (rec_id, partner_shift['date']) in unavail_map: continue
-                            if is_user_busy(rec_id, p_date, schedule, False): continue
+                            if (rec_id, partner_shift['day']) in self.unavail_map: continue
+                            if self.is_user_busy(rec_id, partner_shift['day'], False): continue
                             
-                            shift['employee_id'] = rec_id
-                            partner_shift['employee_id'] = rec_id
+                            self.reassign(shift, rec_id)
+                            self.reassign(partner_shift, rec_id)
                             swaps_performed += 2
-                            sc[donor_id] -= 2; sc[rec_id] += 2
+                            self.metrics.count('swaps_performed')
                             move_made = True
-                            log(f"   🔄 Double Swap: {emp_map.get(donor_id)} ({shift['date']}/{partner_shift['date']}) -> {emp_map.get(rec_id)}")
+                            self.log(lambda: f"   🔄 Double Swap: {self.emp_map.get(donor_id)} ({day_str(shift['day'])}/{day_str(partner_shift['day'])}) -> {self.emp_map.get(rec_id)}", LOG_PHASE)
                             swap_success = True
                             stagnation_count = 0
                             break
                         
                         elif not is_pair:
-                            shift['employee_id'] = rec_id
+                            self.reassign(shift, rec_id)
                             swaps_performed += 1
-                            sc[donor_id] -= 1; sc[rec_id] += 1
+                            self.metrics.count('swaps_performed')
                             move_made = True
                             swap_success = True
-                            log(f"   🔄 Swap: {emp_map.get(donor_id)} ({shift['date']}) -> {emp_map.get(rec_id)}")
+                            self.log(lambda: f"   🔄 Swap: {self.emp_map.get(donor_id)} ({day_str(shift['day'])}) -> {self.emp_map.get(rec_id)}", LOG_PHASE)
                             stagnation_count = 0
                             break
                     
@@ -912,123 +1656,102 @@ def run_auto_scheduler_logic(db, start_date, end_date):
             if not move_made:
                 stagnation_count += 1
                 if stagnation_count >= stagnation_limit:
-                    log(f"⚠️ Η Εξισορρόπηση σταμάτησε (Διαφορά: {diff}). Αιτίες που δεν μειώθηκε η διαφορά:")
-                    for d in list(set(diagnostics))[:5]: 
-                        log(f"      - {d}")
+                    self.log(f"⚠️ Η Εξισορρόπηση σταμάτησε (Διαφορά: {diff}). Αιτίες που δεν μειώθηκε η διαφορά:", LOG_SUMMARY)
+                    for d in list(dict.fromkeys(diagnostics))[:5]: 
+                        self.log(lambda: f"      - {d}", LOG_PHASE)
                     break
 
         # Final Score Log
-        final_sc = get_detailed_scores(target)
-        if final_sc:
-            s_fin = sorted(final_sc.items(), key=lambda x: x[1])
-            log(f"   🏁 [Final Balance] Min: {s_fin[0][1]} | Max: {s_fin[-1][1]} | Range: {s_fin[-1][1] - s_fin[0][1]}")
-            log(f"   🏁 [Final Scores]: {[(emp_map.get(k, k), v) for k,v in s_fin]}")
-
-    run_balance([d['id'] for d in duties if not d.get('is_off_balance') and not d.get('is_special')], "Κανονικών Υπηρεσιών")
-    run_balance([d['id'] for d in duties if d.get('is_off_balance') and not d.get('is_special')], "Υπηρεσιών Εκτός Ισοζυγίου")
-
-    # --- PHASE 5: Special-Date Balancing ---
-    def is_special_date_only(d_str, sp_set):
-        d = dt.strptime(d_str, '%Y-%m-%d').date() if isinstance(d_str, str) else d_str
-        if str(d) in sp_set: return True
-        recurring = f"2000-{d.strftime('%m-%d')}"
-        if recurring in sp_set: return True
-        return False
-
-    def run_special_date_balance(target_duty_ids, label):
-        log(f"▶️ Φάση 5: Εξισορρόπηση Αργιών ({label})...")
+        if sc:
+            s_fin = ledger.ranked_items()
+            self.log(f"   🏁 [Final Balance] Min: {s_fin[0][1]} | Max: {s_fin[-1][1]} | Range: {s_fin[-1][1] - s_fin[0][1]}", LOG_SUMMARY)
+            self.log(lambda: f"   🏁 [Final Scores]: {[(self.emp_map.get(k, k), v) for k,v in s_fin]}", LOG_PHASE)
+            self.metrics.end(s_fin[-1][1] - s_fin[0][1])
+        self.metrics.end()
+
+    # --- SPECIAL-DATE BALANCING LOGIC (Phase 5) ---
+    def run_special_date_balance(self, target_duty_ids, label, phase_name):
+        self.metrics.begin(phase_name)
+        self.log(f"▶️ Φάση 5: Εξισορρόπηση Αργιών ({label})...", LOG_SUMMARY)
         sd_swaps = 0
         stagnation_limit = 2
         stagnation_count = 0
 
-        sd_excluded = set(e['id'] for e in employees)
-        for d in duties:
-            if d['id'] not in target_duty_ids: continue
-            for conf in d.get('shift_config', [{}]):
-                exc = set(int(x) for x in conf.get('excluded_ids', []))
-                sd_excluded -= (set(e['id'] for e in employees) - exc)
+        sd_excluded = self.catalog.excluded_everywhere(target_duty_ids, self.emp_ids)
+
+        # Strictly special days over all of history, kept live across swaps
+        def sd_weight(s, eid):
+            d_id = s['duty_id']
+            if d_id not in self.catalog.by_id or d_id in self.catalog.special_ids: return 0
+            if d_id not in target_duty_ids: return 0
+            return 1 if self.strict_special(s['day']) else 0
+        sd_ledger = self.open_ledger([eid for eid in self.emp_ids if eid not in sd_excluded], sd_weight, self.history + self.schedule)
+        self.dimension_ledgers[phase_name] = sd_ledger
+        sd_sc = sd_ledger.scores
+
+        sd_weekly_ids = frozenset(d for d in target_duty_ids if d in self.catalog.weekly_ids and d not in self.catalog.special_ids)
+        sd_daily_ids = frozenset(d for d in target_duty_ids if d not in self.catalog.weekly_ids and d not in self.catalog.special_ids)
+        sk_kinds = SwapIndex.kinds_where(scoreable=True)
+        sk_plain_kinds = SwapIndex.kinds_where(scoreable=True, strict_special=False)
+        weekday_kinds = SwapIndex.kinds_where(scoreable=False)
 
         for _ in range(200):
-            sd_sc = {e['id']: 0 for e in employees if e['id'] not in sd_excluded}
-            for s in history + schedule:
-                s_d = dt.strptime(s['date'], '%Y-%m-%d').date()
-                d_id = int(s['duty_id'])
-                d_o = next((d for d in duties if d['id'] == d_id), None)
-                if not d_o or d_o.get('is_special'): continue
-                if d_o['id'] not in target_duty_ids: continue
-                eid = int(s['employee_id'])
-                if eid not in sd_sc: continue
-                if is_special_date_only(s_d, special_dates_set):
-                    sd_sc[eid] += 1
-
-            s_sd = sorted(sd_sc.items(), key=lambda x: x[1])
+            if self.should_stop(phase_name): break
+            self.metrics.count('iterations')
+
+            s_sd = sd_ledger.ranked_items()
             
             if _ == 0:
-                 log(f"   📊 [Initial Special Balance] Min: {s_sd[0][1]} | Max: {s_sd[-1][1]}")
-                 log(f"   📊 [Initial Special Scores]: {[(emp_map.get(k, k), v) for k,v in s_sd]}")
+                 self.log(f"   📊 [Initial Special Balance] Min: {s_sd[0][1]} | Max: {s_sd[-1][1]}", LOG_SUMMARY)
+                 self.log(lambda: f"   📊 [Initial Special Scores]: {[(self.emp_map.get(k, k), v) for k,v in s_sd]}", LOG_PHASE)
             if not s_sd or s_sd[-1][1] - s_sd[0][1] <= 1: break
 
             swapped = False
             for i in range(len(s_sd) - 1, 0, -1):
+                if self.should_stop(phase_name): break
                 max_id = s_sd[i][0]
-                for j in range(i):
+                if sd_sc[max_id] - s_sd[0][1] <= 1: break
+                # s_sd is ascending: the employees more than 1 below max_id are a prefix
+                for j in range(min(i, sd_ledger.count_below(sd_sc[max_id] - 1))):
                     min_id = s_sd[j][0]
-                    if sd_sc[max_id] - sd_sc[min_id] <= 1: continue
-
-                    max_special = [s for s in schedule if int(s['employee_id']) == max_id
-                                   and int(s['duty_id']) in target_duty_ids
-                                   and is_scoreable_day(s['date'], special_dates_set)
-                                   and not s.get('manually_locked')
-                                   and start_date <= dt.strptime(s['date'], '%Y-%m-%d').date() <= end_date]
-                    max_special = [s for s in max_special if not any(d['id'] == int(s['duty_id']) and d.get('is_special') for d in duties)]
-
-                    max_special_weekly = [s for s in max_special if any(d['id'] == int(s['duty_id']) and d.get('is_weekly') for d in duties)]
-                    max_special_daily = [s for s in max_special if not any(d['id'] == int(s['duty_id']) and d.get('is_weekly') for d in duties)]
-
-                    min_weekend_nonspecial = [s for s in schedule if int(s['employee_id']) == min_id
-                                              and int(s['duty_id']) in target_duty_ids
-                                              and is_scoreable_day(s['date'], special_dates_set)
-                                              and not is_special_date_only(s['date'], special_dates_set)
-                                              and not s.get('manually_locked')
-                                              and start_date <= dt.strptime(s['date'], '%Y-%m-%d').date() <= end_date]
-                    min_weekend_nonspecial = [s for s in min_weekend_nonspecial if not any(d['id'] == int(s['duty_id']) and (d.get('is_weekly') or d.get('is_special')) for d in duties)]
-
-                    random.shuffle(max_special_daily); random.shuffle(min_weekend_nonspecial)
+
+                    max_special_weekly = self.swap_index.rows(max_id, sd_weekly_ids, sk_kinds)
+                    max_special_daily = self.swap_index.rows(max_id, sd_daily_ids, sk_kinds)
+
+                    min_weekend_nonspecial = self.swap_index.rows(min_id, sd_daily_ids, sk_plain_kinds)
+
+                    self.rng.shuffle(max_special_daily); self.rng.shuffle(min_weekend_nonspecial)
                     for sd_shift in max_special_daily:
-                        sd_d = next((d for d in duties if d['id'] == int(sd_shift['duty_id'])), None)
-                        sd_conf = sd_d.get('shift_config', [{}])[int(sd_shift.get('shift_index', 0))] if sd_d else {}
-                        if min_id in [int(x) for x in sd_conf.get('excluded_ids', [])]: continue
-                        if (min_id, sd_shift['date']) in unavail_map or is_user_busy(min_id, dt.strptime(sd_shift['date'], '%Y-%m-%d').date(), schedule, False): continue
+                        sd_excl = self.catalog.excluded_for(sd_shift['duty_id'], sd_shift.get('shift_index', 0))
+                        if min_id in sd_excl: continue
+                        if (min_id, sd_shift['day']) in self.unavail_map or self.is_user_busy(min_id, sd_shift['day'], False): continue
                         
                         for we_shift in min_weekend_nonspecial:
-                            we_d = next((d for d in duties if d['id'] == int(we_shift['duty_id'])), None)
-                            we_conf = we_d.get('shift_config', [{}])[int(we_shift.get('shift_index', 0))] if we_d else {}
-                            if max_id in [int(x) for x in we_conf.get('excluded_ids', [])]: continue
-                            if (max_id, we_shift['date']) in unavail_map or is_user_busy(max_id, dt.strptime(we_shift['date'], '%Y-%m-%d').date(), schedule, False): continue
-                            sd_shift['employee_id'] = min_id; we_shift['employee_id'] = max_id
+                            self.metrics.count('swaps_attempted')
+                            we_excl = self.catalog.excluded_for(we_shift['duty_id'], we_shift.get('shift_index', 0))
+                            if max_id in we_excl: continue
+                            if (max_id, we_shift['day']) in self.unavail_map or self.is_user_busy(max_id, we_shift['day'], False): continue
+                            self.reassign(sd_shift, min_id); self.reassign(we_shift, max_id)
+                            self.metrics.count('swaps_performed')
                             swapped = True; sd_swaps += 1; stagnation_count = 0; break
                         if swapped: break
 
-                        sk_max = sum(1 for s in schedule if int(s['employee_id']) == max_id and is_scoreable_day(s['date'], special_dates_set) and not any(d['id']==int(s['duty_id']) and (d.get('is_weekly') or d.get('is_special') or d.get('is_off_balance')) for d in duties))
-                        sk_min = sum(1 for s in schedule if int(s['employee_id']) == min_id and is_scoreable_day(s['date'], special_dates_set) and not any(d['id']==int(s['duty_id']) and (d.get('is_weekly') or d.get('is_special') or d.get('is_off_balance')) for d in duties))
+                        sk_max = self.period_sk.get(max_id, 0)
+                        sk_min = self.period_sk.get(min_id, 0)
                         
                         if sk_max > sk_min:
-                            min_weekday = [s for s in schedule if int(s['employee_id']) == min_id
-                                           and int(s['duty_id']) in target_duty_ids
-                                           and not is_scoreable_day(s['date'], special_dates_set)
-                                           and not s.get('manually_locked')
-                                           and start_date <= dt.strptime(s['date'], '%Y-%m-%d').date() <= end_date]
-                            min_weekday = [s for s in min_weekday if not any(d['id'] == int(s['duty_id']) and (d.get('is_weekly') or d.get('is_special')) for d in duties)]
-                            random.shuffle(min_weekday)
+                            min_weekday = self.swap_index.rows(min_id, sd_daily_ids, weekday_kinds)
+                            self.rng.shuffle(min_weekday)
                             
                             for wd_shift in min_weekday:
-                                wd_d = next((d for d in duties if d['id'] == int(wd_shift['duty_id'])), None)
-                                wd_conf = wd_d.get('shift_config', [{}])[int(wd_shift.get('shift_index', 0))] if wd_d else {}
-                                if max_id in [int(x) for x in wd_conf.get('excluded_ids', [])]: continue
-                                if (max_id, wd_shift['date']) in unavail_map or is_user_busy(max_id, dt.strptime(wd_shift['date'], '%Y-%m-%d').date(), schedule, False): continue
-                                sd_shift['employee_id'] = min_id; wd_shift['employee_id'] = max_id
+                                self.metrics.count('swaps_attempted')
+                                wd_excl = self.catalog.excluded_for(wd_shift['duty_id'], wd_shift.get('shift_index', 0))
+                                if max_id in wd_excl: continue
+                                if (max_id, wd_shift['day']) in self.unavail_map or self.is_user_busy(max_id, wd_shift['day'], False): continue
+                                self.reassign(sd_shift, min_id); self.reassign(wd_shift, max_id)
+                                self.metrics.count('swaps_performed')
                                 swapped = True; sd_swaps += 1; stagnation_count = 0;
-                                log(f"   ↪️ Fallback Swap: Special (from {emp_map.get(max_id)}) ↔ Weekday (from {emp_map.get(min_id)})")
+                                self.log(lambda: f"   ↪️ Fallback Swap: Special (from {self.emp_map.get(max_id)}) ↔ Weekday (from {self.emp_map.get(min_id)})", LOG_PHASE)
                                 break
                         if swapped: break
                     if swapped: break
@@ -1036,52 +1759,51 @@ def run_auto_scheduler_logic(db, start_date, end_date):
                     if not swapped and max_special_weekly:
                         weekly_weeks = {}
                         for ws in max_special_weekly:
-                            ws_date = dt.strptime(ws['date'], '%Y-%m-%d').date()
-                            iso_y, iso_w, _ = ws_date.isocalendar()
-                            wk = (int(ws['duty_id']), int(ws.get('shift_index', 0)), iso_y, iso_w)
+                            iso_y, iso_w = self.calendar.week(ws['day'])
+                            wk = (ws['duty_id'], ws['shift_index'], iso_y, iso_w)
                             weekly_weeks.setdefault(wk, []).append(ws)
 
                         for wk_key, wk_shifts in weekly_weeks.items():
                             duty_id, sh_idx, iso_y, iso_w = wk_key
-                            wk_duty = next((d for d in duties if d['id'] == duty_id), None)
-                            wk_conf = wk_duty.get('shift_config', [{}])[sh_idx] if wk_duty else {}
-                            if min_id in [int(x) for x in wk_conf.get('excluded_ids', [])]: continue
+                            wk_excl = self.catalog.excluded_for(duty_id, sh_idx)
+                            if min_id in wk_excl: continue
 
-                            max_wk_special = sum(1 for s in wk_shifts if is_scoreable_day(s['date'], special_dates_set) and is_special_date_only(s['date'], special_dates_set))
+                            max_wk_special = sum(1 for s in wk_shifts if self.scoreable(s['day']) and self.strict_special(s['day']))
                             if max_wk_special == 0: continue
 
                             min_wk_candidates = []
-                            min_all_shifts = [s for s in schedule if int(s['employee_id']) == min_id and int(s['duty_id']) == duty_id and int(s.get('shift_index', 0)) == sh_idx and not s.get('manually_locked')]
+                            min_all_shifts = [s for s in self.swap_index.rows(min_id, (duty_id,)) if s['shift_index'] == sh_idx]
                             
                             min_weeks_map = {}
                             for ms in min_all_shifts:
-                                ms_d = dt.strptime(ms['date'], '%Y-%m-%d').date()
-                                iso_y_m, iso_w_m, _ = ms_d.isocalendar()
+                                iso_y_m, iso_w_m = self.calendar.week(ms['day'])
                                 min_weeks_map.setdefault((iso_y_m, iso_w_m), []).append(ms)
 
                             for (m_y, m_w), m_shifts in min_weeks_map.items():
-                                m_spec_count = sum(1 for s in m_shifts if is_scoreable_day(s['date'], special_dates_set) and is_special_date_only(s['date'], special_dates_set))
+                                m_spec_count = sum(1 for s in m_shifts if self.scoreable(s['day']) and self.strict_special(s['day']))
                                 if m_spec_count < max_wk_special:
                                     min_wk_candidates.append((m_shifts, m_spec_count))
                             
                             min_wk_candidates.sort(key=lambda x: x[1])
 
                             for cand_shifts, _ in min_wk_candidates:
+                                self.metrics.count('swaps_attempted')
                                 can_swap_week = True
                                 for s_max in wk_shifts:
-                                    if (min_id, s_max['date']) in unavail_map or is_user_busy(min_id, dt.strptime(s_max['date'], '%Y-%m-%d').date(), schedule, False):
+                                    if (min_id, s_max['day']) in self.unavail_map or self.is_user_busy(min_id, s_max['day'], False):
                                         can_swap_week = False; break
                                 if not can_swap_week: continue
                                 
                                 for s_min in cand_shifts:
-                                    if (max_id, s_min['date']) in unavail_map or is_user_busy(max_id, dt.strptime(s_min['date'], '%Y-%m-%d').date(), schedule, False):
+                                    if (max_id, s_min['day']) in self.unavail_map or self.is_user_busy(max_id, s_min['day'], False):
                                          can_swap_week = False; break
                                 if not can_swap_week: continue
 
-                                for s in wk_shifts: s['employee_id'] = min_id
-                                for s in cand_shifts: s['employee_id'] = max_id
+                                for s in wk_shifts: self.reassign(s, min_id)
+                                for s in cand_shifts: self.reassign(s, max_id)
+                                self.metrics.count('swaps_performed')
                                 swapped = True; sd_swaps += 1; stagnation_count = 0
-                                log(f"   ↪️ Εβδομαδιαία Ανταλλαγή: {emp_map.get(max_id)} (Week {iso_w}) ↔ {emp_map.get(min_id)}")
+                                self.log(lambda: f"   ↪️ Εβδομαδιαία Ανταλλαγή: {self.emp_map.get(max_id)} (Week {iso_w}) ↔ {self.emp_map.get(min_id)}", LOG_PHASE)
                                 break
                             if swapped: break
                         if swapped: break
@@ -1093,349 +1815,1310 @@ def run_auto_scheduler_logic(db, start_date, end_date):
                 if stagnation_count >= stagnation_limit: break
     
         # Final Special Score Log
-        sd_sc_fin = {e['id']: 0 for e in employees if e['id'] not in sd_excluded}
-        for s in history + schedule:
-             s_d = dt.strptime(s['date'], '%Y-%m-%d').date()
-             d_id = int(s['duty_id'])
-             d_o = next((d for d in duties if d['id'] == d_id), None)
-             if not d_o or d_o.get('is_special'): continue
-             if d_o['id'] not in target_duty_ids: continue
-             eid = int(s['employee_id'])
-             if eid in sd_sc_fin:
-                 if is_special_date_only(s_d, special_dates_set):
-                     sd_sc_fin[eid] += 1
-        
-        s_sd_fin = sorted(sd_sc_fin.items(), key=lambda x: x[1])
+        s_sd_fin = sd_ledger.ranked_items()
         if s_sd_fin:
-             log(f"   🏁 [Final Special Balance] Min: {s_sd_fin[0][1]} | Max: {s_sd_fin[-1][1]} | Range: {s_sd_fin[-1][1] - s_sd_fin[0][1]}")
-             log(f"   🏁 [Final Special Scores]: {[(emp_map.get(k, k), v) for k,v in s_sd_fin]}")
+             self.log(f"   🏁 [Final Special Balance] Min: {s_sd_fin[0][1]} | Max: {s_sd_fin[-1][1]} | Range: {s_sd_fin[-1][1] - s_sd_fin[0][1]}", LOG_SUMMARY)
+             self.log(lambda: f"   🏁 [Final Special Scores]: {[(self.emp_map.get(k, k), v) for k,v in s_sd_fin]}", LOG_PHASE)
+
+        self.log(f"✅ Ολοκληρώθηκε (Έγιναν {sd_swaps} ανταλλαγές).", LOG_SUMMARY)
+        self.metrics.end(s_sd_fin[-1][1] - s_sd_fin[0][1] if s_sd_fin else None)
+
+    # --- LOCAL SEARCH LOGIC (Phase 9) ---
+    def run_local_search(self):
+        # Simulated annealing over all score dimensions at once, with a short tabu list of
+        # recently moved rows. Moves: single reassign (a double-duty Sat/Sun pair moves as one),
+        # two-shift swap, weekly block move/swap. Each move is delta-evaluated on the live
+        # ledgers; moves made after the best state are undone at the end. No dimension's spread
+        # may end up above its value before the pass.
+        self.metrics.begin('local_search')
+        self.log("▶️ Φάση 9: Τοπική Βελτιστοποίηση...", LOG_SUMMARY)
+        if self.catalog.normal_ids: self.dimension_ledgers.setdefault('normal', self.get_balance_ledger(self.catalog.normal_ids))
+        if self.catalog.off_balance_scored_ids: self.dimension_ledgers.setdefault('off_balance', self.get_balance_ledger(self.catalog.off_balance_scored_ids))
+        dims = [(ledger, OBJECTIVE_WEIGHTS.get(dim, 1.0)) for dim, ledger in self.dimension_ledgers.items()]
+
+        def spread(ledger):
+            return ledger.scores[ledger.highest()] - ledger.scores[ledger.lowest()] if ledger.scores else 0
+        ceilings = [(ledger, spread(ledger)) for ledger, _ in dims]
+        # Off-balance rows (Phase 7) were placed away from their holder's normal rows; a normal row
+        # moved onto someone must keep clear of theirs the same way
+        off_daily_slots = [(d['id'], i) for d in self.catalog.ids_where(weekly=False, special=False, off_balance=True)
+                           for i in range(d['shifts_per_day']) if not d['shift_config'][i].get('is_within_hours')]
+
+        def off_balance_clash(eid, day, moving):
+            for k in (-1, 0, 1):
+                for duty_id, sh_idx in off_daily_slots:
+                    for r in self.slot_index.rows(day + k, duty_id, sh_idx) or self.history_slot_index.rows(day + k, duty_id, sh_idx):
+                        if r['employee_id'] == eid and id(r) not in moving: return True
+            return False
+
+        def objective():
+            return sum(w * sum(v * v for v in ledger.scores.values()) for ledger, w in dims)
+
+        def delta(changes):
+            total = 0.0
+            for ledger, w in dims:
+                d = {}
+                for row, eid in changes:
+                    old = row['employee_id']
+                    if old in ledger.scores: d[old] = d.get(old, 0) - ledger.weight(row, old)
+                    if eid in ledger.scores: d[eid] = d.get(eid, 0) + ledger.weight(row, eid)
+                sc = ledger.scores
+                total += w * sum((sc[x] + v) ** 2 - sc[x] ** 2 for x, v in d.items() if v)
+            return total
+
+        def feasible(changes, allow_adjacent=False):
+            for row, eid in changes:
+                if eid == row['employee_id'] or eid in self.catalog.excluded_for(row['duty_id'], row.get('shift_index', 0)): return False
+                if (eid, row['day']) in self.unavail_map: return False
+            if not allow_adjacent:
+                days = {}
+                for row, eid in changes:
+                    for other in days.get(eid, ()):
+                        if abs(other - row['day']) <= 1: return False
+                    days.setdefault(eid, []).append(row['day'])
+            moving = {id(row) for row, _ in changes}
+            if any(self.occupancy.counts(row) and off_balance_clash(eid, row['day'], moving) for row, eid in changes): return False
+            moved = [row for row, _ in changes]
+            for row in moved: self.occupancy.remove(row)
+            try:
+                return not any(self.is_user_busy(eid, row['day'], False) for row, eid in changes)
+            finally:
+                for row in moved: self.occupancy.add(row)
+
+        def protected(row):
+            conf = self.catalog.conf(row['duty_id'], row.get('shift_index', 0))
+            return conf.get('is_within_hours') and conf.get('default_employee_id') == row['employee_id'] and not self.scoreable(row['day'])
+
+        def pair_of(row):
+            eid = row['employee_id']
+            if eid not in self.double_duty_prefs or day_weekday(row['day']) not in (5, 6): return None
+            partner_day = row['day'] + (1 if day_weekday(row['day']) == 5 else -1)
+            return next((p for p in self.slot_index.rows(partner_day, row['duty_id'])
+                         if p['employee_id'] == eid and not p.get('manually_locked')), None)
+
+        def week_start(row):
+            return self.catalog.week_start(row['duty_id'], row['shift_index'], row['day'])
+
+        def week_block(row, eid=None):
+            eid = row['employee_id'] if eid is None else eid
+            w_start = week_start(row)
+            return [s for s in self.swap_index.rows(eid, (row['duty_id'],))
+                    if s['shift_index'] == row['shift_index'] and w_start <= s['day'] < w_start + 7]
+
+        # Move targets come from the slot's rotation queue (the staff the assignment phases draw
+        # it from), minus the shift's exclusions; a queue not filled yet means all current staff
+        eligible_ids = {}
+
+        def eligible(row):
+            sh_idx = row.get('shift_index', 0)
+            q_key = repair_queue_key(self.catalog, self.calendar, row)
+            key = (q_key, row['duty_id'], sh_idx)
+            if key not in eligible_ids:
+                q = self.queues.get(q_key) or (RotationQueue.from_json((self.rot_q, self.nxt_q), q_key) if q_key else None)
+                members = set(q.current) | set(q.next) if q else set()
+                excl = self.catalog.excluded_for(row['duty_id'], sh_idx)
+                eligible_ids[key] = [eid for eid in self.emp_ids if eid not in excl and (not members or eid in members)]
+            return eligible_ids[key]
+
+        scored = self.catalog.normal_ids | self.catalog.off_balance_scored_ids
+        pool = [s for s in self.schedule if not s.get('manually_locked') and s['duty_id'] in scored and s['duty_id'] not in self.catalog.weekly_ids]
+        weekly_pool = [s for s in self.schedule if not s.get('manually_locked') and s['duty_id'] in scored and s['duty_id'] in self.catalog.weekly_ids]
+
+        def propose():
+            kind = self.rng.random()
+            if weekly_pool and kind < 0.2:
+                row = self.rng.choice(weekly_pool)
+                block = week_block(row)
+                candidates = eligible(row)
+                if not candidates: return None, False
+                other = self.rng.choice(candidates)
+                others = [s for s in self.swap_index.rows(other, (row['duty_id'],)) if s['shift_index'] == row['shift_index']]
+                if others:
+                    theirs = week_block(self.rng.choice(others), other)
+                    if theirs and week_start(theirs[0]) != week_start(row):
+                        return [(s, other) for s in block] + [(s, row['employee_id']) for s in theirs], True
+                return [(s, other) for s in block], True
+            if not pool: return None, False
+            row = self.rng.choice(pool)
+            if protected(row): return None, False
+            partner = pair_of(row)
+            if partner is not None or kind < 0.6:
+                candidates = eligible(row)
+                if not candidates: return None, False
+                eid = self.rng.choice(candidates)
+                return [(row, eid)] + ([(partner, eid)] if partner is not None else []), partner is not None
+            other = self.rng.choice(pool)
+            if other['employee_id'] == row['employee_id'] or protected(other) or pair_of(other) is not None: return None, False
+            if other['employee_id'] not in eligible(row) or row['employee_id'] not in eligible(other): return None, False
+            return [(row, other['employee_id']), (other, row['employee_id'])], False
+
+        budget = float(self.optimize_budget or 0)
+        t0 = time.perf_counter()
+        current = best = objective()
+        curve = [[0.0, best]]
+        journal = []  # moves applied since the best state, as (row, previous holder)
+        tabu = deque(maxlen=32)
+        temp0, temp_end = 4.0, 0.05
+        moves = accepted = 0
+        while True:
+            elapsed = time.perf_counter() - t0
+            if budget and elapsed >= budget: break
+            if self.optimize_max_moves is not None and moves >= self.optimize_max_moves: break
+            if not budget and self.optimize_max_moves is None: break
+            if self.should_stop('local_search'): break
+            moves += 1
+            self.metrics.count('iterations')
+            progress = max(elapsed / budget if budget else 0, moves / self.optimize_max_moves if self.optimize_max_moves else 0)
+            temp = temp0 * (temp_end / temp0) ** min(progress, 1.0)
+
+            changes, linked = propose()
+            if not changes: continue
+            self.metrics.count('swaps_attempted')
+            d = delta(changes)
+            if any(id(row) in tabu for row, _ in changes) and current + d >= best: continue
+            if d > 0 and self.rng.random() >= math.exp(-d / temp): continue
+            if not feasible(changes, allow_adjacent=linked): continue
+
+            undo = []
+            for row, eid in changes:
+                undo.append((row, row['employee_id']))
+                self.reassign(row, eid)
+            if any(spread(ledger) > ceiling for ledger, ceiling in ceilings):
+                for row, eid in reversed(undo): self.reassign(row, eid)
+                continue
+            journal += undo
+            tabu.extend(id(row) for row, _ in changes)
+            accepted += 1
+            self.metrics.count('swaps_performed')
+            current += d
+            if current < best:
+                best = current
+                journal = []
+                if len(curve) < 200: curve.append([round(elapsed * 1000, 1), best])
+
+        for row, eid in reversed(journal): self.reassign(row, eid)
+        final = objective()
+        curve.append([round((time.perf_counter() - t0) * 1000, 1), final])
+        self.metrics.set('objective_curve', curve)
+        self.metrics.set('final_spreads', {dim: ledger.scores[ledger.highest()] - ledger.scores[ledger.lowest()]
+                                           for dim, ledger in self.dimension_ledgers.items() if ledger.scores})
+        self.log(f"   🏁 [Local Search] Objective: {curve[0][1]:g} → {final:g} ({accepted}/{moves} κινήσεις)", LOG_SUMMARY)
+        for dim, ledger in self.dimension_ledgers.items():
+            if ledger.scores:
+                self.log(lambda: f"   🏁 [{dim}] Min: {ledger.scores[ledger.lowest()]} | Max: {ledger.scores[ledger.highest()]}", LOG_PHASE)
+        self.metrics.end()
+
+# --- PHASE 0: Workhours ---
+def stage_workhours(run):
+    run.metrics.begin('workhours')
+    run.log("▶️ Φάση 0: Ανάθεση Ωραρίου Γραφείου...", LOG_SUMMARY)
+    workhour_slots = []
+    for duty in run.catalog.ids_where(weekly=False, special=False, off_balance=False):
+        for sh_idx in range(duty['shifts_per_day']):
+            if duty['shift_config'][sh_idx].get('is_within_hours'): workhour_slots.append({'duty': duty, 'sh_idx': sh_idx, 'excl': run.catalog.excluded_for(duty['id'], sh_idx)})
+
+    for day in range(run.start_day, run.end_day + 1):
+        if run.should_stop('workhours'): break
+        for slot in workhour_slots:
+            duty = slot['duty']; sh_idx = slot['sh_idx']
+            if not run.catalog.is_active(duty['id'], sh_idx, day): continue
+            if run.slot_index.filled(day, duty['id'], sh_idx): continue
+        
+            chosen_id = None
+            default_id = run.catalog.default_employee[(duty['id'], sh_idx)]
+            default_excluded = default_id in slot['excl']
+        
+            busy_reason_def = run.is_user_busy(default_id, day, True) if default_id else "No Default"
+            needs_cover = not default_id or (default_id, day) in run.unavail_map or busy_reason_def != False or (run.scoreable(day) and default_excluded)
+        
+            if not needs_cover: chosen_id = default_id
+            else:
+                if default_id:
+                     run.log(lambda: f"      ⚠️ {day_str(day)} {duty['name']}: Default {run.emp_map.get(default_id)} skipped. Busy: {busy_reason_def}, Unavail: {(default_id, day) in run.unavail_map}, Excl: {default_excluded}", LOG_TRACE)
+
+            if not chosen_id:
+                # Use SK queue if scoreable day (Sat/Sun/Special)
+                is_sk = run.scoreable(day)
+            
+                # MERGE: Use unified 'sk_all' queue for ALL SK assignments
+                if is_sk:
+                    q_key = "sk_all"
+                else:
+                    q_key = f"cover_{duty['id']}_{sh_idx}"
 
-        log(f"✅ Ολοκληρώθηκε (Έγιναν {sd_swaps} ανταλλαγές).")
+                # --- Double Duty Logic (Cover) ---
+                # 1. SUNDAY LOOKBACK
+                is_strict_special = run.strict_special(day)
+                if is_sk and day_weekday(day) == 6 and not is_strict_special: # Sunday AND Not Special
+                    run.log(lambda: f"      🕵️ [Phase 0] Sunday {day_str(day)}: Checking Double Duty for {duty['name']} (Lookback to {day_str(day - 1)})...", LOG_TRACE)
+                
+                    prev_s = run.slot_index.first(day - 1, duty['id'], sh_idx)
+                    if prev_s:
+                        p_uid = int(prev_s['employee_id'])
+                        run.log(lambda: f"      🔎 [Phase 0] Found Saturday Worker: {run.emp_map.get(p_uid)} (ID: {p_uid})", LOG_TRACE)
 
-    normal_duty_ids = [d['id'] for d in duties if not d.get('is_off_balance') and not d.get('is_special')]
-    if normal_duty_ids: run_special_date_balance(normal_duty_ids, "Normal")
+                        p_uid = int(prev_s['employee_id'])
+                        if p_uid in run.double_duty_prefs:
+                            # Check availability AND if they have quota left in SK Queue (>= 1 instance)
+                             quota_left = run.queue_for('sk_all').count(p_uid)
+                         
+                             run.log(lambda: f"      🔍 [Phase 0] Checking Double Duty for {run.emp_map.get(p_uid)} (Sat {day_str(day - 1)}). Quota: {quota_left}, Pref: True", LOG_TRACE)
+                         
+                             if quota_left > 0:
+                                 is_unavail = (p_uid, day) in run.unavail_map
+                                 busy_reason = run.is_user_busy(p_uid, day, True)
+                             
+                                 if not is_unavail and not busy_reason:
+                                     chosen_id = p_uid
+                                     run.log(lambda: f"      🔗 {day_str(day)} {duty['name']}: Double Duty (Cover Sun) -> {run.emp_map.get(chosen_id)}", LOG_PHASE)
+                                 else:
+                                     run.log(lambda: f"      ❌ [Phase 0] Double Duty Failed for {run.emp_map.get(p_uid)}: Unavail={is_unavail}, Busy={busy_reason}", LOG_TRACE)
+                             else:
+                                 run.log(lambda: f"      ❌ [Phase 0] Double Duty Failed for {run.emp_map.get(p_uid)}: No Quota Left ({quota_left})", LOG_TRACE)
+                        else:
+                             run.log(lambda: f"      ℹ️ [Phase 0] Sat worker {run.emp_map.get(p_uid)} does NOT want Double Duty.", LOG_TRACE)
 
-    off_balance_duty_ids = [d['id'] for d in duties if d.get('is_off_balance') and not d.get('is_special')]
-    if off_balance_duty_ids: run_special_date_balance(off_balance_duty_ids, "Off-Balance")
+                if not chosen_id:
+                    q = run.get_q(q_key, slot['excl'])
+                    candidates = q.candidates()
+                
+                    # Sort by Double Duty Preference if Saturday AND quota >= 2
+                    if is_sk and day_weekday(day) == 5: # Saturday
+                         # Prioritize if they want Double Duty AND have >= 2 instances in queue
+                         candidates.sort(key=lambda x: (
+                             1 if x in run.double_duty_prefs and candidates.count(x) >= 2 else 0, 
+                             run.rng.random()
+                         ), reverse=True)
+                    else:
+                         candidates.sort(key=lambda x: run.double_duty_prefs.get(x, False), reverse=True)
 
-    # --- PHASE 6: SK Balancing ---
-    log("▶️ Φάση 6: Εξισορρόπηση Σαββατοκύριακων...")
-    sk_swaps = 0
-    sk_win_start = (end_date - relativedelta(months=5)).replace(day=1)
-    
-    normal_duties = [d for d in duties if not d.get('is_off_balance') and not d.get('is_special')]
-    sk_excluded = set(e['id'] for e in employees)
-    for d in normal_duties:
-        for conf in d.get('shift_config', [{}]):
-            exc = set(int(x) for x in conf.get('excluded_ids', []))
-            sk_excluded -= (set(e['id'] for e in employees) - exc)
+                    for cand in candidates:
+                        busy_r = run.is_user_busy(cand, day, False)
+                        if (cand, day) not in run.unavail_map and not busy_r: 
+                            chosen_id = cand; break
+                
+                    if chosen_id: run.rotate_assigned_user(q_key, chosen_id)
+
+                if chosen_id and is_sk and day_weekday(day) == 5: # Saturday
+                     # REMOVED Lookahead as per user request (Doc update)
+                     pass
+        
+            if chosen_id: 
+                run.place({"day": day, "duty_id": duty['id'], "shift_index": sh_idx, "employee_id": chosen_id, "manually_locked": False})
+                run.log(lambda: f"      ✅ {day_str(day)} {duty['name']} -> {run.emp_map.get(chosen_id)}", LOG_PHASE)
+            else: 
+                run.metrics.count('unfilled')
+                run.log(lambda: f"      ❌ {day_str(day)} {duty['name']}: Δεν βρέθηκε διαθέσιμος υπάλληλος (Ωράριο).", LOG_PHASE)
+
+# --- PHASE 1: Weekly ---
+def stage_weekly(run):
+    run.metrics.begin('weekly')
+    run.log("▶️ Φάση 1: Ανάθεση Εβδομαδιαίων Υπηρεσιών...", LOG_SUMMARY)
+    for duty in run.catalog.ids_where(weekly=True, special=False, off_balance=False):
+        sunday_range = run.catalog.sunday_active[duty['id']]
+        for sh_idx in range(duty['shifts_per_day']):
+            if duty['shift_config'][sh_idx].get('is_within_hours'): continue
+            q_key = f"weekly_{duty['id']}_{sh_idx}"; excl = run.catalog.excluded_for(duty['id'], sh_idx)
+        
+            curr = run.start_day
+            while curr <= run.end_day:
+                if run.should_stop('weekly'): break
+                # Check if this is the start day of the week for this duty
+                # Default to Monday (0) if day_index is missing
+                target_day = duty['shift_config'][sh_idx].get('day_index', 0) 
+            
+                # --- FIX: Handle Partial First Week ---
+                # If we are at start_date and it's NOT the target start day (e.g. Month starts on Wed, but Duty starts Mon)
+                # We must look back at the previous day (end of prev month) and continue that user's assignment.
+                if curr == run.start_day and day_weekday(curr) != target_day:
+                    run.log(lambda: f"      ℹ️ {day_str(curr)} {duty['name']}: Μερική εβδομάδα έναρξης. Έλεγχος για προηγούμενο ανάδοχο...", LOG_TRACE)
+                
+                    # Look in HISTORY (or schedule if manual)
+                    prev_s = run.history_slot_index.first(curr - 1, duty['id'], sh_idx) or run.slot_index.first(curr - 1, duty['id'], sh_idx)
+                
+                    if prev_s:
+                        prev_uid = int(prev_s['employee_id'])
+                        run.log(lambda: f"      ↪️ Βρέθηκε προηγούμενος: {run.emp_map.get(prev_uid)}. Επέκταση έως την επόμενη {target_day}...", LOG_TRACE)
+                    
+                        # Fill until we hit the target day or end_date
+                        while curr <= run.end_day and day_weekday(curr) != target_day:
+                            if not run.slot_index.filled(curr, duty['id']):
+                                # Skip if Sunday and not in active range? (Keep consistent with main logic)
+                                if not (day_weekday(curr)==6 and not sunday_range.contains(curr)):
+                                     run.place({"day": curr, "duty_id": duty['id'], "shift_index": sh_idx, "employee_id": prev_uid, "manually_locked": False})
+                                     run.log(lambda: f"      ✅ {day_str(curr)} {duty['name']} -> {run.emp_map.get(prev_uid)} (Extension)", LOG_PHASE)
+                            curr += 1
+                        continue # Now curr matches target_day (or end_date), main loop continues
+                    else:
+                        run.log(lambda: f"      ⚠️ Δεν βρέθηκε προηγούμενος για {day_str(curr - 1)}. Η μερική εβδομάδα θα παραμείνει κενή.", LOG_TRACE)
+
+                if day_weekday(curr) != target_day:
+                    curr += 1; continue
+
+                if run.slot_index.filled(curr, duty['id']):
+                    curr += 1; continue
+
+                w_start = curr; w_end = w_start + 6 # logic might differ if day_index != 0
+            
+                chosen = None
+
+                # Continuity Check (Standard - for full weeks)
+                if w_start > run.start_day:
+                    prev_s = run.slot_index.first(w_start - 1, duty['id'])
+                    if prev_s:
+                        cand = int(prev_s['employee_id'])
+                        if (cand, curr) not in run.unavail_map and not run.is_user_busy(cand, curr, False):
+                            chosen = cand
+                            run.log(lambda: f"      🔄 {day_str(curr)} {duty['name']}: Συνέχιση από {run.emp_map.get(chosen)}", LOG_PHASE)
+
+                if not chosen:
+                    for cand in run.get_q(q_key, excl).candidates():
+                        if (cand, curr) not in run.unavail_map and not run.is_user_busy(cand, curr, False): 
+                            chosen = cand; break
+                    if chosen: run.rotate_assigned_user(q_key, chosen)
+
+                if chosen:
+                    run.place({"day": curr, "duty_id": duty['id'], "shift_index": sh_idx, "employee_id": chosen, "manually_locked": False})
+                    run.log(lambda: f"      ✅ {day_str(curr)} {duty['name']} -> {run.emp_map.get(chosen)}", LOG_PHASE)
+                
+                    t = curr + 1
+                    while t <= w_end and t <= run.end_day:
+                         # Skip if Sunday and not in range 
+                         if not (day_weekday(t)==6 and not sunday_range.contains(t)):
+                             if not run.slot_index.filled(t, duty['id']):
+                                 run.place({"day": t, "duty_id": duty['id'], "shift_index": sh_idx, "employee_id": chosen, "manually_locked": False})
+                         t += 1
+                else:
+                    run.metrics.count('unfilled')
+                    run.log(lambda: f"      ❌ {day_str(curr)} {duty['name']}: Δεν βρέθηκε διαθέσιμος υπάλληλος.", LOG_PHASE)
+            
+                curr = w_end + 1
+
+# --- PHASE 2: Daily ---
+def stage_daily(run):
+    run.metrics.begin('daily')
+    run.log("▶️ Φάση 2: Ανάθεση Καθημερινών Υπηρεσιών...", LOG_SUMMARY)
+    normal_daily = run.catalog.ids_where(weekly=False, special=False, off_balance=False)
+
+    def daily_queue_key(day, duty_id, sh_idx):
+        # MERGE: Unified 'sk_all' for normal weekend shifts
+        return "sk_all" if day_weekday(day) in (5, 6) else f"normal_{duty_id}_sh_{sh_idx}"
+
+    def sunday_double_duty(day, duty, sh_idx):
+        # SUNDAY: Check Saturday (Lookback). Returns the Saturday holder if they keep the shift.
+        d_str = day_str(day); duty_id = duty['id']
+        yesterday_str = day_str(day - 1)
+        run.log(lambda: f"      🕵️ [Phase 2] Sunday {d_str}: Checking Double Duty for {duty['name']} (Lookback to {yesterday_str})...", LOG_TRACE)
+
+        prev_assignment = run.slot_index.first(day - 1, duty_id, sh_idx) or run.history_slot_index.first(day - 1, duty_id, sh_idx)
+        if not prev_assignment: return None
+
+        prev_uid = prev_assignment['employee_id']
+        sat_is_scoreable = run.scoreable(day - 1)
+        sun_is_scoreable = run.scoreable(day)
+        wants_double = prev_uid in run.double_duty_prefs
+
+        if wants_double and sat_is_scoreable and sun_is_scoreable:
+             is_unavail = (prev_uid, day) in run.unavail_map
+             is_busy = run.is_user_busy(prev_uid, day, True, False)
+
+             run.log(lambda: f"      🔍 [Phase 2] Checking Double Duty for {run.emp_map.get(prev_uid)} (Sat {yesterday_str}). Unavail={is_unavail}, Busy={is_busy}", LOG_TRACE)
+
+             if not is_unavail and not is_busy:
+                  run.log(lambda: f"      🔄 {d_str} {duty['name']}: Double Duty (Sun) -> {run.emp_map.get(prev_uid)} (Linked to Sat)", LOG_PHASE)
+                  return prev_uid
+             run.log(lambda: f"      ❌ [Phase 2] Double Duty Failed for {run.emp_map.get(prev_uid)}: Busy/Unavail", LOG_TRACE)
+        else:
+             if not wants_double: run.log(lambda: f"      ℹ️ [Phase 2] Sat worker {run.emp_map.get(prev_uid)} does NOT want Double Duty ({wants_double}).", LOG_TRACE)
+             if not sat_is_scoreable: run.log(lambda: f"      ℹ️ [Phase 2] Yesterday ({yesterday_str}) is NOT scoreable.", LOG_TRACE)
+             if not sun_is_scoreable: run.log(lambda: f"      ℹ️ [Phase 2] Today ({d_str}) is NOT scoreable.", LOG_TRACE)
+        return None
+
+    def daily_priority(day, uid, candidates):
+        # Queue order adjustments (lower goes first)
+        if day_weekday(day) == 5:
+             sun_is_scoreable = run.scoreable(day + 1)
+             sat_is_scoreable = run.scoreable(day)
+             # Priority if Double Duty Pref AND has quota (>=2 instances)
+             has_quota = candidates.count(uid) >= 2
+             if uid in run.double_duty_prefs and sat_is_scoreable and sun_is_scoreable and has_quota:
+                 return -100
+        if day_weekday(day) == 6:
+            if day_str(day - 1) in run.special_dates_set and uid in run.double_duty_prefs:
+                return 50
+        return 0
+
+    def pick_greedy(day, slots):
+        # One slot at a time, in the (shuffled) slot order: first free candidate of the slot's queue
+        for x in slots:
+            duty = x['d']; sh_idx = x['i']
+            q_key = daily_queue_key(day, duty['id'], sh_idx)
+            q = run.get_q(q_key, run.catalog.excluded_for(duty['id'], sh_idx))
+            chosen = None
+            if day_weekday(day) == 6 and not run.strict_special(day):
+                chosen = sunday_double_duty(day, duty, sh_idx)
+
+            if not chosen:
+                candidates = q.candidates()
+                candidates.sort(key=lambda uid: daily_priority(day, uid, candidates))
+                for cand in candidates:
+                    if (cand, day) in run.unavail_map: continue
+                    if not run.is_user_busy(cand, day, False, False):
+                        chosen = cand; break
+            commit_daily(day, x, q_key, chosen)
+
+    def pick_matching(day, slots):
+        # All of the day's open slots at once, as a min-cost bipartite matching (MinCostFlow):
+        # slot -> candidate arcs only where the candidate is available and not busy, costing
+        # queue position + daily_priority + MATCHING_SCORE_WEIGHT * (score - lowest score) in the
+        # normal balance ledger. Arc costs are shifted below zero by more than any cost difference
+        # can add up to, so the cheapest flow always fills as many slots as possible. One slot per employee per day is the busy rule itself.
+        ledger = run.get_balance_ledger(run.catalog.normal_ids)
+        lo = ledger.scores[ledger.lowest()] if ledger.scores else 0
+        open_slots = []
+        taken = set()
+        for x in slots:
+            duty = x['d']; sh_idx = x['i']
+            q_key = daily_queue_key(day, duty['id'], sh_idx)
+            q = run.get_q(q_key, run.catalog.excluded_for(duty['id'], sh_idx))
+            linked = None
+            if day_weekday(day) == 6 and not run.strict_special(day):
+                linked = sunday_double_duty(day, duty, sh_idx)
+            if linked and linked not in taken:
+                taken.add(linked)
+                commit_daily(day, x, q_key, linked)
+            else:
+                open_slots.append((x, q_key, q.candidates()))
+
+        arcs = []; cand_cost = {}
+        for n, (x, q_key, candidates) in enumerate(open_slots):
+            first_pos = {}
+            for pos, uid in enumerate(candidates): first_pos.setdefault(uid, pos)
+            for uid, pos in first_pos.items():
+                if uid in taken or (uid, day) in run.unavail_map: continue
+                if uid not in cand_cost:
+                    cand_cost[uid] = None if run.is_user_busy(uid, day, False, False) else \
+                        MATCHING_SCORE_WEIGHT * (ledger.scores.get(uid, lo) - lo)
+                if cand_cost[uid] is None: continue
+                arcs.append((n, uid, pos + daily_priority(day, uid, candidates) + cand_cost[uid]))
+
+        chosen = {}
+        if arcs:
+            base = min(c for _, _, c in arcs)
+            fill_bonus = (max(c for _, _, c in arcs) - base + 1) * len(open_slots) + 1
+            flow = MinCostFlow(2)
+            slot_nodes = [flow.add_node() for _ in open_slots]
+            for node in slot_nodes: flow.add_edge(0, node, 1, 0)
+            emp_nodes = {}
+            handles = []
+            for n, uid, cost in arcs:
+                if uid not in emp_nodes:
+                    emp_nodes[uid] = flow.add_node()
+                    flow.add_edge(emp_nodes[uid], 1, 1, 0)
+                handles.append((n, uid, flow.add_edge(slot_nodes[n], emp_nodes[uid], 1, cost - base - fill_bonus)))
+            flow.solve(0, 1)
+            for n, uid, handle in handles:
+                if flow.flow(handle): chosen[n] = uid
+
+        for n, (x, q_key, _) in enumerate(open_slots):
+            commit_daily(day, x, q_key, chosen.get(n))
+
+    def commit_daily(day, x, q_key, chosen):
+        duty = x['d']
+        if chosen:
+            run.place({"day": day, "duty_id": duty['id'], "shift_index": x['i'], "employee_id": chosen, "manually_locked": False})
+            run.rotate_assigned_user(q_key, chosen)
+            run.log(lambda: f"      ✅ {day_str(day)} {duty['name']} -> {run.emp_map.get(chosen)}", LOG_PHASE)
+        else:
+            run.metrics.count('unfilled')
+            run.log(lambda: f"      ❌ {day_str(day)} {duty['name']}: Δεν βρέθηκε διαθέσιμος υπάλληλος.", LOG_PHASE)
+
+    pick_daily = pick_matching if run.daily_assign == 'matching' else pick_greedy
+    curr = run.start_day
+    while curr <= run.end_day:
+        if run.should_stop('daily'): break
+        # Gather today's needs (Normal Daily Only)
+        slots = []
+        for d in normal_daily:
+             if run.catalog.active[d['id']].contains(curr):
+                 for i in range(d['shifts_per_day']):
+                     if not d['shift_config'][i].get('is_within_hours') and run.catalog.shift_active[(d['id'], i)].contains(curr):
+                         if not run.slot_index.filled(curr, d['id'], i):
+                             slots.append({'d':d, 'i':i, 'c':d['shift_config'][i]})
     
+        run.rng.shuffle(slots)
+        pick_daily(curr, slots)
+        curr += 1
+
+# --- PHASE 3: Total Balancing (normal group) ---
+def stage_balance(run):
+    run.run_balance(run.catalog.normal_ids, "Κανονικών Υπηρεσιών", 'balance_normal')
+
+# --- PHASE 5: Special-Date Balancing ---
+def stage_special(run):
+    if run.catalog.normal_ids: run.run_special_date_balance(run.catalog.normal_ids, "Normal", 'special_normal')
+
+# --- PHASE 6: SK Balancing ---
+def stage_sk(run):
+    run.metrics.begin('sk')
+    run.log("▶️ Φάση 6: Εξισορρόπηση Σαββατοκύριακων...", LOG_SUMMARY)
+    sk_swaps = 0
+    sk_win_start = to_day(sk_window_start(run.end_date))
+
+    sk_excluded = run.catalog.excluded_everywhere(run.catalog.normal_ids, run.emp_ids)
+
     sk_stagnation_count = 0 
     sk_stagnation_limit = 2
-    
+
+    # SK score: scoreable normal-duty days from sk_win_start on, kept live across swaps
+    def sk_weight(s, eid):
+        if s['day'] < sk_win_start or s['duty_id'] not in run.catalog.normal_ids: return 0
+        return 1 if run.scoreable(s['day']) else 0
+    sk_ledger = run.open_ledger([eid for eid in run.emp_ids if eid not in sk_excluded], sk_weight, run.history + run.schedule)
+    sk = sk_ledger.scores
+    run.dimension_ledgers['sk'] = sk_ledger
+    weekend_kinds = SwapIndex.kinds_where(weekend=True)
+    weekday_plain_kinds = SwapIndex.kinds_where(weekend=False, strict_special=False)
+
     for _ in range(200):
-        sk = {e['id']: 0 for e in employees if e['id'] not in sk_excluded}
-        for s in history+schedule:
-            if dt.strptime(s['date'],'%Y-%m-%d').date() < sk_win_start: continue
-            d_o = next((d for d in duties if d['id']==int(s['duty_id'])),None)
-            if not d_o or d_o.get('is_special') or d_o.get('is_off_balance'): continue
-            eid = int(s['employee_id'])
-            if eid in sk and is_scoreable_day(s['date'], special_dates_set): sk[eid] += 1
-        
-        s_sk = sorted(sk.items(), key=lambda x:x[1])
-        
+        if run.should_stop('sk'): break
+        run.metrics.count('iterations')
+        s_sk = sk_ledger.ranked_items()
+    
         if _ == 0:
-             log(f"   📊 [Initial SK Balance] Min: {s_sk[0][1]} | Max: {s_sk[-1][1]} | Range: {s_sk[-1][1] - s_sk[0][1]}")
-             log(f"   📊 [Initial SK Scores]: {[(emp_map.get(k, k), v) for k,v in s_sk]}")
-             
+             run.log(f"   📊 [Initial SK Balance] Min: {s_sk[0][1]} | Max: {s_sk[-1][1]} | Range: {s_sk[-1][1] - s_sk[0][1]}", LOG_SUMMARY)
+             run.log(lambda: f"   📊 [Initial SK Scores]: {[(run.emp_map.get(k, k), v) for k,v in s_sk]}", LOG_PHASE)
+         
         if s_sk[-1][1] - s_sk[0][1] <= 2: break
-        
+    
         swapped = False
         max_swaps_per_iter = 5
         iter_swaps = 0
         failure_log = [] # Track reasons for failures in this iteration
-        
-        
+    
+    
         true_max = s_sk[-1][1]
         for i in range(len(s_sk)-1, 0, -1):
+            if run.should_stop('sk'): break
             max_id = s_sk[i][0]
             if s_sk[i][1] < true_max - 1:
                  # User constraint: detailed balancing only for top tiers (Max and Max-1)
                  break
-                 
+             
             if iter_swaps >= max_swaps_per_iter: break
-            
-            for j in range(i):
+        
+            # Check diff. If stagnation_count > 0, we relax diff to > 1
+            required_diff = 2 if sk_stagnation_count == 0 else 1
+            # s_sk is ascending: the employees far enough below max_id are a prefix
+            for j in range(min(i, sk_ledger.count_below(sk[max_id] - required_diff))):
                 min_id = s_sk[j][0]
-                
-                # Check diff. If stagnation_count > 0, we relax diff to > 1
-                required_diff = 2 if sk_stagnation_count == 0 else 1
-                if sk[max_id] - sk[min_id] <= required_diff: continue
-                
-                max_we = [s for s in schedule if int(s['employee_id'])==max_id 
-                          and dt.strptime(s['date'], '%Y-%m-%d').date().weekday() in [5, 6] 
-                          and not s.get('manually_locked')]
-                max_we = [s for s in max_we if not any(d['id']==int(s['duty_id']) and (d.get('is_weekly') or d.get('is_special') or d.get('is_off_balance')) for d in duties)]
-                
+            
+                max_we = run.swap_index.rows(max_id, run.catalog.daily_normal_ids, weekend_kinds)
+            
                 if not max_we:
-                     failure_log.append(f"No swappable weekend shifts for {emp_map.get(max_id)}")
-                
+                     failure_log.append(f"No swappable weekend shifts for {run.emp_map.get(max_id)}")
+            
                 # Double Duty Debugging
-                if max_id in double_duty_prefs:
-                    log(f"   🔍 Check Double Duty for {emp_map.get(max_id)} in SK Balance...")
-
-                min_wd = [s for s in schedule if int(s['employee_id'])==min_id 
-                          and dt.strptime(s['date'], '%Y-%m-%d').date().weekday() not in [5, 6] 
-                          and not is_special_date_only(s['date'], special_dates_set)
-                          and not s.get('manually_locked')]
-                min_wd = [s for s in min_wd if not any(d['id']==int(s['duty_id']) and (d.get('is_weekly') or d.get('is_special') or d.get('is_off_balance')) for d in duties)]
+                if max_id in run.double_duty_prefs:
+                    run.log(lambda: f"   🔍 Check Double Duty for {run.emp_map.get(max_id)} in SK Balance...", LOG_TRACE)
+
+                min_wd = run.swap_index.rows(min_id, run.catalog.daily_normal_ids, weekday_plain_kinds)
                 if not min_wd:
-                     failure_log.append(f"No swappable weekday shifts for {emp_map.get(min_id)}")
-                
-                random.shuffle(max_we); random.shuffle(min_wd)
+                     failure_log.append(f"No swappable weekday shifts for {run.emp_map.get(min_id)}")
+            
+                run.rng.shuffle(max_we); run.rng.shuffle(min_wd)
                 for we in max_we:
-                    if int(we['employee_id']) != max_id: continue 
-                    
+                    if we['employee_id'] != max_id: continue 
+                
                     is_double_pair = False
                     partner = None
-                    if max_id in double_duty_prefs:
-                         we_date = dt.strptime(we['date'], '%Y-%m-%d').date()
-                         if we_date.weekday() == 5: 
-                             partner_date = we_date + timedelta(days=1)
-                             partner = next((s for s in schedule if s['date']==partner_date.strftime('%Y-%m-%d') and int(s['employee_id'])==max_id and int(s['duty_id'])==int(we['duty_id']) and s.get('shift_index')==we.get('shift_index') and not s.get('manually_locked')), None)
-                         elif we_date.weekday() == 6: 
-                             partner_date = we_date - timedelta(days=1)
-                             partner = next((s for s in schedule if s['date']==partner_date.strftime('%Y-%m-%d') and int(s['employee_id'])==max_id and int(s['duty_id'])==int(we['duty_id']) and s.get('shift_index')==we.get('shift_index') and not s.get('manually_locked')), None)
-                         
+                    if max_id in run.double_duty_prefs:
+                         we_date = we['day']
+                         if day_weekday(we_date) == 5: 
+                             partner_date = we_date + 1
+                             partner = next((s for s in run.slot_index.rows(partner_date, we['duty_id'], we['shift_index']) if s['employee_id']==max_id and not s.get('manually_locked')), None)
+                         elif day_weekday(we_date) == 6: 
+                             partner_date = we_date - 1
+                             partner = next((s for s in run.slot_index.rows(partner_date, we['duty_id'], we['shift_index']) if s['employee_id']==max_id and not s.get('manually_locked')), None)
+                     
                          if partner: 
                              is_double_pair = True
-                             log(f"     Found Double Pair for {emp_map.get(max_id)}: {we['date']} & {partner['date']}")
+                             run.log(lambda: f"     Found Double Pair for {run.emp_map.get(max_id)}: {day_str(we['day'])} & {day_str(partner['day'])}", LOG_TRACE)
                          else:
-                             log(f"     No Partner found for {emp_map.get(max_id)} on {we['date']}")
+                             run.log(lambda: f"     No Partner found for {run.emp_map.get(max_id)} on {day_str(we['day'])}", LOG_TRACE)
 
                     if is_double_pair and partner:
-                        log(f"      🔎 Attempting Atomic Swap for {emp_map.get(max_id)}: Sat {we['date']} + Sun {partner['date']}")
+                        run.log(lambda: f"      🔎 Attempting Atomic Swap for {run.emp_map.get(max_id)}: Sat {day_str(we['day'])} + Sun {day_str(partner['day'])}", LOG_TRACE)
                         if len(min_wd) < 2: 
-                             failure_log.append(f"Not enough weekday shifts for {emp_map.get(min_id)} to swap atomic pair")
+                             failure_log.append(f"Not enough weekday shifts for {run.emp_map.get(min_id)} to swap atomic pair")
                              continue 
-                        
-                        p_d = next((d for d in duties if d['id']==int(partner['duty_id'])), None)
-                        p_conf = p_d.get('shift_config', [{}])[int(partner.get('shift_index',0))] if p_d else {}
-                        
-                        we_d = next((d for d in duties if d['id']==int(we['duty_id'])), None)
-                        we_conf = we_d.get('shift_config', [{}])[int(we.get('shift_index',0))] if we_d else {}
-                        
-                        if min_id in [int(x) for x in p_conf.get('excluded_ids', [])]: 
-                            failure_log.append(f"{emp_map.get(min_id)} excluded from partner duty {partner['duty_id']}")
+                    
+                        p_excl = run.catalog.excluded_for(partner['duty_id'], partner.get('shift_index', 0))
+                    
+                        we_excl = run.catalog.excluded_for(we['duty_id'], we.get('shift_index', 0))
+                    
+                        if min_id in p_excl: 
+                            failure_log.append(f"{run.emp_map.get(min_id)} excluded from partner duty {partner['duty_id']}")
                             continue
-                        if min_id in [int(x) for x in we_conf.get('excluded_ids', [])]: 
-                            failure_log.append(f"{emp_map.get(min_id)} excluded from duty {we['duty_id']}")
+                        if min_id in we_excl: 
+                            failure_log.append(f"{run.emp_map.get(min_id)} excluded from duty {we['duty_id']}")
                             continue
 
-                        if (min_id, partner['date']) in unavail_map or is_user_busy(min_id, dt.strptime(partner['date'],'%Y-%m-%d').date(), schedule, False): 
-                             failure_log.append(f"{emp_map.get(min_id)} busy/unavail on {partner['date']}")
+                        if (min_id, partner['day']) in run.unavail_map or run.is_user_busy(min_id, partner['day'], False): 
+                             failure_log.append(f"{run.emp_map.get(min_id)} busy/unavail on {day_str(partner['day'])}")
                              continue
-                        if (min_id, we['date']) in unavail_map or is_user_busy(min_id, dt.strptime(we['date'],'%Y-%m-%d').date(), schedule, False): 
-                             failure_log.append(f"{emp_map.get(min_id)} busy/unavail on {we['date']}")
+                        if (min_id, we['day']) in run.unavail_map or run.is_user_busy(min_id, we['day'], False): 
+                             failure_log.append(f"{run.emp_map.get(min_id)} busy/unavail on {day_str(we['day'])}")
                              continue
 
+                        run.metrics.count('swaps_attempted')
                         found_wd_pair = []
                         for wd in min_wd:
-                            wd_d = next((d for d in duties if d['id']==int(wd['duty_id'])), None)
-                            wd_conf = wd_d.get('shift_config', [{}])[int(wd.get('shift_index',0))] if wd_d else {}
-                            if max_id in [int(x) for x in wd_conf.get('excluded_ids', [])]: continue
-                            if (max_id, wd['date']) in unavail_map or is_user_busy(max_id, dt.strptime(wd['date'],'%Y-%m-%d').date(), schedule, False): continue
+                            wd_excl = run.catalog.excluded_for(wd['duty_id'], wd.get('shift_index', 0))
+                            if max_id in wd_excl: continue
+                            if (max_id, wd['day']) in run.unavail_map or run.is_user_busy(max_id, wd['day'], False): continue
                             found_wd_pair.append(wd)
                             if len(found_wd_pair) == 2: break
-                        
+                    
                         if len(found_wd_pair) == 2:
-                            we['employee_id'] = min_id
-                            partner['employee_id'] = min_id
-                            found_wd_pair[0]['employee_id'] = max_id
-                            found_wd_pair[1]['employee_id'] = max_id
-                            
+                            run.reassign(we, min_id)
+                            run.reassign(partner, min_id)
+                            run.reassign(found_wd_pair[0], max_id)
+                            run.reassign(found_wd_pair[1], max_id)
+                            run.metrics.count('swaps_performed')
+                        
                             swapped = True; sk_swaps += 2; iter_swaps += 1
-                            sk[max_id] -= 2; sk[min_id] += 2
-                            log(f"   🔄 Atomic Double Swap: {emp_map.get(max_id)} (Sat {we['date']} + Sun {partner['date']}) -> {emp_map.get(min_id)}")
+                            run.log(lambda: f"   🔄 Atomic Double Swap: {run.emp_map.get(max_id)} (Sat {day_str(we['day'])} + Sun {day_str(partner['day'])}) -> {run.emp_map.get(min_id)}", LOG_PHASE)
                             sk_stagnation_count = 0
                             break
                         else:
                             continue 
-                    
+                
                     else:
-                        we_d = next((d for d in duties if d['id']==int(we['duty_id'])), None)
-                        we_conf = we_d.get('shift_config', [{}])[int(we.get('shift_index',0))] if we_d else {}
-                        if min_id in [int(x) for x in we_conf.get('excluded_ids', [])]: 
-                            failure_log.append(f"{emp_map.get(min_id)} excluded from {we['duty_id']}")
+                        we_excl = run.catalog.excluded_for(we['duty_id'], we.get('shift_index', 0))
+                        if min_id in we_excl: 
+                            failure_log.append(f"{run.emp_map.get(min_id)} excluded from {we['duty_id']}")
                             continue
-                        if (min_id, we['date']) in unavail_map or is_user_busy(min_id, dt.strptime(we['date'],'%Y-%m-%d').date(), schedule, False): 
-                            failure_log.append(f"{emp_map.get(min_id)} busy on {we['date']}")
+                        if (min_id, we['day']) in run.unavail_map or run.is_user_busy(min_id, we['day'], False): 
+                            failure_log.append(f"{run.emp_map.get(min_id)} busy on {day_str(we['day'])}")
                             continue
-                        
+                    
                         for wd in min_wd:
-                            wd_d = next((d for d in duties if d['id']==int(wd['duty_id'])), None)
-                            wd_conf = wd_d.get('shift_config', [{}])[int(wd.get('shift_index',0))] if wd_d else {}
-                            if max_id in [int(x) for x in wd_conf.get('excluded_ids', [])]: continue
-                            if (max_id, wd['date']) in unavail_map or is_user_busy(max_id, dt.strptime(wd['date'],'%Y-%m-%d').date(), schedule, False): continue
-                            
-                            we['employee_id'] = min_id; wd['employee_id'] = max_id
+                            run.metrics.count('swaps_attempted')
+                            wd_excl = run.catalog.excluded_for(wd['duty_id'], wd.get('shift_index', 0))
+                            if max_id in wd_excl: continue
+                            if (max_id, wd['day']) in run.unavail_map or run.is_user_busy(max_id, wd['day'], False): continue
+                        
+                            run.reassign(we, min_id); run.reassign(wd, max_id)
+                            run.metrics.count('swaps_performed')
                             swapped = True; sk_swaps += 1; iter_swaps += 1
-                            sk[max_id] -= 1; sk[min_id] += 1
-                            log(f"   🔄 Single Swap: {emp_map.get(max_id)} ({we['date']}) -> {emp_map.get(min_id)}")
+                            run.log(lambda: f"   🔄 Single Swap: {run.emp_map.get(max_id)} ({day_str(we['day'])}) -> {run.emp_map.get(min_id)}", LOG_PHASE)
                             sk_stagnation_count = 0
                             break
                         if swapped: break 
                 if swapped: break 
             if swapped: break 
-            
+        
         if not swapped:
             # --- Last Resort: Weekly Duty Swap ---
             # If granular swaps failed, try to offload an ENTIRE week of a Weekly Duty from Max to Min.
-            log(f"      ⚠️ Granular swaps failed via {emp_map.get(max_id)}. Attempting Weekly Duty Swap...")
-            
+            run.log(lambda: f"      ⚠️ Granular swaps failed via {run.emp_map.get(max_id)}. Attempting Weekly Duty Swap...", LOG_TRACE)
+        
             # 1. Find all Weekly Duty assignments for max_id
-            max_weekly_shifts = [s for s in schedule if int(s['employee_id'])==max_id 
-                                 and any(d['id']==int(s['duty_id']) and d.get('is_weekly') for d in duties)
-                                 and not s.get('manually_locked')]
-            
+            max_weekly_shifts = run.swap_index.rows(max_id, run.catalog.weekly_ids)
+        
             # Group by (DutyID, WeekStart)
             weekly_groups = {}
             for s in max_weekly_shifts:
-                s_date = dt.strptime(s['date'], '%Y-%m-%d').date()
+                s_date = s['day']
                 # Find start of week (Monday)
-                week_start = s_date - timedelta(days=s_date.weekday())
-                key = (int(s['duty_id']), week_start)
+                week_start = s_date - day_weekday(s_date)
+                key = (s['duty_id'], week_start)
                 if key not in weekly_groups: weekly_groups[key] = []
                 weekly_groups[key].append(s)
 
             # 2. Try to swap a whole group to a Min ID
             for (did_id, w_start), shifts in weekly_groups.items():
                 if swapped: break
-                
-                duty_obj = next((d for d in duties if d['id']==did_id), None)
+            
+                duty_obj = run.catalog.get(did_id)
                 if not duty_obj: continue
                 # We assume all shifts in a weekly duty have same config/exclusions for simplicity, 
                 # or we check the specific shift index of the first shift.
                 # Weekly duties usually use shift_index 0 or consistent configs.
-                
+            
                 # Check Min Candidates
                 # We iterate standard min_ids from the SK list
                 for j in range(i): 
                     min_candidate = s_sk[j][0]
-                    
+                    run.metrics.count('swaps_attempted')
+                
                     # Check Exclusions
                     # Check exclusion for *every* shift in the group (strict)
                     is_excluded = False
                     for s in shifts:
-                         conf = duty_obj.get('shift_config', [{}])[int(s.get('shift_index',0))]
-                         if min_candidate in [int(x) for x in conf.get('excluded_ids', [])]:
+                         if min_candidate in run.catalog.excluded_for(did_id, s.get('shift_index',0)):
                              is_excluded = True; break
                     if is_excluded: continue
 
                     # Check Availability / Busy for ALL dates in the group
                     is_busy_any = False
                     for s in shifts:
-                        s_date = dt.strptime(s['date'], '%Y-%m-%d').date()
-                        if (min_candidate, s['date']) in unavail_map: 
+                        s_date = s['day']
+                        if (min_candidate, s['day']) in run.unavail_map: 
                             is_busy_any = True; break
-                        if is_user_busy(min_candidate, s_date, schedule, False):
+                        if run.is_user_busy(min_candidate, s_date, False):
                             is_busy_any = True; break
-                    
+                
                     if is_busy_any: continue
 
                     # PERFORM SWAP
                     score_change = 0
                     for s in shifts:
-                        s['employee_id'] = min_candidate
-                        if is_scoreable_day(s['date'], special_dates_set):
+                        run.reassign(s, min_candidate)
+                        if run.scoreable(s['day']):
                             score_change += 1
-                    
+                
                     swapped = True
-                    sk[max_id] -= score_change
-                    sk[min_candidate] += score_change
                     sk_swaps += score_change # Approximate swap count
+                    run.metrics.count('swaps_performed')
                     sk_stagnation_count = 0
-                    
-                    log(f"      🔄 WEEKLY SWAP: {emp_map.get(max_id)} -> {emp_map.get(min_candidate)} | Duty {duty_obj['name']} | Week of {w_start}")
+                
+                    run.log(lambda: f"      🔄 WEEKLY SWAP: {run.emp_map.get(max_id)} -> {run.emp_map.get(min_candidate)} | Duty {duty_obj['name']} | Week of {day_str(w_start)}", LOG_PHASE)
                     break # Found a min candidate
-            
+        
             if not swapped:
                 sk_stagnation_count += 1
                 if sk_stagnation_count >= sk_stagnation_limit:
-                    log(f"⚠️ SK: Η Εξισορρόπηση σταμάτησε (Stagnation). Reasons:")
+                    run.log("⚠️ SK: Η Εξισορρόπηση σταμάτησε (Stagnation). Reasons:", LOG_SUMMARY)
                     for fai in failure_log[:10]: # Show top 10 reasons
-                        log(f"   - {fai}")
+                        run.log(lambda: f"   - {fai}", LOG_PHASE)
                     break
-            
+        
     # Final SK Score Log
-    sk_fin = {e['id']: 0 for e in employees if e['id'] not in sk_excluded}
-    for s in history+schedule:
-        if dt.strptime(s['date'],'%Y-%m-%d').date() < sk_win_start: continue
-        d_o = next((d for d in duties if d['id']==int(s['duty_id'])),None)
-        if not d_o or d_o.get('is_special') or d_o.get('is_off_balance'): continue
-        eid = int(s['employee_id'])
-        if eid in sk_fin and is_scoreable_day(s['date'], special_dates_set): sk_fin[eid] += 1
-    
-    s_sk_fin = sorted(sk_fin.items(), key=lambda x:x[1])
+    s_sk_fin = sk_ledger.ranked_items()
     if s_sk_fin:
-         log(f"   🏁 [Final SK Balance] Min: {s_sk_fin[0][1]} | Max: {s_sk_fin[-1][1]} | Range: {s_sk_fin[-1][1] - s_sk_fin[0][1]}")
-         log(f"   🏁 [Final SK Scores]: {[(emp_map.get(k, k), v) for k,v in s_sk_fin]}")
+         run.log(f"   🏁 [Final SK Balance] Min: {s_sk_fin[0][1]} | Max: {s_sk_fin[-1][1]} | Range: {s_sk_fin[-1][1] - s_sk_fin[0][1]}", LOG_SUMMARY)
+         run.log(lambda: f"   🏁 [Final SK Scores]: {[(run.emp_map.get(k, k), v) for k,v in s_sk_fin]}", LOG_PHASE)
 
-    log(f"✅ Ολοκληρώθηκε (Έγιναν {sk_swaps} αλλαγές).")
+    run.log(f"✅ Ολοκληρώθηκε (Έγιναν {sk_swaps} αλλαγές).", LOG_SUMMARY)
+    run.metrics.end(s_sk_fin[-1][1] - s_sk_fin[0][1] if s_sk_fin else None)
 
-    # --- PHASE 7: Off-Balance Duties (Assignments & Balancing) ---
-    log("▶️ Φάση 7: Ανάθεση & Εξισορρόπηση Υπηρεσιών Εκτός Ισοζυγίου...")
-    
-    off_weekly = [d for d in duties if d.get('is_weekly') and d.get('is_off_balance') and not d.get('is_special')]
+# --- PHASE 8: Final Weekday Balancing (normal group) ---
+def stage_weekday(run):
+    run.log("▶️ Φάση 8: Τελική Εξισορρόπηση (Μόνο Καθημερινές)...", LOG_SUMMARY)
+    if run.catalog.normal_ids: 
+        run.run_balance(run.catalog.normal_ids, "Κανονικών Υπηρεσιών (Weekday Only)", 'balance_normal_weekday')
+
+# --- PHASE 7: Off-Balance Duties (Assignments & Balancing) ---
+def stage_off_balance(run):
+    run.metrics.begin('off_balance_assign')
+    run.log("▶️ Φάση 7: Ανάθεση & Εξισορρόπηση Υπηρεσιών Εκτός Ισοζυγίου...", LOG_SUMMARY)
+
+    off_weekly = run.catalog.ids_where(weekly=True, special=False, off_balance=True)
     for duty in off_weekly:
         for sh_idx in range(duty['shifts_per_day']):
-            curr = start_date
-            while curr <= end_date:
-                if curr.weekday() == duty['shift_config'][sh_idx]['day_index']:
-                    d_str = curr.strftime('%Y-%m-%d')
-                    if not any(s['date'] == d_str and int(s['duty_id']) == duty['id'] for s in schedule):
-                        def_emp = duty['shift_config'][sh_idx].get('default_employee_id')
-                        chosen = def_emp if def_emp and (def_emp,d_str) not in unavail_map and not is_user_busy(def_emp, curr, schedule, False) else None
+            curr = run.start_day
+            while curr <= run.end_day:
+                if run.should_stop('off_balance_assign'): break
+                if day_weekday(curr) == duty['shift_config'][sh_idx]['day_index']:
+                    if not run.slot_index.filled(curr, duty['id']):
+                        def_emp = run.catalog.default_employee[(duty['id'], sh_idx)]
+                        chosen = def_emp if def_emp and (def_emp,curr) not in run.unavail_map and not run.is_user_busy(def_emp, curr, False) else None
                         if not chosen:
-                             excl = [int(x) for x in duty['shift_config'][sh_idx].get('excluded_ids', [])]
-                             cq, nq = get_q(f"weekly_off_{duty['id']}_{sh_idx}", excl)
-                             for c in cq+nq:
-                                 if (c,d_str) not in unavail_map and not is_user_busy(c, curr, schedule, False): chosen=c; break
-                        if chosen: schedule.append({"date": d_str, "duty_id": duty['id'], "shift_index": 0, "employee_id": chosen, "manually_locked": False})
-                curr += timedelta(days=1)
-
-    off_daily = [d for d in duties if not d.get('is_weekly') and d.get('is_off_balance') and not d.get('is_special')]
-    curr = start_date
-    while curr <= end_date:
-         d_str = curr.strftime('%Y-%m-%d')
+                             excl = run.catalog.excluded_for(duty['id'], sh_idx)
+                             for c in run.get_q(f"weekly_off_{duty['id']}_{sh_idx}", excl).candidates():
+                                 if (c,curr) not in run.unavail_map and not run.is_user_busy(c, curr, False): chosen=c; break
+                        if chosen: run.place({"day": curr, "duty_id": duty['id'], "shift_index": 0, "employee_id": chosen, "manually_locked": False})
+                        else: run.metrics.count('unfilled')
+                curr += 1
+
+    off_daily = run.catalog.ids_where(weekly=False, special=False, off_balance=True)
+    curr = run.start_day
+    while curr <= run.end_day:
+         if run.should_stop('off_balance_assign'): break
          for duty in off_daily:
-             if is_in_period(curr, duty.get('active_range')):
+             if run.catalog.active[duty['id']].contains(curr):
                   for i in range(duty['shifts_per_day']):
-                      if not duty['shift_config'][i].get('is_within_hours') and is_in_period(curr, duty['shift_config'][i].get('active_range')):
-                          if not any(s['date']==d_str and int(s['duty_id'])==int(duty['id']) and int(s['shift_index'])==i for s in schedule):
-                                log(f"      [Phase 7] Checking {d_str} for {duty['name']}...")
+                      if not duty['shift_config'][i].get('is_within_hours') and run.catalog.shift_active[(duty['id'], i)].contains(curr):
+                          if not run.slot_index.filled(curr, duty['id'], i):
+                                run.log(lambda: f"      [Phase 7] Checking {day_str(curr)} for {duty['name']}...", LOG_TRACE)
                                 chosen = None
-                                
-                                excl = [int(x) for x in duty['shift_config'][i].get('excluded_ids', [])]
-                                cq, nq = get_q(f"off_{duty['id']}_{i}", excl)
-                                for c in cq+nq:
-                                    if (c,d_str) not in unavail_map and not is_user_busy(c, curr, schedule, False): chosen=c; break
-                                
+                            
+                                excl = run.catalog.excluded_for(duty['id'], i)
+                                for c in run.get_q(f"off_{duty['id']}_{i}", excl).candidates():
+                                    if (c,curr) not in run.unavail_map and not run.is_user_busy(c, curr, False): chosen=c; break
+                            
                                 if chosen:
-                                    schedule.append({"date": d_str, "duty_id": duty['id'], "shift_index": i, "employee_id": chosen, "manually_locked": False})
-                                    rotate_assigned_user(f"off_{duty['id']}_{i}", chosen)
-         curr += timedelta(days=1)
-
-    off_ids = [d['id'] for d in duties if d.get('is_off_balance') and not d.get('is_special')]
-    if off_ids:
-        run_balance(off_ids, "Υπηρεσιών Εκτός Ισοζυγίου (Final)")
-
-    # --- PHASE 8: Final Weekday Balancing ---
-    log("▶️ Φάση 8: Τελική Εξισορρόπηση (Μόνο Καθημερινές)...")
-    if normal_duty_ids: 
-        run_balance(normal_duty_ids, "Κανονικών Υπηρεσιών (Weekday Only)")
+                                    run.place({"day": curr, "duty_id": duty['id'], "shift_index": i, "employee_id": chosen, "manually_locked": False})
+                                    run.rotate_assigned_user(f"off_{duty['id']}_{i}", chosen)
+                                else: run.metrics.count('unfilled')
+         curr += 1
+
+    off_balance_duty_ids = run.catalog.off_balance_scored_ids
     if off_balance_duty_ids:
-        run_balance(off_balance_duty_ids, "Υπηρεσιών Εκτός Ισοζυγίου (Weekday Only)")
+        run.run_balance(off_balance_duty_ids, "Υπηρεσιών Εκτός Ισοζυγίου (Final)", 'balance_off_balance_final')
+        run.run_special_date_balance(off_balance_duty_ids, "Off-Balance", 'special_off_balance')
+        run.log("▶️ Φάση 8: Τελική Εξισορρόπηση Εκτός Ισοζυγίου (Μόνο Καθημερινές)...", LOG_SUMMARY)
+        run.run_balance(off_balance_duty_ids, "Υπηρεσιών Εκτός Ισοζυγίου (Weekday Only)", 'balance_off_balance_weekday')
+
+# --- PHASE 9: Local Search (optional) ---
+def stage_local_search(run):
+    if run.optimize_budget or run.optimize_max_moves:
+        run.run_local_search()
+
+# --- PIPELINE ---
+# Engine stages in run order; `phases` runs a subset of them on the stored schedule.
+# Duty groups run in dependency order: normal/weekly rows decide who is busy (OccupancyIndex),
+# off-balance rows only read that, so the off-balance group (Phase 7 onwards) is assigned and
+# balanced once the normal group (Phases 3, 5, 6 and 8) is final.
+SCHEDULER_STAGES = {'workhours': stage_workhours, 'weekly': stage_weekly, 'daily': stage_daily, 'balance': stage_balance,
+                    'special': stage_special, 'sk': stage_sk, 'weekday': stage_weekday, 'off_balance': stage_off_balance,
+                    'local_search': stage_local_search}
+# Named subsets for touch-up runs
+STAGE_PRESETS = {'balance': ('balance', 'special', 'sk', 'weekday', 'off_balance'), 'sk': ('sk',)}
+
+def resolve_stages(phases):
+    """Stage names to run, in SCHEDULER_STAGES order: None = all, a STAGE_PRESETS name, or stage names."""
+    if phases is None: return tuple(SCHEDULER_STAGES)
+    if isinstance(phases, str):
+        if phases not in STAGE_PRESETS: raise ValueError(f"Unknown phases preset: {phases}")
+        return STAGE_PRESETS[phases]
+    unknown = [p for p in phases if p not in SCHEDULER_STAGES]
+    if unknown: raise ValueError(f"Unknown phases: {unknown}")
+    return tuple(p for p in SCHEDULER_STAGES if p in phases)
+
+def run_auto_scheduler_logic(db, start_date, end_date, log_level='trace', log_flush=True, seed=None, balancer='swap',
+                             optimize_budget=0, optimize_max_moves=None, deadline=None, cancel_token=None,
+                             daily_assign='greedy', phases=None):
+    # Setup builds the run context; every selected stage then works on it in pipeline order
+    run = SchedulerRun(db, start_date, end_date, log_level, log_flush, seed, balancer, optimize_budget, optimize_max_moves,
+                       deadline, cancel_token, daily_assign, phases)
+    if not run.employees:
+        return [], {"rotation_queues": {}, "next_round_queues": {}, "logs": run.logs, "metrics": run.metrics.to_json(), "seed": run.seed,
+                    "stopped": None, "cut_short": []}
+
+    for name in run.selected_stages:
+        SCHEDULER_STAGES[name](run)
+
+    run.log("✅ Ο Χρονοπρογραμματισμός ολοκληρώθηκε επιτυχώς.", LOG_SUMMARY)
+    run.save_queues()
+    return serialize_rows(run.schedule), {"rotation_queues": run.rot_q, "next_round_queues": run.nxt_q, "logs": run.logs,
+                                          "metrics": run.metrics.to_json(), "seed": run.seed,
+                                          "stopped": run.stop['reason'], "cut_short": run.stop['cut_short']}
 
-    log("✅ Ο Χρονοπρογραμματισμός ολοκληρώθηκε επιτυχώς.")
-    return schedule, {"rotation_queues": rot_q, "next_round_queues": nxt_q, "logs": logs}
+# ==========================================
+# 7. PORTFOLIO (MULTI-SEED RUNS)
+# ==========================================
+# Score dimension -> metrics phases; the last phase that ran for the dimension gives its final spread
+SCORE_DIMENSIONS = {
+    'normal': ('local_search.normal', 'balance_normal_weekday', 'balance_normal'),
+    'off_balance': ('local_search.off_balance', 'balance_off_balance_weekday', 'balance_off_balance_final'),
+    'special_normal': ('local_search.special_normal', 'special_normal'),
+    'special_off_balance': ('local_search.special_off_balance', 'special_off_balance'),
+    'sk': ('local_search.sk', 'sk'),
+}
+
+def portfolio_score(meta):
+    """(unfilled slots, worst spread, sum of spreads, swaps performed) for one run; lower is better."""
+    m = meta['metrics']
+    spreads = {}
+    for dim, phases in SCORE_DIMENSIONS.items():
+        spreads[dim] = next((m['final_spreads'][p] for p in phases if p in m['final_spreads']), 0)
+    return (m['unfilled_slots'], max(spreads.values()), sum(spreads.values()), m['swaps_performed']), spreads
+
+def _portfolio_worker(args):
+    db, start_date, end_date, seed, run_kwargs = args
+    # Workers keep their logs in res_meta only; the chosen run's logs go back to the caller
+    with contextlib.redirect_stdout(io.StringIO()):
+        schedule, meta = run_auto_scheduler_logic(db, start_date, end_date, log_flush=False, seed=seed, **run_kwargs)
+    return schedule, meta
+
+def run_scheduler_portfolio(db, start_date, end_date, seeds, workers=None, time_budget=None, cancel_token=None, **run_kwargs):
+    """
+    Runs run_auto_scheduler_logic (with run_kwargs, e.g. log_level/balancer/deadline)
+    once per seed in worker processes and returns
+    the best (schedule, res_meta) by portfolio_score(). Runs still going when
+    time_budget (seconds) runs out are dropped; if none has finished by then the
+    first one to finish is used (workers stop by themselves at a run_kwargs
+    deadline: time.monotonic() is system-wide). cancel_token (a threading token
+    cannot reach the workers) keeps the best run finished so far, or, if none
+    has finished, terminates the pool and returns no rows with
+    res_meta['stopped'] = 'cancelled'. A seed whose run raises is recorded as
+    'failed' and the best is chosen among the rest. res_meta['portfolio'] lists
+    every seed's outcome.
+    """
+    seeds = list(seeds)
+    if not seeds: raise ValueError("run_scheduler_portfolio needs at least one seed")
+    workers = max(1, min(workers or os.cpu_count() or 1, len(seeds)))
+    deadline = time.monotonic() + time_budget if time_budget else None
+    results = {}
+    failures = {}
+
+    # spawn: workers never inherit the caller's DB connections or threads
+    pool = multiprocessing.get_context('spawn').Pool(workers)
+    try:
+        pending = {seed: pool.apply_async(_portfolio_worker, ((db, start_date, end_date, seed, run_kwargs),)) for seed in seeds}
+        while pending:
+            if cancel_token is not None and cancel_token.cancelled: break
+            if results and deadline is not None and time.monotonic() >= deadline: break
+            for seed, job in list(pending.items()):
+                if job.ready():
+                    try: results[seed] = job.get()
+                    except Exception as e: failures[seed] = e
+                    del pending[seed]
+            if pending: time.sleep(0.05)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    summary = []
+    best = None
+    for idx, seed in enumerate(seeds):
+        if seed in failures:
+            summary.append({'seed': seed, 'status': 'failed', 'error': repr(failures[seed])})
+            continue
+        if seed not in results:
+            summary.append({'seed': seed, 'status': 'cancelled' if cancel_token is not None and cancel_token.cancelled else 'timeout'})
+            continue
+        score, spreads = portfolio_score(results[seed][1])
+        summary.append({'seed': seed, 'status': 'done', 'score': list(score), 'spreads': spreads,
+                        'total_ms': results[seed][1]['metrics']['total_ms']})
+        if best is None or (score, idx) < best[0]: best = ((score, idx), seed)
+
+    if best is None and not failures:
+        # Cancelled before any seed finished: nothing to choose from, the stored state stays as it is
+        metrics = RunMetrics()
+        return [], {"rotation_queues": db['service_config']['rotation_queues'], "next_round_queues": db['service_config']['next_round_queues'],
+                    "logs": [], "metrics": metrics.to_json(), "seed": None, "stopped": 'cancelled', "cut_short": list(resolve_stages(run_kwargs.get('phases'))),
+                    "portfolio": summary}
+    if best is None:
+        first = next(failures[seed] for seed in seeds if seed in failures)
+        raise RuntimeError(f"every portfolio seed failed ({len(failures)}): {first!r}") from first
+    schedule, meta = results[best[1]]
+    meta['portfolio'] = summary
+    return schedule, meta
+
+# ==========================================
+# 8. INCREMENTAL REPAIR (UNAVAILABILITY CHANGES)
+# ==========================================
+# Leading feasible queue candidates repair_schedule considers for a released slot
+REPAIR_CANDIDATES = 5
+
+def repair_queue_key(catalog, calendar, row):
+    """Rotation queue the engine fills this row's slot from (None: special duties have no queue)."""
+    duty_id = row['duty_id']; sh_idx = row['shift_index']; day = row['day']
+    if duty_id in catalog.special_ids: return None
+    if duty_id in catalog.weekly_ids:
+        return f"weekly_off_{duty_id}_{sh_idx}" if duty_id in catalog.off_balance_ids else f"weekly_{duty_id}_{sh_idx}"
+    if duty_id in catalog.off_balance_ids: return f"off_{duty_id}_{sh_idx}"
+    if catalog.conf(duty_id, sh_idx).get('is_within_hours'):
+        return "sk_all" if calendar.is_scoreable(day) else f"cover_{duty_id}_{sh_idx}"
+    return "sk_all" if day_weekday(day) in (5, 6) else f"normal_{duty_id}_sh_{sh_idx}"
+
+def repair_schedule(db, start_date, end_date, changes, radius=7, log_level='phase', log_flush=True):
+    """
+    Repairs a published schedule after new unavailability instead of re-running
+    the period. `changes` are (employee_id, date) pairs; every unlocked row of
+    [start_date, end_date] they hit is released and refilled from its rotation
+    queue (same keys as the engine; weekly rows are covered for the day without
+    using up a weekly turn). Of the first REPAIR_CANDIDATES free candidates, the
+    first that can hand the released employee one of their own shifts of the
+    same duty group and day kind within `radius` days takes the slot and makes
+    that move, so neither score changes; otherwise the first candidate does.
+
+    Returns (diff, res_meta): diff lists only the rows whose employee changed,
+    as {'date', 'duty_id', 'shift_index', 'employee_id', 'previous_employee_id'}
+    (employee_id None = left unfilled). res_meta has the updated queues, logs,
+    metrics and the manually locked rows that clash with the changes.
+    """
+    logs = []
+    metrics = RunMetrics()
+    verbosity = LOG_LEVELS[log_level]
+
+    def log(msg, level=LOG_PHASE):
+        if level > verbosity: return
+        if callable(msg): msg = msg()
+        log_entry = f"[{dt.now().strftime('%H:%M:%S.%f')[:-3]}] {msg}"
+        logs.append(log_entry)
+        print(f"[REPAIR] {log_entry}", flush=log_flush)
+
+    metrics.begin('setup')
+    employees = [{'id': int(e['id']), 'name': e['name']} for e in db['employees']]
+    emp_map = {e['id']: e['name'] for e in employees}
+    valid_ids = [e['id'] for e in employees]
+    catalog = DutyCatalog(db['service_config']['duties'])
+    start_day = start_date.toordinal(); end_day = end_date.toordinal()
+    rows = compile_rows(db['schedule'])
+    calendar = HorizonCalendar(set(db['service_config'].get('special_dates', [])),
+                               min([s['day'] for s in rows] + [start_day]), max([s['day'] for s in rows] + [end_day]))
+    changed = {(int(eid), to_day(d)) for eid, d in changes}
+    unavail_map = {(int(u['employee_id']), to_day(u['date'])) for u in db['unavailability']} | changed
+    rot_q = db['service_config']['rotation_queues']
+    nxt_q = db['service_config']['next_round_queues']
+
+    schedule = sorted((s for s in rows if start_day <= s['day'] <= end_day),
+                      key=lambda s: (s['day'], s['duty_id'], s['shift_index']))
+    occupancy = OccupancyIndex(catalog)
+    for s in rows: occupancy.add(s)
+    swap_index = SwapIndex(calendar, schedule)
+
+    def is_user_busy(eid, day):
+        metrics.busy_calls += 1
+        return occupancy.busy_reason(eid, day)
+
+    # Off-balance rows are not in the occupancy index; a normal row handed to someone must keep
+    # clear of their daily off-balance rows the way Phase 7 placed them (as in Phase 9)
+    off_daily_rows = {}
+    for s in rows:
+        if s['duty_id'] in catalog.off_balance_ids and s['duty_id'] not in catalog.weekly_ids and \
+                not catalog.conf(s['duty_id'], s['shift_index']).get('is_within_hours'):
+            off_daily_rows.setdefault(s['day'], []).append(s)
+
+    def off_balance_clash(eid, row, day):
+        return occupancy.counts(row) and any(s['employee_id'] == eid for k in (-1, 0, 1) for s in off_daily_rows.get(day + k, ()))
+
+    def reassign(row, eid):
+        old_eid = row['employee_id']
+        occupancy.remove(row)
+        row['employee_id'] = eid
+        occupancy.add(row)
+        swap_index.move(row, old_eid, eid)
+
+    released = [s for s in schedule if (s.get('employee_id'), s['day']) in changed and not s.get('manually_locked')]
+    conflicts = [s for s in schedule if (s.get('employee_id'), s['day']) in changed and s.get('manually_locked')]
+    log(f"🛠️ ΕΠΙΔΙΟΡΘΩΣΗ: {len(changed)} αλλαγές διαθεσιμότητας, {len(released)} βάρδιες προς αντικατάσταση.", LOG_SUMMARY)
+    for s in conflicts:
+        log(f"   🔒 {day_str(s['day'])}: {emp_map.get(s['employee_id'])} έχει κλειδωμένη βάρδια. Δεν αλλάζει.", LOG_SUMMARY)
+
+    previous = {}  # id(row) -> (row, employee before the repair)
+    def track(row):
+        previous.setdefault(id(row), (row, row.get('employee_id')))
+
+    def compensation(row, chosen, freed):
+        # One of chosen's shifts within radius days that freed can take back: same duty group and
+        # day kind as the released row, so both keep their scores. None if there is no such shift.
+        day = row['day']; duty_id = row['duty_id']
+        group = catalog.special_ids if duty_id in catalog.special_ids else \
+            catalog.off_balance_scored_ids if duty_id in catalog.off_balance_ids else catalog.normal_ids
+        for shift in swap_index.rows(chosen, group, {swap_index.kind(day)}):
+            s_day = shift['day']
+            if shift is row or abs(s_day - day) > radius or shift['duty_id'] in catalog.weekly_ids: continue
+            conf = catalog.conf(shift['duty_id'], shift['shift_index'])
+            if conf.get('is_within_hours') and conf.get('default_employee_id') in (chosen, freed) and not calendar.is_scoreable(s_day): continue
+            if freed in catalog.excluded_for(shift['duty_id'], shift['shift_index']) or (freed, s_day) in unavail_map: continue
+            metrics.count('swaps_attempted')
+            if not is_user_busy(freed, s_day) and not off_balance_clash(freed, shift, s_day): return shift
+        return None
+
+    metrics.begin('repair')
+    for row in released:
+        day = row['day']; duty_id = row['duty_id']; sh_idx = row['shift_index']
+        freed = row['employee_id']
+        duty = catalog.get(duty_id) or {}
+        excl = catalog.excluded_for(duty_id, sh_idx)
+        track(row)
+        occupancy.remove(row); row['employee_id'] = None
+        swap_index.move(row, freed, None)
+
+        q_key = repair_queue_key(catalog, calendar, row)
+        q = RotationQueue.from_json((rot_q, nxt_q), q_key) if q_key else RotationQueue()
+        # Queue order first, then anyone else eligible (a stale queue must not leave the slot empty)
+        candidates = list(dict.fromkeys([eid for eid in q.candidates() if eid in emp_map] + valid_ids))
+        feasible = []
+        for cand in candidates:
+            if cand == freed or cand in excl or (cand, day) in unavail_map: continue
+            if not is_user_busy(cand, day) and not off_balance_clash(cand, row, day):
+                feasible.append(cand)
+                if len(feasible) == REPAIR_CANDIDATES: break
+        if not feasible:
+            metrics.count('unfilled')
+            log(f"   ❌ {day_str(day)} {duty.get('name')}: Δεν βρέθηκε αντικαταστάτης για {emp_map.get(freed)}.", LOG_SUMMARY)
+            continue
+
+        # The first of the leading queue candidates that can also hand a shift back to freed
+        chosen, back = feasible[0], None
+        for cand in feasible:
+            back = compensation(row, cand, freed)
+            if back:
+                chosen = cand; break
+
+        row['employee_id'] = chosen
+        occupancy.add(row)
+        swap_index.move(row, None, chosen)
+        metrics.count('placed')
+        if q_key and duty_id not in catalog.weekly_ids:
+            q.served(chosen)
+            rot_q[q_key], nxt_q[q_key] = q.to_json()
+        log(f"   ✅ {day_str(day)} {duty.get('name')}: {emp_map.get(freed)} -> {emp_map.get(chosen)}", LOG_PHASE)
+
+        if back:
+            track(back)
+            reassign(back, freed)
+            metrics.count('swaps_performed')
+            log(f"   🔄 {day_str(back['day'])}: {emp_map.get(chosen)} -> {emp_map.get(freed)} (Αντιστάθμιση)", LOG_PHASE)
+    metrics.end()
+
+    diff = [{'date': day_str(row['day']), 'duty_id': row['duty_id'], 'shift_index': row['shift_index'],
+             'employee_id': row['employee_id'], 'previous_employee_id': before}
+            for row, before in previous.values() if row['employee_id'] != before]
+    res = metrics.to_json()
+    log(f"🏁 Επιδιόρθωση: {len(diff)} αλλαγές σε {res['total_ms']:.1f}ms.", LOG_SUMMARY)
+    return diff, {"rotation_queues": rot_q, "next_round_queues": nxt_q, "logs": logs, "metrics": res,
+                  "conflicts": serialize_rows(conflicts)}
+
+# ==========================================
+# 9. MULTI-MONTH RUNS (PER-MONTH CHECKPOINTS)
+# ==========================================
+def month_spans(start_date, end_date):
+    """[(first_day, last_day)] of every calendar month in [start_date, end_date]."""
+    spans = []
+    first = start_date
+    while first <= end_date:
+        last = min(first.replace(day=1) + relativedelta(months=1) - timedelta(days=1), end_date)
+        spans.append((first, last))
+        first = last + timedelta(days=1)
+    return spans
+
+def run_scheduler_months(db, start_date, end_date, checkpoint=None, runner=None, **run_kwargs):
+    """
+    Runs [start_date, end_date] one calendar month at a time with
+    runner(db, first, last, **run_kwargs) (default run_auto_scheduler_logic;
+    the route passes the portfolio). Each month starts from the queues the
+    previous one left and sees its rows as history, the way the next request
+    would see them once stored (a `phases` touch-up keeps the stored rows
+    instead). checkpoint(first, last, rows, res_meta) is called
+    after every month with that month's rows, so the caller can persist it; a
+    month with res_meta['stopped'] set (deadline/cancel) was cut short and is
+    the last one run.
+
+    Returns (rows of every month run, res_meta): res_meta is the last month's,
+    with the logs of all months and 'months' summarising each one.
+    """
+    runner = runner or run_auto_scheduler_logic
+    start_str, end_str = start_date.isoformat(), end_date.isoformat()
+    # Unlocked rows of the horizon get regenerated: no month may see the old ones of a later month
+    regenerate = run_kwargs.get('phases') is None
+    db = dict(db, service_config=dict(db['service_config']),
+              schedule=[s for s in db['schedule'] if not regenerate or s.get('manually_locked') or not start_str <= str(s['date']) <= end_str])
+
+    rows, logs, months = [], [], []
+    res_meta = None
+    for first, last in month_spans(start_date, end_date):
+        first_str, last_str = first.isoformat(), last.isoformat()
+        month_rows, res_meta = runner(db, first, last, **run_kwargs)
+        month_rows = [s for s in month_rows if first_str <= s['date'] <= last_str]
+
+        db['schedule'] = [s for s in db['schedule'] if not first_str <= str(s['date']) <= last_str] + month_rows
+        db['service_config']['rotation_queues'] = res_meta['rotation_queues']
+        db['service_config']['next_round_queues'] = res_meta['next_round_queues']
+        rows += month_rows
+        logs += res_meta['logs']
+        months.append({'month': first_str[:7], 'seed': res_meta['seed'], 'stopped': res_meta.get('stopped'),
+                       'unfilled_slots': res_meta['metrics']['unfilled_slots'], 'total_ms': res_meta['metrics']['total_ms']})
+
+        if checkpoint: checkpoint(first, last, month_rows, res_meta)
+        if res_meta.get('stopped'): break
+
+    return rows, dict(res_meta, logs=logs, months=months)
+
+# ==========================================
+# 10. SEASON SIMULATION (IN MEMORY)
+# ==========================================
+# Balance-report fields whose spread over employees the simulation tracks
+SIMULATION_REPORT_KEYS = ('effective_total', 'sk_score', 'special_normal', 'special_offbalance')
+
+def synthetic_unavailability(employee_ids, start_date, end_date, rate, rng):
+    """Random days off: every employee-day in [start_date, end_date] with probability `rate`."""
+    out = []
+    for day in range(start_date.toordinal(), end_date.toordinal() + 1):
+        for eid in employee_ids:
+            if rng.random() < rate: out.append({'employee_id': eid, 'date': day_str(day)})
+    return out
+
+def simulate_season(db, start_date, months, unavailability_rate=0.0, seed=None, **run_kwargs):
+    """
+    Forecast of the next `months` months from start_date under the current
+    staff, duties and special dates: run_scheduler_months on a copy of db, so
+    nothing is stored and the state is loaded once. unavailability_rate adds
+    random days off on top of the known ones (seeded by `seed`, which also
+    seeds every month's run).
+
+    Returns {'months': [...], 'balance': [...], 'rotation_queues', 'next_round_queues'}.
+    Every month has its run summary, the engine's final spreads per score
+    dimension ('spreads', see SCORE_DIMENSIONS) and the spread of each
+    SIMULATION_REPORT_KEYS field over the simulated months so far
+    ('cumulative'); 'balance' is the balance report over the whole simulation.
+    """
+    db = copy.deepcopy(db)
+    end_date = start_date + relativedelta(months=months) - timedelta(days=1)
+    employees = [{'id': int(e['id']), 'name': e['name']} for e in db['employees']]
+    if unavailability_rate:
+        db['unavailability'] = db['unavailability'] + synthetic_unavailability(
+            [e['id'] for e in employees], start_date, end_date, unavailability_rate, random.Random(seed))
+
+    duties = db['service_config']['duties']
+    special_dates = set(db['service_config'].get('special_dates', []))
+    report = balance_stats_matrix if np is not None else balance_stats
+    first_month = start_date.strftime('%Y-%m')
+    simulated, trajectory = [], []
+
+    def record(first, last, rows, res_meta):
+        simulated.extend(rows)
+        stats = report(employees, duties, simulated, special_dates, first_month, first.strftime('%Y-%m'))
+        trajectory.append({'month': first.strftime('%Y-%m'), 'seed': res_meta['seed'], 'stopped': res_meta.get('stopped'),
+                           'unfilled_slots': res_meta['metrics']['unfilled_slots'],
+                           'swaps_performed': res_meta['metrics']['swaps_performed'],
+                           'total_ms': res_meta['metrics']['total_ms'],
+                           'spreads': portfolio_score(res_meta)[1],
+                           'cumulative': {k: max(s[k] for s in stats) - min(s[k] for s in stats) if stats else 0
+                                          for k in SIMULATION_REPORT_KEYS}})
+
+    run_kwargs.setdefault('log_level', 'summary')
+    run_kwargs.setdefault('log_flush', False)
+    _, res_meta = run_scheduler_months(db, start_date, end_date, checkpoint=record, seed=seed, **run_kwargs)
+    stats = report(employees, duties, simulated, special_dates, first_month, end_date.strftime('%Y-%m'))
+    balance = [dict(id=e['id'], **{k: s[k] for k in ('name', 'total') + SIMULATION_REPORT_KEYS}) for e, s in zip(employees, stats)]
+    return {'months': trajectory, 'balance': balance,
+            'rotation_queues': res_meta['rotation_queues'], 'next_round_queues': res_meta['next_round_queues']}
+
+# ==========================================
+# 11. INPUT FINGERPRINT (RESULT CACHE)
+# ==========================================
+# Run options that only bound or interrupt a run; a run they stopped early is not worth caching
+FINGERPRINT_IGNORED_OPTIONS = ('deadline', 'cancel_token', 'log_flush', 'time_budget')
+
+def input_fingerprint(db, start_date, end_date, **run_options):
+    """
+    Stable sha256 hex digest of what a run of [start_date, end_date] reads: employees
+    (in queue order), duty config, special dates, preferences, starting queues,
+    unavailability from the day before to the day after the period, the stored rows
+    it keeps (locked rows of the period, all of them for a `phases` touch-up, every
+    row outside it) and the run options, seed included. Equal digests give equal runs.
+    """
+    start_day, end_day = start_date.toordinal(), end_date.toordinal()
+    keep_schedule = run_options.get('phases') is not None
+    rows = []
+    for s in db['schedule']:
+        day = to_day(s['date'])
+        if start_day <= day <= end_day and not (keep_schedule or s.get('manually_locked')): continue
+        rows.append((day, int(s['duty_id']), int(s.get('shift_index') or 0),
+                     None if s.get('employee_id') is None else int(s['employee_id']), bool(s.get('manually_locked'))))
+    unavailability = sorted({(int(u['employee_id']), to_day(u['date'])) for u in db['unavailability']
+                             if start_day - 1 <= to_day(u['date']) <= end_day + 1})
+    config = db['service_config']
+    payload = {
+        'period': [start_day, end_day],
+        'employees': [[int(e['id']), e['name'], e.get('surname') or '', e.get('real_name') or e['name']] for e in db['employees']],
+        # DutyCatalog fills in shift defaults in place: hash them filled in, whether or not a run already did
+        'duties': DutyCatalog(copy.deepcopy(config['duties'])).duties,
+        'special_dates': sorted(str(d) for d in config.get('special_dates', [])),
+        'preferences': sorted([str(k), bool(v)] for k, v in db.get('preferences', {}).items()),
+        'rotation_queues': config['rotation_queues'],
+        'next_round_queues': config['next_round_queues'],
+        'unavailability': unavailability,
+        'schedule': sorted(rows, key=lambda r: (r[0], r[1], r[2], -1 if r[3] is None else r[3], r[4])),
+        'options': {k: v for k, v in run_options.items() if k not in FINGERPRINT_IGNORED_OPTIONS},
+    }
+    blob = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
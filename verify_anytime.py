@@ -0,0 +1,31 @@
+import unittest
+import copy
+import time
+from datetime import date
+
+import app
+import scheduler_logic
+from verify_scheduler_cache import SchedulerRouteTestCase, make_state
+
+# A run whose deadline has already passed stops at its first check: the engine reports it,
+# the route returns the month unsaved and does not cache it.
+
+class TestPastDeadline(SchedulerRouteTestCase):
+    def test_engine_reports_deadline(self):
+        rows, meta = scheduler_logic.run_auto_scheduler_logic(copy.deepcopy(make_state()), date(2024, 3, 1), date(2024, 3, 31),
+                                                              log_level='summary', log_flush=False, seed=1, deadline=time.monotonic() - 1)
+        self.assertEqual(meta['stopped'], 'deadline')
+        self.assertTrue(meta['cut_short'])
+        self.assertLess(len(rows), 31 * 2)
+
+    def test_route_does_not_save_or_cache(self):
+        res = self.run_scheduler(time_limit=1e-6, seed=1)
+
+        self.assertEqual(res['stopped'], 'deadline')
+        self.assertTrue(res['cut_short'])
+        self.assertEqual(res['months'][0]['stopped'], 'deadline')
+        self.save.assert_not_called()
+        self.assertEqual(len(app.SCHEDULER_CACHE), 0)
+
+if __name__ == '__main__':
+    unittest.main()
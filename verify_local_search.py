@@ -0,0 +1,65 @@
+import unittest
+import contextlib
+import io
+from datetime import date
+
+import scheduler_logic
+from bench_scheduler import build_db
+
+# Phase 9 (local search) on the synthetic benchmark data: every row it moves must stay a valid
+# placement, and no score dimension may end with a wider spread than it had before the pass.
+
+def spreads(run):
+    return {dim: ledger.scores[ledger.highest()] - ledger.scores[ledger.lowest()] if ledger.scores else 0
+            for dim, ledger in run.dimension_ledgers.items()}
+
+class TestLocalSearch(unittest.TestCase):
+    def run_pass(self, seed, daily_assign):
+        run = scheduler_logic.SchedulerRun(build_db(), date(2024, 3, 1), date(2024, 3, 31), log_level='summary', log_flush=False,
+                                           seed=seed, optimize_budget=1, optimize_max_moves=3000, daily_assign=daily_assign)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for name, stage in scheduler_logic.SCHEDULER_STAGES.items():
+                if name != 'local_search': stage(run)
+            # The ledgers Phase 9 adds for itself, so the spreads before the pass cover every dimension
+            catalog = run.catalog
+            run.dimension_ledgers.setdefault('normal', run.get_balance_ledger(catalog.normal_ids))
+            run.dimension_ledgers.setdefault('off_balance', run.get_balance_ledger(catalog.off_balance_scored_ids))
+            before = {id(r): r['employee_id'] for r in run.schedule}
+            spreads_before = spreads(run)
+            scheduler_logic.stage_local_search(run)
+        moved = [r for r in run.schedule if r['employee_id'] != before[id(r)]]
+        return run, moved, spreads_before
+
+    def test_moves_stay_valid(self):
+        for seed in (1, 2):
+            for daily_assign in scheduler_logic.DAILY_ASSIGNERS:
+                with self.subTest(seed=seed, daily_assign=daily_assign):
+                    run, moved, spreads_before = self.run_pass(seed, daily_assign)
+                    catalog = run.catalog
+                    self.assertTrue(moved)
+
+                    def is_within_hours(r):
+                        return catalog.conf(r['duty_id'], r.get('shift_index', 0)).get('is_within_hours')
+                    def is_normal(r):
+                        return r['duty_id'] in catalog.normal_ids and not is_within_hours(r)
+                    def is_off_daily(r):
+                        return r['duty_id'] in catalog.off_balance_ids and r['duty_id'] not in catalog.weekly_ids and not is_within_hours(r)
+
+                    by_emp = {}
+                    for r in run.schedule: by_emp.setdefault(r['employee_id'], []).append(r)
+                    for r in moved:
+                        eid, day = r['employee_id'], r['day']
+                        self.assertNotIn((eid, day), run.unavail_map)
+                        self.assertNotIn(eid, catalog.excluded_for(r['duty_id'], r.get('shift_index', 0)))
+                        near = [o for o in by_emp[eid] if o is not r and abs(o['day'] - day) <= 1]
+                        self.assertFalse([o for o in near if o['day'] == day], f"double booking on {day}")
+                        # Normal and daily off-balance rows keep a day of rest between each other
+                        if is_normal(r): self.assertFalse([o for o in near if is_off_daily(o)])
+                        if is_off_daily(r): self.assertFalse([o for o in near if is_normal(o)])
+
+                    spreads_after = spreads(run)
+                    for dim, spread in spreads_before.items():
+                        self.assertLessEqual(spreads_after[dim], spread, dim)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import contextlib
+import copy
+import io
+from datetime import date
+
+import scheduler_logic
+from bench_scheduler import build_db
+
+# repair_schedule on a generated month of the benchmark data: only the released employee's rows
+# on the new unavailable days and the shifts handed back to them within `radius` may change,
+# and the repaired month must stay valid.
+RADIUS = 7
+
+def published_month(seed):
+    db = build_db()
+    with contextlib.redirect_stdout(io.StringIO()):
+        rows, meta = scheduler_logic.run_auto_scheduler_logic(copy.deepcopy(db), date(2024, 3, 1), date(2024, 3, 31),
+                                                              log_level='summary', log_flush=False, seed=seed)
+    db['schedule'] = [s for s in db['schedule'] if s['date'] < '2024-03-01'] + rows
+    db['service_config']['rotation_queues'] = meta['rotation_queues']
+    db['service_config']['next_round_queues'] = meta['next_round_queues']
+    return db, rows
+
+class TestRepairSchedule(unittest.TestCase):
+    def test_changes_stay_local_and_valid(self):
+        db, rows = published_month(1)
+        catalog = scheduler_logic.DutyCatalog(db['service_config']['duties'])
+        unavailable = {(int(u['employee_id']), u['date']) for u in db['unavailability']}
+
+        def is_normal(duty_id, sh_idx):
+            return duty_id in catalog.normal_ids and duty_id not in catalog.weekly_ids
+        def is_off_daily(duty_id, sh_idx):
+            return duty_id in catalog.off_balance_ids and duty_id not in catalog.weekly_ids and \
+                not catalog.conf(duty_id, sh_idx).get('is_within_hours')
+
+        for eid in (3, 9, 17, 25):
+            with self.subTest(employee=eid):
+                changes = [(eid, s['date']) for s in rows if s['employee_id'] == eid][:3]
+                with contextlib.redirect_stdout(io.StringIO()):
+                    diff, _ = scheduler_logic.repair_schedule(copy.deepcopy(db), date(2024, 3, 1), date(2024, 3, 31), changes,
+                                                              radius=RADIUS, log_level='summary', log_flush=False)
+                self.assertTrue(diff)
+
+                released = {(s['date'], s['employee_id']) for s in diff if s['previous_employee_id'] == eid}
+                self.assertEqual({d for d, _ in released}, {d for _, d in changes})
+                for s in diff:
+                    if s['previous_employee_id'] == eid: continue
+                    # A hand-back: one of the replacements gives the released employee a shift near the day they took
+                    self.assertEqual(s['employee_id'], eid)
+                    self.assertTrue(any(taker == s['previous_employee_id'] and
+                                        abs(scheduler_logic.to_day(s['date']) - scheduler_logic.to_day(d)) <= RADIUS
+                                        for d, taker in released), s)
+
+                repaired = {(s['date'], s['duty_id'], s['shift_index']): s['employee_id'] for s in rows}
+                for s in diff: repaired[(s['date'], s['duty_id'], s['shift_index'])] = s['employee_id']
+                by_emp = {}
+                for (day, duty_id, sh_idx), holder in repaired.items():
+                    by_emp.setdefault(holder, []).append((scheduler_logic.to_day(day), duty_id, sh_idx))
+                for s in diff:
+                    holder = s['employee_id']
+                    if holder is None: continue
+                    self.assertNotIn((holder, s['date']), unavailable | set(changes))
+                    self.assertNotIn(holder, catalog.excluded_for(s['duty_id'], s['shift_index']))
+                    day = scheduler_logic.to_day(s['date'])
+                    near = [o for o in by_emp[holder] if abs(o[0] - day) <= 1 and o != (day, s['duty_id'], s['shift_index'])]
+                    self.assertFalse([o for o in near if o[0] == day], f"double booking: {s}")
+                    # Normal rows keep a day of rest from the holder's other normal and daily off-balance rows
+                    if is_normal(s['duty_id'], s['shift_index']):
+                        self.assertFalse([o for o in near if is_normal(*o[1:]) or is_off_daily(*o[1:])], f"no rest: {s}")
+                    if is_off_daily(s['duty_id'], s['shift_index']):
+                        self.assertFalse([o for o in near if is_normal(*o[1:])], f"no rest: {s}")
+
+if __name__ == '__main__':
+    unittest.main()
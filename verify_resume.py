@@ -0,0 +1,63 @@
+import unittest
+import contextlib
+import copy
+import io
+from datetime import date
+
+import scheduler_logic
+from bench_scheduler import build_db
+
+# run_scheduler_months with per-month checkpoints: a run that fails after its first month and is
+# resumed from the stored state (the route's `resume`) must end with the same rows and queues as
+# an uninterrupted run with the same seed.
+START, END = date(2024, 3, 1), date(2024, 5, 31)
+
+class Crash(Exception):
+    pass
+
+def stored_state():
+    # Published rows up to the end of the horizon (regenerated by the run), a few of them locked
+    db = build_db(history_end=END)
+    for s in db['schedule'][-200::20]: s['manually_locked'] = True
+    return db
+
+def store_month(store):
+    # What save_scheduler_month does to the DB, on an in-memory copy of the state
+    def checkpoint(first, last, rows, res_meta):
+        first_str, last_str = first.isoformat(), last.isoformat()
+        store['schedule'] = [s for s in store['schedule'] if s.get('manually_locked') or not first_str <= s['date'] <= last_str] + \
+            [s for s in rows if not s.get('manually_locked')]
+        store['service_config']['rotation_queues'] = res_meta['rotation_queues']
+        store['service_config']['next_round_queues'] = res_meta['next_round_queues']
+        store['completed'] = first
+    return checkpoint
+
+def run_months(db, start, end, checkpoint):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return scheduler_logic.run_scheduler_months(copy.deepcopy(db), start, end, checkpoint=checkpoint,
+                                                    log_level='summary', log_flush=False, seed=5)
+
+def month_rows(store):
+    return sorted((s['date'], s['duty_id'], s['shift_index'], s['employee_id']) for s in store['schedule'] if str(s['date']) >= START.isoformat())
+
+class TestResume(unittest.TestCase):
+    def test_resumed_run_matches_uninterrupted(self):
+        full = stored_state()
+        run_months(full, START, END, store_month(full))
+
+        resumed = stored_state()
+        save = store_month(resumed)
+        def crash_after_first(first, last, rows, res_meta):
+            save(first, last, rows, res_meta)
+            raise Crash()
+        with self.assertRaises(Crash):
+            run_months(resumed, START, END, crash_after_first)
+        self.assertEqual(resumed['completed'], START)
+        run_months(resumed, date(2024, 4, 1), END, save)
+
+        self.assertEqual(month_rows(resumed), month_rows(full))
+        self.assertEqual(resumed['service_config']['rotation_queues'], full['service_config']['rotation_queues'])
+        self.assertEqual(resumed['service_config']['next_round_queues'], full['service_config']['next_round_queues'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import unittest
+import copy
+import datetime
+from unittest import mock
+
+import app
+import scheduler_logic
+
+# Route-level checks of the run_scheduler result cache: the DB is replaced by a fixed
+# scheduler state and a mocked connection, the engine itself runs for real.
+TOKEN = 'verify-scheduler-cache'
+
+def make_state():
+    employees = [{'id': i, 'name': f'Emp{i}'} for i in range(1, 7)]
+    duties = [
+        {
+            'id': 101,
+            'name': 'Duty Normal',
+            'shifts_per_day': 1,
+            'shift_config': [{'id': 1, 'is_within_hours': False}],
+            'is_weekly': False,
+            'is_special': False,
+            'is_off_balance': False,
+            'active_range': {'start': '2023-01-01', 'end': '2030-12-31'}
+        },
+        {
+            'id': 102,
+            'name': 'Duty Off',
+            'shifts_per_day': 1,
+            'shift_config': [{'id': 1, 'is_within_hours': False}],
+            'is_weekly': False,
+            'is_special': False,
+            'is_off_balance': True,
+            'active_range': {'start': '2023-01-01', 'end': '2030-12-31'}
+        }
+    ]
+    return {
+        'employees': employees,
+        'service_config': {'duties': duties, 'special_dates': ['2024-03-25'], 'rotation_queues': {}, 'next_round_queues': {}},
+        'schedule': [],
+        'unavailability': [{'employee_id': 2, 'date': '2024-03-12'}],
+        'preferences': {}
+    }
+
+class SchedulerRouteTestCase(unittest.TestCase):
+    # Fixed state, mocked connection and month store, real engine (also used by verify_anytime.py)
+    def setUp(self):
+        app.SCHEDULER_CACHE.clear()
+        app.TOKEN_CACHE[TOKEN] = {'auth_id': 'verify', 'db_user': {'id': 1, 'role': 'admin', 'auth_id': 'verify'},
+                                  'expires': datetime.datetime.now().timestamp() + 3600}
+        self.client = app.app.test_client()
+        self.engine = mock.Mock(wraps=scheduler_logic.run_auto_scheduler_logic)
+        self.save = mock.Mock()
+        patches = [
+            mock.patch.object(scheduler_logic, 'load_state_for_scheduler', side_effect=lambda *a, **kw: copy.deepcopy(make_state())),
+            mock.patch.object(scheduler_logic, 'run_auto_scheduler_logic', self.engine),
+            mock.patch.object(app, 'get_db', return_value=mock.MagicMock()),
+            mock.patch.object(app, 'save_scheduler_month', self.save),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.addCleanup(app.TOKEN_CACHE.pop, TOKEN, None)
+        self.addCleanup(app.SCHEDULER_CACHE.clear)
+
+    def run_scheduler(self, **body):
+        res = self.client.post('/api/services/run_scheduler', json=dict({'start': '2024-03', 'end': '2024-03', 'log_level': 'summary'}, **body),
+                               headers={'Authorization': f'Bearer {TOKEN}'})
+        self.assertEqual(res.status_code, 200, res.get_json())
+        return res.get_json()
+
+class TestSchedulerRouteCache(SchedulerRouteTestCase):
+    def test_repeated_unseeded_request_is_cached(self):
+        first = self.run_scheduler()
+        second = self.run_scheduler()
+
+        self.assertEqual(first['cached_months'], [])
+        self.assertEqual(second['cached_months'], ['2024-03'])
+        self.assertEqual(self.engine.call_count, 1)
+        # The cached month replays the first run: same seed, same rows stored
+        self.assertEqual(second['seed'], first['seed'])
+        self.assertEqual(self.save.call_count, 2)
+        self.assertEqual(self.save.call_args_list[0][0][3], self.save.call_args_list[1][0][3])
+
+    def test_seeded_request_does_not_reuse_unseeded_entry(self):
+        first = self.run_scheduler()
+        seeded = self.run_scheduler(seed=first['seed'] + 1)
+
+        self.assertEqual(seeded['cached_months'], [])
+        self.assertEqual(seeded['seed'], first['seed'] + 1)
+        self.assertEqual(self.engine.call_count, 2)
+
+    def test_repeated_multi_month_request_is_cached(self):
+        # Duty 102 comes without shift defaults: the first run fills them in, a cached month does not
+        def state():
+            st = make_state()
+            del st['service_config']['duties'][1]['shifts_per_day'], st['service_config']['duties'][1]['shift_config']
+            return st
+        with mock.patch.object(scheduler_logic, 'load_state_for_scheduler', side_effect=lambda *a, **kw: state()):
+            first = self.run_scheduler(end='2024-04', seed=3)
+            second = self.run_scheduler(end='2024-04', seed=3)
+
+        self.assertEqual(first['cached_months'], [])
+        self.assertEqual(second['cached_months'], ['2024-03', '2024-04'])
+        self.assertEqual(self.engine.call_count, 2)
+
+class TestInputFingerprint(unittest.TestCase):
+    def key(self, state):
+        return scheduler_logic.input_fingerprint(state, datetime.date(2024, 3, 1), datetime.date(2024, 3, 31), seed=1)
+
+    def test_run_inputs_change_the_key(self):
+        base = self.key(make_state())
+        changes = {
+            'duty': lambda st: st['service_config']['duties'][0].update(is_weekly=True),
+            'shift': lambda st: st['service_config']['duties'][0]['shift_config'][0].update(is_within_hours=True),
+            'unavailability': lambda st: st['unavailability'].append({'employee_id': 3, 'date': '2024-03-20'}),
+            'special date': lambda st: st['service_config']['special_dates'].append('2024-03-26'),
+        }
+        for name, change in changes.items():
+            with self.subTest(change=name):
+                st = make_state()
+                change(st)
+                self.assertNotEqual(self.key(st), base)
+
+    def test_unavailability_outside_the_period_is_ignored(self):
+        st = make_state()
+        st['unavailability'].append({'employee_id': 3, 'date': '2024-05-20'})
+        self.assertEqual(self.key(st), self.key(make_state()))
+
+    def test_duty_defaults_filled_by_a_run_keep_the_key(self):
+        pristine = make_state()
+        del pristine['service_config']['duties'][1]['shift_config']
+        ran = copy.deepcopy(pristine)
+        scheduler_logic.DutyCatalog(ran['service_config']['duties'])
+
+        self.assertNotEqual(ran['service_config']['duties'], pristine['service_config']['duties'])
+        self.assertEqual(self.key(ran), self.key(pristine))
+        self.assertIsNone(pristine['service_config']['duties'][1].get('shift_config'))
+
+if __name__ == '__main__':
+    unittest.main()